@@ -0,0 +1,184 @@
+import gzip
+import orjson
+from flask import Blueprint, Response, current_app, g, request, session, url_for
+from werkzeug.exceptions import BadRequest, HTTPException, NotFound, Unauthorized, UnsupportedMediaType
+from .cart import cart_product_ids
+from .http_cache import add_validators, make_etag, not_modified
+from .product_cache import get_product, get_products
+from .purchases import COMPLETED, find_purchase, get_purchase_status, parse_idempotency_key, submit_purchase
+from .queries import decode_transaction_cursor, fetch_product_page, fetch_transaction_page, page_last_modified
+from .replicas import read_only
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+_PRODUCT_FIELDS = ('id', 'name', 'price')
+_TRANSACTION_FIELDS = ('id', 'created', 'product_name', 'product_price')
+
+def _json(data, status=200):
+    return Response(orjson.dumps(data), status=status, mimetype='application/json')
+
+# ORM オブジェクトではなく、行のタプルから必要な項目だけを取り出す
+def _project(rows, fields):
+    return [dict(zip(fields, (getattr(row, field) for field in fields))) for row in rows]
+
+def _json_body():
+    # JSON 以外はフォームからのクロスサイトリクエストの可能性があるため受け付けない
+    if not request.is_json:
+        raise UnsupportedMediaType('Request body must be JSON.')
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise BadRequest('Request body must be a JSON object.')
+    return data
+
+@bp.before_request
+def require_user():
+    if not g.user:
+        raise Unauthorized
+
+def handle_http_exception(e):
+    response = _json({'error': e.name, 'message': e.description}, status=e.code)
+    # 429 の Retry-After など、例外が持つヘッダーを引き継ぐ
+    for name, value in e.get_headers():
+        if name != 'Content-Type':
+            response.headers[name] = value
+    return response
+
+# アプリ全体のエラーハンドラはステータスコードごとに登録されているため、API でもコードごとに上書きする
+bp.register_error_handler(HTTPException, handle_http_exception)
+for code in (400, 401, 403, 404, 405, 415, 429, 500, 503):
+    bp.register_error_handler(code, handle_http_exception)
+
+@bp.after_request
+def compress(response):
+    min_size = current_app.config['API_COMPRESS_MIN_SIZE']
+    if (
+        response.direct_passthrough
+        or response.status_code == 304
+        or 'Content-Encoding' in response.headers
+        or response.content_length is None
+        or response.content_length < min_size
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encodings = request.accept_encodings
+    if brotli is not None and encodings['br']:
+        response.set_data(brotli.compress(response.get_data(), quality=4))
+        response.headers['Content-Encoding'] = 'br'
+    elif encodings['gzip']:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@bp.get("/products")
+@read_only
+def products():
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+
+    page = fetch_product_page(after=after, before=before, per_page=current_app.config['PRODUCTS_PER_PAGE'])
+    updated = page_last_modified(page)
+    etag = make_etag('api.products', [(row.id, row.updated) for row in page.items], page.prev_cursor, page.next_cursor)
+    response = not_modified(etag, updated)
+    if response:
+        return response
+
+    response = _json({
+        'items': _project(page.items, _PRODUCT_FIELDS),
+        'prev_cursor': page.prev_cursor,
+        'next_cursor': page.next_cursor,
+    })
+    return add_validators(response, etag, updated)
+
+@bp.get("/products/<int:product_id>")
+@read_only
+def product(product_id):
+    product = get_product(product_id)
+    if product is None:
+        raise NotFound
+
+    in_cart = str(product_id) in session.get('cart', ())
+    etag = make_etag('api.product', product.id, product.updated, in_cart)
+    response = not_modified(etag, product.updated)
+    if response:
+        return response
+
+    response = _json({**_project([product], _PRODUCT_FIELDS)[0], 'in_cart': in_cart})
+    return add_validators(response, etag, product.updated)
+
+@bp.get("/cart")
+@read_only
+def cart():
+    return _json({'items': _project(get_products(cart_product_ids()), _PRODUCT_FIELDS)})
+
+@bp.post("/cart")
+def add_cart():
+    product_id = _json_body().get('product_id')
+    if not isinstance(product_id, int):
+        raise BadRequest('product_id must be an integer.')
+    if get_product(product_id) is None:
+        raise NotFound
+
+    session.setdefault('cart', set()).add(str(product_id))
+    session.modified = True
+    return _json({'items': _project(get_products(cart_product_ids()), _PRODUCT_FIELDS)}, status=201)
+
+@bp.delete("/cart/<int:product_id>")
+def remove_cart(product_id):
+    if 'cart' in session:
+        session['cart'].discard(str(product_id))
+        session.modified = True
+    return Response(status=204)
+
+def _purchase_json(result, status):
+    data = {'id': result.id, 'status': result.status}
+    if result.id is not None:
+        data['status_url'] = url_for('api.purchase_status', request_id=result.id)
+    if result.status == COMPLETED:
+        data['items'] = _project(get_products(result.product_ids), _PRODUCT_FIELDS)
+    return _json(data, status=status)
+
+# Idempotency-Key ヘッダーを付けると、再送しても同じ結果を返す
+@bp.post("/checkout")
+def checkout():
+    _json_body()
+    key = parse_idempotency_key(request.headers.get('Idempotency-Key'))
+    result = find_purchase(g.user.id, key)
+    if result is not None:
+        return _purchase_json(result, status=200)
+
+    products = get_products(cart_product_ids())
+    if not products:
+        raise BadRequest('Cart is empty.')
+
+    result = submit_purchase(g.user.id, products, key)
+    session.pop('cart', None)
+    return _purchase_json(result, status=201 if result.status == COMPLETED else 202)
+
+@bp.get("/purchases/<int:request_id>")
+def purchase_status(request_id):
+    result = get_purchase_status(g.user.id, request_id)
+    if result is None:
+        raise NotFound
+    return _purchase_json(result, status=200)
+
+@bp.get("/transactions")
+@read_only
+def transactions():
+    before = None
+    if 'before' in request.args:
+        try:
+            before = decode_transaction_cursor(request.args['before'])
+        except ValueError as e:
+            raise BadRequest('Invalid cursor.') from e
+
+    page = fetch_transaction_page(g.user.id, before=before, per_page=current_app.config['TRANSACTIONS_PER_PAGE'])
+    return _json({
+        'items': _project(page.items, _TRANSACTION_FIELDS),
+        'next_cursor': page.next_cursor,
+    })
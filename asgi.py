@@ -0,0 +1,89 @@
+# データベースの待ち時間が長いページだけを非同期のビューで処理し、それ以外は Flask のアプリにそのまま渡す。
+# 起動するアプリは main_asgi.py で作る
+#
+#   $ uvicorn main_asgi:app
+import io
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import current_app, g, redirect, url_for
+from flask.ctx import RequestContext
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from . import async_db
+from .views import product_cursors, products_response, transaction_cursor, transactions_response
+
+async def products():
+    if not g.user:
+        return redirect(url_for('views.sign_in'))
+
+    after, before = product_cursors()
+    page = await async_db.fetch_product_page(
+        current_app, after=after, before=before, per_page=current_app.config['PRODUCTS_PER_PAGE'],
+    )
+    return products_response(page)
+
+async def transactions():
+    if not g.user:
+        return redirect(url_for('views.sign_in'))
+
+    page = await async_db.fetch_transaction_page(
+        current_app, g.user.id, before=transaction_cursor(), per_page=current_app.config['TRANSACTIONS_PER_PAGE'],
+    )
+    return transactions_response(page)
+
+def _to_asgi_response(response):
+    result = Response(response.get_data(), status_code=response.status_code)
+    result.raw_headers = [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in response.headers.items()]
+    return result
+
+# Flask のリクエストコンテキストの中で非同期のビューを呼び出し、before_request や after_request、エラーハンドラは Flask のものを使う
+async def _dispatch(flask_app, request, view):
+    environ = build_environ(request.scope, io.BytesIO())
+    flask_request = flask_app.request_class(environ)
+    # セッションを先に読み込んで渡しておくと、push したときに同期のストアから読み込まれない
+    session = await async_db.open_session(flask_app, flask_request)
+    ctx = RequestContext(flask_app, environ, request=flask_request, session=session)
+    ctx.push()
+    try:
+        try:
+            try:
+                await async_db.load_current_user(flask_app, session)
+                # before_request の関数は同期のデータベースアクセスを含みうるため、イベントループを止めないようスレッドプールで行う
+                rv = await run_in_threadpool(flask_app.preprocess_request)
+                if rv is None:
+                    rv = await view()
+            except Exception as e:
+                rv = flask_app.handle_user_exception(e)
+            response = flask_app.make_response(rv)
+            # セッションの保存はデータベースに書き込むことがあるため、スレッドプールで行う
+            response = await run_in_threadpool(flask_app.process_response, response)
+        except Exception as e:
+            response = flask_app.handle_exception(e)
+        return _to_asgi_response(response)
+    finally:
+        ctx.pop()
+
+def create_asgi_app(flask_app):
+    async_db.init_app(flask_app)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await flask_app.extensions['async_engine'].dispose()
+
+    def route(path, view):
+        async def endpoint(request):
+            return await _dispatch(flask_app, request, view)
+        return Route(path, endpoint, methods=['GET'])
+
+    return Starlette(
+        routes=[
+            route('/products', products),
+            route('/transactions', transactions),
+            Mount('/', app=WSGIMiddleware(flask_app)),
+        ],
+        lifespan=lifespan,
+    )
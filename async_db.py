@@ -0,0 +1,105 @@
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from .auth import CurrentUser
+from .models import StoredSession, User
+from .queries import product_page, select_product_page, select_transaction_page, transaction_page
+from .sessions import CachedSessionStore, SQLAlchemySessionStore, _utcnow, serializer
+
+_ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+# 同期のエンジンと同じデータベースに、非同期のドライバーで接続する
+def async_database_uri(uri):
+    url = make_url(uri)
+    return url.set(drivername=_ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+def engine_options(options):
+    options = dict(options)
+    poolclass = options.pop('poolclass', None)
+
+    # PgBouncer (transaction モード) ではプリペアドステートメントを使い回せないため、キャッシュを無効にする
+    if poolclass is not None and issubclass(poolclass, NullPool):
+        options['poolclass'] = NullPool
+        options['connect_args'] = {'statement_cache_size': 0, 'prepared_statement_cache_size': 0}
+    return options
+
+def init_app(app):
+    app.config.setdefault('ASYNC_DATABASE_URI', None)
+    uri = app.config['ASYNC_DATABASE_URI'] or async_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    engine = create_async_engine(uri, **engine_options(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})))
+    app.extensions['async_engine'] = engine
+    app.extensions['async_session'] = async_sessionmaker(engine, expire_on_commit=False)
+
+def session(app):
+    return app.extensions['async_session']()
+
+async def fetch_product_page(app, after=None, before=None, per_page=20):
+    async with session(app) as s:
+        rows = (await s.execute(select_product_page(after=after, before=before, per_page=per_page))).all()
+    return product_page(rows, after=after, before=before, per_page=per_page)
+
+async def fetch_transaction_page(app, user_id, before=None, per_page=20):
+    async with session(app) as s:
+        rows = (await s.execute(select_transaction_page(user_id, before=before, per_page=per_page))).all()
+    return transaction_page(rows, per_page=per_page)
+
+async def _load_session_data(app, store, sid, version):
+    if isinstance(store, CachedSessionStore):
+        if version is None:
+            return await _load_session_data(app, store.store, sid, version)
+        data = store.cache.get((sid, version))
+        if data is None:
+            data = await _load_session_data(app, store.store, sid, version)
+            if data is not None:
+                store.cache.set((sid, version), data)
+        return data
+
+    if isinstance(store, SQLAlchemySessionStore):
+        stmt = select(StoredSession.data).where(StoredSession.id == sid, StoredSession.expires > _utcnow())
+        async with session(app) as s:
+            return (await s.execute(stmt)).scalar_one_or_none()
+
+    # メモリ上のストアはそのまま読み出す
+    return store.get(sid, version)
+
+# ServerSideSessionInterface.open_session と同じ処理を、データベースへの問い合わせだけ非同期にして行う
+async def open_session(app, request):
+    interface = app.session_interface
+    value = request.cookies.get(interface.get_cookie_name(app))
+    if value and value.startswith(interface.signed_prefix):
+        return interface.open_signed_session(app, value)
+
+    sid, version = interface.parse_cookie(value)
+
+    if sid:
+        data = await _load_session_data(app, interface.store, sid, version)
+        if data is not None:
+            return interface.session_class(serializer.loads(data), sid=sid, version=version)
+
+    return interface.session_class(sid=interface.generate_sid(), new=True)
+
+# ユーザー情報をキャッシュに読み込んでおき、auth.load_current_user がデータベースに問い合わせずに済むようにする
+async def load_current_user(app, flask_session):
+    if 'email' not in flask_session:
+        return
+
+    cache = app.extensions['user_cache']
+    user_id = flask_session.get('user_id')
+    user = cache.get(user_id) if user_id is not None else None
+    if user is not None and user.email == flask_session['email']:
+        return
+
+    stmt = select(User.id, User.name, User.email).filter_by(email=flask_session['email'])
+    async with session(app) as s:
+        row = (await s.execute(stmt)).one_or_none()
+    if row is None:
+        flask_session.pop('email', None)
+        flask_session.pop('user_id', None)
+        return
+
+    user = CurrentUser(*row)
+    cache.set(user.id, user)
+    if user_id != user.id:
+        flask_session['user_id'] = user.id
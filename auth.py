@@ -0,0 +1,75 @@
+from collections import namedtuple
+from flask import current_app, g, has_app_context, session
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from . import db
+from .cache import LRUCache
+from .models import User
+from .sessions import regenerate_session
+
+# ビューやテンプレートで使うだけの軽量なユーザー情報
+CurrentUser = namedtuple('CurrentUser', ['id', 'name', 'email'])
+
+def init_app(app):
+    app.config.setdefault('USER_CACHE_SIZE', 10000)
+    app.config.setdefault('USER_CACHE_TTL', 60)
+    app.extensions['user_cache'] = LRUCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+    app.before_request(load_current_user)
+
+def _fetch_user(**filters):
+    row = db.session.execute(db.select(User.id, User.name, User.email).filter_by(**filters)).one_or_none()
+    return CurrentUser(*row) if row is not None else None
+
+def load_current_user():
+    g.user = None
+
+    if 'email' not in session:
+        return
+
+    cache = current_app.extensions['user_cache']
+    user_id = session.get('user_id')
+    user = cache.get(user_id) if user_id is not None else None
+
+    if user is None or user.email != session['email']:
+        if user is None and user_id is not None:
+            user = _fetch_user(id=user_id)
+
+        # 古いセッションには user_id が無いので、メールアドレスから引き直す
+        if user is None or user.email != session['email']:
+            user = _fetch_user(email=session['email'])
+
+        # 削除されたユーザーのセッションはサインアウトさせ、サインインとの間でリダイレクトし続けないようにする
+        if user is None:
+            sign_out_user()
+            return
+
+        cache.set(user.id, user)
+
+    if user_id != user.id:
+        session['user_id'] = user.id
+
+    g.user = user
+
+def sign_in_user(user):
+    regenerate_session()
+    session['email'] = user.email
+    session['user_id'] = user.id
+
+def sign_out_user():
+    regenerate_session()
+    session.pop('email', None)
+    session.pop('user_id', None)
+
+def _invalidate_user(target):
+    if has_app_context() and 'user_cache' in current_app.extensions:
+        current_app.extensions['user_cache'].delete(target.id)
+
+@event.listens_for(User, 'after_update')
+def _after_update_user(mapper, connection, target):
+    # 購入履歴の追加などでコレクションだけが変わった場合は無効化しない
+    if object_session(target).is_modified(target, include_collections=False):
+        _invalidate_user(target)
+
+@event.listens_for(User, 'after_delete')
+def _after_delete_user(mapper, connection, target):
+    _invalidate_user(target)
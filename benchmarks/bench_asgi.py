@@ -0,0 +1,184 @@
+# WSGI (スレッドプール) と ASGI (非同期のビューとエンジン) の 1 ワーカーあたりの同時接続の比較
+#
+#   $ FLASK_ENV=test python -m pytest benchmarks/bench_asgi.py -s
+#
+# どちらも uvicorn の 1 プロセスで起動し、/products と /transactions に BENCH_CONCURRENCY (カンマ区切り) の
+# 同時接続で BENCH_REQUESTS 件ずつリクエストを送る。WSGI は uvicorn の WSGI モード (10 スレッド) で実行する。
+# データベースとの間には BENCH_DB_LATENCY_MS ミリ秒の遅延を入れるプロキシを挟み、別のホストにある場合を再現する。
+# コネクションプールはどちらも BENCH_DB_POOL_SIZE にそろえる
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import httpx
+from sqlalchemy.engine import make_url
+from . import report
+from .seed import PASSWORD, seed
+
+USERS = int(os.environ.get('BENCH_USERS', 100))
+PRODUCTS = int(os.environ.get('BENCH_PRODUCTS', 1000))
+TRANSACTIONS = int(os.environ.get('BENCH_TRANSACTIONS', 100000))
+CONCURRENCY = [int(c) for c in os.environ.get('BENCH_CONCURRENCY', '10,50,200').split(',')]
+REQUESTS = int(os.environ.get('BENCH_REQUESTS', 1000))
+DB_LATENCY = float(os.environ.get('BENCH_DB_LATENCY_MS', 20)) / 1000
+DB_POOL_SIZE = os.environ.get('BENCH_DB_POOL_SIZE', '50')
+
+PAGES = ('/products', '/transactions')
+
+PACKAGE = __package__.rpartition('.')[0]
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SERVERS = {
+    'wsgi': (8101, ['--interface', 'wsgi', f'{PACKAGE}.main:app']),
+    'asgi': (8102, [f'{PACKAGE}.main_asgi:app']),
+}
+
+# 受け取ったデータを片道 BENCH_DB_LATENCY_MS / 2 だけ遅らせて転送する TCP プロキシ。
+# 遅延は受け取った時刻から数えるので、続けて届いたデータが順番に待たされることはない
+async def _pipe(reader, writer):
+    queue = asyncio.Queue()
+
+    async def forward():
+        while (item := await queue.get()) is not None:
+            deadline, data = item
+            await asyncio.sleep(max(deadline - time.monotonic(), 0))
+            writer.write(data)
+            await writer.drain()
+
+    sender = asyncio.create_task(forward())
+    try:
+        while data := await reader.read(65536):
+            queue.put_nowait((time.monotonic() + DB_LATENCY / 2, data))
+    except ConnectionError:
+        pass
+    finally:
+        queue.put_nowait(None)
+        try:
+            await sender
+        except ConnectionError:
+            pass
+        writer.close()
+
+def _run_proxy(host, port, listen_port):
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(host, port)
+        await asyncio.gather(_pipe(client_reader, server_writer), _pipe(server_reader, client_writer))
+
+    async def serve():
+        server = await asyncio.start_server(handle, '127.0.0.1', listen_port)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+# 負荷をかける側と CPU を取り合わないよう、別のプロセスで動かす
+def _start_proxy(host, port, listen_port):
+    process = multiprocessing.Process(target=_run_proxy, args=(host, port, listen_port), daemon=True)
+    process.start()
+    return process
+
+def _start_server(name, database_url):
+    port, args = SERVERS[name]
+    # コネクションプールが先に上限に達しないよう、どちらも BENCH_DB_POOL_SIZE まで接続できるようにする
+    env = {
+        **os.environ,
+        'TEST_DATABASE_URL': database_url,
+        'DB_POOL_SIZE': DB_POOL_SIZE,
+        'LOG_LEVEL': 'WARNING',
+        'SLOW_REQUEST_SECONDS': '60',
+    }
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', '--port', str(port), '--log-level', 'warning', '--no-access-log', '--timeout-keep-alive', '60', *args],
+        cwd=ROOT,
+        env=env,
+    )
+
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            if httpx.get(f'{base_url}/sign_in').status_code == 200:
+                return process, base_url
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f'{name} server did not start')
+
+# 接続を使い回す 1 つのクライアントではなく、同時接続数だけ独立したクライアントを作って並行に送る
+async def _load(base_url, cookies, concurrency, requests):
+    latencies = {page: [] for page in PAGES}
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker(client):
+        nonlocal errors
+        for n in remaining:
+            page = PAGES[n % len(PAGES)]
+            start = time.perf_counter()
+            try:
+                response = await client.get(page)
+            except httpx.TransportError:
+                # 処理しきれずに切断された接続もエラーとして数える
+                errors += 1
+                continue
+            latencies[page].append(time.perf_counter() - start)
+            errors += response.status_code != 200
+
+    clients = [
+        httpx.AsyncClient(base_url=base_url, cookies={'session': cookies[i % len(cookies)]}, timeout=60)
+        for i in range(concurrency)
+    ]
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for client in clients))
+        elapsed = time.perf_counter() - start
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+    return latencies, errors, elapsed
+
+# サーバープロセスが消費した CPU 時間 (秒)
+def _cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat', encoding='ascii') as f:
+        fields = f.read().rpartition(')')[2].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def _sign_in(base_url, user_id):
+    response = httpx.post(f'{base_url}/sign_in', data={'email': f'user{user_id}@example.com', 'password': PASSWORD})
+    assert response.status_code == 302
+    return response.cookies['session']
+
+def test_asgi_concurrency(app):
+    with app.app_context():
+        seed(USERS, PRODUCTS, TRANSACTIONS)
+
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    proxy = _start_proxy(url.host, url.port or 5432, 15432)
+    database_url = url.set(host='127.0.0.1', port=15432).render_as_string(hide_password=False)
+
+    print()
+    print(f"users: {USERS}, products: {PRODUCTS}, transactions: {TRANSACTIONS}, db latency: {DB_LATENCY * 1000:.1f}ms")
+    print(f"{'server':<8}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'cpu ms':>10}{'errors':>8}")
+    try:
+        for name in SERVERS:
+            process, base_url = _start_server(name, database_url)
+            try:
+                cookies = [_sign_in(base_url, user_id) for user_id in range(1, min(USERS, 20) + 1)]
+                # データベースへの接続を確立しておくため、最大の同時接続数で一度リクエストを送ってから計測する
+                asyncio.run(_load(base_url, cookies, max(CONCURRENCY), max(CONCURRENCY) * 2))
+                for concurrency in CONCURRENCY:
+                    cpu = _cpu_seconds(process.pid)
+                    latencies, errors, elapsed = asyncio.run(_load(base_url, cookies, concurrency, REQUESTS))
+                    cpu = _cpu_seconds(process.pid) - cpu
+                    values = [latency for page in PAGES for latency in latencies[page]]
+                    print(
+                        f"{name:<8}{concurrency:>8}{len(values) / elapsed:>10.1f}"
+                        f"{report.percentile(values, 50) * 1000:>10.2f}{report.percentile(values, 95) * 1000:>10.2f}"
+                        f"{cpu / len(values) * 1000:>10.2f}{errors:>8}"
+                    )
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        proxy.terminate()
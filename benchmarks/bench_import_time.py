@@ -0,0 +1,74 @@
+# import にかかる時間の計測 (python -X importtime)
+#
+#   $ FLASK_ENV=test python -m pytest benchmarks/bench_import_time.py -s
+#
+# 新しいプロセスで create_app までを BENCH_RUNS 回実行し、トップレベルのモジュールごとの累積時間の中央値を
+# 大きい順に BENCH_TOP 件、それぞれが直接 import したモジュールを BENCH_CHILDREN 件ずつ出力する。BENCH_OUTPUT を指定すると結果を JSON で保存し、BENCH_BASELINE に
+# 以前の結果を指定すると合計が BENCH_TOLERANCE の割合を超えて悪化した場合に失敗する
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RUNS = int(os.environ.get('BENCH_RUNS', 5))
+TOP = int(os.environ.get('BENCH_TOP', 10))
+CHILDREN = int(os.environ.get('BENCH_CHILDREN', 5))
+TOLERANCE = float(os.environ.get('BENCH_TOLERANCE', 0.2))
+
+PACKAGE = __package__.rpartition('.')[0]
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# importtime の出力は "import time: self [us] | cumulative | 字下げ + モジュール名" の形式で、
+# 字下げ (2 文字ごと) が import した側からの深さを表す。import されたモジュールは import した側より先に出力される
+def parse_importtime(stderr):
+    modules = {}
+    children = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        ms = int(cumulative) / 1000
+        if level == 1:
+            children[name.strip()] = ms
+        elif level == 0:
+            modules[name.strip()] = {'ms': ms, 'children': children}
+            children = {}
+    return modules
+
+def _run():
+    code = f"from {PACKAGE} import create_app; create_app()"
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+    ).stderr
+    return parse_importtime(stderr)
+
+def _median(runs, key):
+    return statistics.median(value for value in (key(run) for run in runs) if value is not None)
+
+def test_import_time():
+    runs = [_run() for _ in range(RUNS)]
+    total = statistics.median(sum(module['ms'] for module in run.values()) for run in runs)
+    medians = {name: _median(runs, lambda run: run.get(name, {}).get('ms')) for name in runs[0]}
+
+    print()
+    print(f"import time (median of {RUNS} runs): {total:.1f} ms")
+    for name, ms in sorted(medians.items(), key=lambda item: item[1], reverse=True)[:TOP]:
+        print(f"  {name:<44}{ms:>10.1f} ms")
+        # その中で時間のかかっているモジュール
+        children = runs[0][name]['children']
+        for child in sorted(children, key=children.get, reverse=True)[:CHILDREN]:
+            print(f"    {child:<42}{_median(runs, lambda run: run.get(name, {}).get('children', {}).get(child)):>10.1f} ms")
+
+    if os.environ.get('BENCH_OUTPUT'):
+        with open(os.environ['BENCH_OUTPUT'], 'w', encoding='utf8') as f:
+            json.dump({'total_ms': total, 'modules': medians}, f, indent=2, sort_keys=True)
+
+    if os.environ.get('BENCH_BASELINE'):
+        with open(os.environ['BENCH_BASELINE'], encoding='utf8') as f:
+            baseline = json.load(f)
+        assert total <= baseline['total_ms'] * (1 + TOLERANCE), (
+            f"import time regressed: {total:.1f} ms > {baseline['total_ms']:.1f} ms"
+        )
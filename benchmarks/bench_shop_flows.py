@@ -0,0 +1,97 @@
+# 商品一覧の閲覧から購入までの一連の操作の負荷試験
+#
+#   $ FLASK_ENV=test python -m pytest benchmarks/bench_shop_flows.py -s
+#
+# BENCH_USERS, BENCH_PRODUCTS, BENCH_TRANSACTIONS で投入するデータ量を、
+# BENCH_CONCURRENCY, BENCH_ITERATIONS で同時に操作するユーザー数と繰り返し回数を指定する。
+# BENCH_OUTPUT を指定すると結果を JSON で保存し、BENCH_BASELINE に以前の結果を指定すると
+# p95 (BENCH_TOLERANCE の割合まで許容)、スループット、リクエストあたりのクエリ数が悪化した場合に失敗する
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import random
+import time
+from . import report
+from .seed import PASSWORD, seed
+
+USERS = int(os.environ.get('BENCH_USERS', 1000))
+PRODUCTS = int(os.environ.get('BENCH_PRODUCTS', 1000))
+TRANSACTIONS = int(os.environ.get('BENCH_TRANSACTIONS', 100000))
+CONCURRENCY = int(os.environ.get('BENCH_CONCURRENCY', 8))
+ITERATIONS = int(os.environ.get('BENCH_ITERATIONS', 10))
+TOLERANCE = float(os.environ.get('BENCH_TOLERANCE', 0.2))
+
+# 計測するステップと、リクエストあたりのクエリ数を集計するエンドポイント
+STEPS = {
+    'sign_in': 'views.sign_in',
+    'products': 'views.products',
+    'add_cart': 'views.add_cart',
+    'cart': 'views.cart',
+    'purchase': 'views.purchase',
+    'transactions': 'views.transactions',
+}
+
+def _request(latencies, step, expected_status, send):
+    start = time.perf_counter()
+    response = send()
+    latencies[step].append(time.perf_counter() - start)
+    assert response.status_code == expected_status, f"{step}: {response.status_code}"
+    return response
+
+def _run_user(app, user_id):
+    rng = random.Random(user_id)
+    client = app.test_client()
+    latencies = defaultdict(list)
+
+    _request(latencies, 'sign_in', 302, lambda: client.post('/sign_in', data={
+        "email": f"user{user_id}@example.com",
+        "password": PASSWORD,
+    }))
+
+    for _ in range(ITERATIONS):
+        product_id = rng.randint(1, PRODUCTS)
+        _request(latencies, 'products', 200, lambda: client.get('/products'))
+        _request(latencies, 'add_cart', 302, lambda: client.post('/add_cart', data={"product_id": product_id}))
+        _request(latencies, 'cart', 200, lambda: client.get('/cart'))
+        _request(latencies, 'purchase', 200, lambda: client.post(f'/purchase/{product_id}'))
+        _request(latencies, 'transactions', 200, lambda: client.get('/transactions'))
+
+    return latencies
+
+def test_shop_flows(app):
+    assert USERS >= CONCURRENCY
+
+    with app.app_context():
+        seed(USERS, PRODUCTS, TRANSACTIONS)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        results = list(executor.map(lambda i: _run_user(app, i + 1), range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+
+    latencies = defaultdict(list)
+    for result in results:
+        for step, values in result.items():
+            latencies[step].extend(values)
+
+    histogram = app.extensions['metrics'].get('http_request_sql_statements')
+    queries = {
+        step: histogram.sum(endpoint=endpoint) / histogram.count(endpoint=endpoint)
+        for step, endpoint in STEPS.items()
+        if histogram.count(endpoint=endpoint)
+    }
+    summary = report.summarize(latencies, queries, elapsed)
+
+    print()
+    print(f"users: {USERS}, products: {PRODUCTS}, transactions: {TRANSACTIONS}, concurrency: {CONCURRENCY}, iterations: {ITERATIONS}")
+    report.print_summary(summary)
+
+    if os.environ.get('BENCH_OUTPUT'):
+        report.write_baseline(os.environ['BENCH_OUTPUT'], summary)
+
+    if os.environ.get('BENCH_BASELINE'):
+        with open(os.environ['BENCH_BASELINE'], encoding='utf8') as f:
+            baseline = json.load(f)
+        regressions = report.compare(baseline, summary, TOLERANCE)
+        assert not regressions, '\n'.join(regressions)
@@ -0,0 +1,58 @@
+# サインインのスループット計測
+#
+#   $ FLASK_ENV=test BCRYPT_ROUNDS=12 python -m pytest benchmarks/bench_sign_in.py -s
+#
+# PASSWORD_HASH_WORKERS=0 (リクエストスレッド上で bcrypt を実行する従来の動作) と
+# ワーカープールを使った場合の 1 秒あたりのサインイン数を比較する
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+from .. import db, passwords
+from ..models import User
+
+LOGINS = int(os.environ.get('BENCH_LOGINS', 64))
+CONCURRENCY = int(os.environ.get('BENCH_CONCURRENCY', 16))
+
+def _sign_in(app, email, password):
+    client = app.test_client()
+    start = time.perf_counter()
+    response = client.post('/sign_in', data={"email": email, "password": password})
+    return response.status_code, time.perf_counter() - start
+
+def _run(app, workers):
+    # 同じ IP アドレスから繰り返しサインインするため、試行回数の制限は外して計測する
+    app.config['RATE_LIMIT_ENABLED'] = False
+    app.config['PASSWORD_HASH_WORKERS'] = workers
+    app.config['PASSWORD_HASH_QUEUE_SIZE'] = CONCURRENCY
+    app.config['PASSWORD_HASH_TIMEOUT'] = 1.0
+    passwords.init_app(app)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        results = list(executor.map(lambda i: _sign_in(app, f"user{i % 8}@gmail.com", "hogehoge"), range(LOGINS)))
+    elapsed = time.perf_counter() - start
+
+    ok = [latency for status, latency in results if status == 302]
+    rejected = sum(1 for status, _ in results if status == 503)
+    ok.sort()
+    return {
+        'logins_per_second': len(ok) / elapsed,
+        'p95_ms': ok[int(len(ok) * 0.95) - 1] * 1000 if ok else None,
+        'rejected': rejected,
+    }
+
+def test_sign_in_throughput(app):
+    with app.app_context():
+        db.session.add_all([
+            User(name=f"user{i}", email=f"user{i}@gmail.com", password=passwords.hash("hogehoge"))
+            for i in range(8)
+        ])
+        db.session.commit()
+
+    before = _run(app, workers=0)
+    after = _run(app, workers=os.cpu_count() or 1)
+
+    print()
+    print(f"bcrypt rounds: {app.config['BCRYPT_ROUNDS']}, logins: {LOGINS}, concurrency: {CONCURRENCY}")
+    print(f"before (request thread): {before['logins_per_second']:.1f} logins/s, p95 {before['p95_ms']:.0f} ms")
+    print(f"after  (worker pool)   : {after['logins_per_second']:.1f} logins/s, p95 {after['p95_ms']:.0f} ms, rejected {after['rejected']}")
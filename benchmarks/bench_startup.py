@@ -0,0 +1,115 @@
+# 起動時間とワーカーあたりのメモリ使用量の計測
+#
+#   $ FLASK_ENV=test python -m pytest benchmarks/bench_startup.py -s
+#
+# 新しいプロセスで import から create_app と warmup までにかかる時間を BENCH_RUNS 回計測し、
+# gunicorn を BENCH_WORKERS ワーカーで preload あり/なしで起動して、各ワーカーの RSS と PSS、
+# 共有されていないメモリ (USS) を比較する
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+
+RUNS = int(os.environ.get('BENCH_RUNS', 5))
+WORKERS = int(os.environ.get('BENCH_WORKERS', 2))
+REQUESTS = int(os.environ.get('BENCH_REQUESTS', 50))
+PORT = 8121
+
+PACKAGE = __package__.rpartition('.')[0]
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_COLD_START = f"""
+import json, time
+started = time.perf_counter()
+from {PACKAGE} import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+from {PACKAGE}.prefork import warmup
+warmup(app)
+print(json.dumps({{'import': imported - started, 'create_app': created - imported, 'warmup': time.perf_counter() - created}}))
+"""
+
+def _cold_start():
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', _COLD_START], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return {**json.loads(output.splitlines()[-1]), 'process': time.perf_counter() - started}
+
+def _memory(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup', encoding='ascii') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if rest.strip().endswith('kB'):
+                values[key] = int(rest.split()[0])
+    return {
+        'rss_mb': values['Rss'] / 1024,
+        'pss_mb': values['Pss'] / 1024,
+        'uss_mb': (values['Private_Clean'] + values['Private_Dirty']) / 1024,
+    }
+
+def _children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children', encoding='ascii') as f:
+        return [int(child) for child in f.read().split()]
+
+def _run_gunicorn(app, preload):
+    env = {
+        **os.environ,
+        'FLASK_ENV': 'production',
+        'SECRET_KEY': 'bench',
+        'DATABASE_URL': app.config['SQLALCHEMY_DATABASE_URI'],
+        'SESSION_COOKIE_SECURE': 'false',
+        # 起動だけを計測するため、Redis には接続しない
+        'RATE_LIMIT_URL': 'redis://127.0.0.1:6379/0',
+        'BIND': f'127.0.0.1:{PORT}',
+        'WEB_CONCURRENCY': str(WORKERS),
+        'GUNICORN_PRELOAD': 'true' if preload else 'false',
+        'LOG_LEVEL': 'WARNING',
+    }
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, PACKAGE, 'gunicorn.conf.py')],
+        cwd=ROOT,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(200):
+            try:
+                if httpx.get(f'http://127.0.0.1:{PORT}/sign_in').status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.05)
+        ready = time.perf_counter() - started
+
+        # 各ワーカーがリクエストを処理した後の状態で計測する
+        for _ in range(REQUESTS):
+            httpx.get(f'http://127.0.0.1:{PORT}/sign_in')
+
+        workers = [_memory(pid) for pid in _children(process.pid)]
+        return ready, _memory(process.pid), workers
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+def test_startup(app):
+    runs = [_cold_start() for _ in range(RUNS)]
+
+    print()
+    print(f"cold start (median of {RUNS} runs)")
+    for phase in ('import', 'create_app', 'warmup', 'process'):
+        print(f"  {phase:<12}{statistics.median(run[phase] for run in runs) * 1000:>10.1f} ms")
+
+    print(f"{'preload':<10}{'ready ms':>10}{'process':>10}{'rss MB':>10}{'pss MB':>10}{'uss MB':>10}")
+    for preload in (True, False):
+        ready, master, workers = _run_gunicorn(app, preload)
+        assert len(workers) == WORKERS
+        for name, stats in [('master', master)] + [(f'worker{i}', worker) for i, worker in enumerate(workers, 1)]:
+            print(
+                f"{str(preload):<10}{ready * 1000:>10.0f}{name:>10}"
+                f"{stats['rss_mb']:>10.1f}{stats['pss_mb']:>10.1f}{stats['uss_mb']:>10.1f}"
+            )
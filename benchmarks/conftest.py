@@ -0,0 +1,23 @@
+import pytest
+from .. import create_app, db
+
+# テストで書き出すログをリポジトリに残さない (モジュール単位のフィクスチャや子プロセスにも効くようセッション単位で設定する)
+@pytest.fixture(scope='session', autouse=True)
+def log_file(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('LOG_FILE', str(tmp_path_factory.mktemp('logs') / 'server.log'))
+        yield
+
+@pytest.fixture()
+def app():
+    app = create_app()
+
+    # set up
+    with app.app_context():
+        db.create_all()
+
+    yield app
+
+    # tear down
+    with app.app_context():
+        db.drop_all()
@@ -0,0 +1,50 @@
+import json
+import math
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * p / 100) - 1, 0)]
+
+def summarize(latencies, queries, elapsed):
+    summary = {}
+    for step, values in latencies.items():
+        summary[step] = {
+            'count': len(values),
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'queries_per_request': queries.get(step),
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {'requests_per_second': total / elapsed, 'steps': summary}
+
+def print_summary(summary):
+    print(f"throughput: {summary['requests_per_second']:.1f} requests/s")
+    print(f"{'step':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}")
+    for step, stats in summary['steps'].items():
+        queries = stats['queries_per_request']
+        print(
+            f"{step:<14}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+            f"{queries if queries is None else format(queries, '.2f'):>10}"
+        )
+
+def write_baseline(path, summary):
+    with open(path, 'w', encoding='utf8') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+
+# ベースラインより p95 が tolerance 以上遅くなった、またはクエリ数が増えたステップを返す
+def compare(baseline, summary, tolerance):
+    regressions = []
+    for step, stats in summary['steps'].items():
+        before = baseline['steps'].get(step)
+        if before is None:
+            continue
+        if stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{step}: p95 {before['p95_ms']:.2f} ms -> {stats['p95_ms']:.2f} ms")
+        if (stats['queries_per_request'] or 0) > (before['queries_per_request'] or 0):
+            regressions.append(f"{step}: queries/request {before['queries_per_request']} -> {stats['queries_per_request']}")
+    if summary['requests_per_second'] < baseline['requests_per_second'] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['requests_per_second']:.1f} -> {summary['requests_per_second']:.1f} requests/s")
+    return regressions
@@ -0,0 +1,14 @@
+from .. import seed as loader
+
+PASSWORD = "hogehoge"
+
+# 空のデータベースに投入するため、ユーザーと商品の id は 1 から連番になる
+def seed(users, products, transactions, seed=0):
+    loader.load_users(loader.generate_users(users, PASSWORD))
+    loader.load_products(loader.generate_products(products, seed=seed))
+    loader.load_transactions(loader.generate_transactions(
+        transactions,
+        user_ids=list(range(1, users + 1)),
+        product_ids=list(range(1, products + 1)),
+        seed=seed,
+    ))
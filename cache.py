@@ -0,0 +1,192 @@
+from collections import OrderedDict
+import pickle
+import threading
+import time
+
+MISSING = object()
+
+# スレッドセーフな LRU + TTL のインメモリキャッシュ
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, MISSING)
+
+            if item is MISSING:
+                return default
+
+            value, expires = item
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    @property
+    def evictions(self):
+        return 0
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, maxsize=1024, ttl=None):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self.cache.get(key, MISSING)
+
+    def set(self, key, value, ttl=None):
+        self.cache.set(key, value, ttl=ttl)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    @property
+    def evictions(self):
+        return self.cache.evictions
+
+# 複数プロセスで共有する場合は Redis 互換のサーバーを使う
+class RedisBackend(CacheBackend):
+    def __init__(self, client, prefix='', ttl=None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        data = self.client.get(f'{self.prefix}{key}')
+        return MISSING if data is None else pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(f'{self.prefix}{key}', pickle.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(f'{self.prefix}{key}')
+
+# キャッシュミスしたキーは 1 スレッドだけがロードし、他のスレッドはその結果を待つ
+class ReadThroughCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _acquire(self, key):
+        with self._locks_lock:
+            lock, waiters = self._locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._locks[key] = (lock, waiters + 1)
+        lock.acquire()
+        return lock
+
+    def _release(self, key, lock):
+        lock.release()
+        with self._locks_lock:
+            _, waiters = self._locks[key]
+            if waiters == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, waiters - 1)
+
+    def get(self, key, loader):
+        value = self.backend.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        lock = self._acquire(key)
+        try:
+            value = self.backend.get(key)
+            if value is not MISSING:
+                self.hits += 1
+                return value
+
+            self.misses += 1
+            self.loads += 1
+            value = loader()
+            if value is not None:
+                self.backend.set(key, value)
+            return value
+        finally:
+            self._release(key, lock)
+
+    def get_many(self, keys, loader):
+        values = {}
+        missing = []
+
+        for key in keys:
+            value = self.backend.get(key)
+            if value is MISSING:
+                missing.append(key)
+            else:
+                values[key] = value
+
+        self.hits += len(values)
+        if missing:
+            self.misses += len(missing)
+            self.loads += 1
+            for key, value in loader(missing).items():
+                self.backend.set(key, value)
+                values[key] = value
+
+        return values
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'loads': self.loads,
+            'evictions': self.backend.evictions,
+        }
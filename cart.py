@@ -0,0 +1,5 @@
+from flask import session
+
+# カートはセッションに商品 id の文字列の集合で保存している
+def cart_product_ids():
+    return sorted(int(product_id) for product_id in session.get('cart', ()) if product_id.isdigit())
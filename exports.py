@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+import sys
+import zlib
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from . import db
+from .models import User
+from .queries import select_transaction_export
+
+export_cli = AppGroup('export', help='Export purchase transactions.')
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+def init_app(app):
+    app.config.setdefault('EXPORT_YIELD_PER', 1000)
+    app.config.setdefault('ADMIN_EMAILS', [])
+    app.cli.add_command(export_cli)
+
+# サーバーサイドカーソルで yield_per 件ずつ取得し、チャンク単位で返す
+def iter_transaction_chunks(user_id=None):
+    yield_per = current_app.config['EXPORT_YIELD_PER']
+    result = db.session.execute(select_transaction_export(user_id).execution_options(yield_per=yield_per))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+def _row_dict(row):
+    data = row._asdict()
+    data['created'] = data['created'].isoformat()
+    return data
+
+def iter_csv(chunks, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+
+    for rows in chunks:
+        writer.writerows(_row_dict(row).values() for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def iter_jsonl(chunks, columns):
+    for rows in chunks:
+        yield ''.join(json.dumps(_row_dict(row), ensure_ascii=False) + '\n' for row in rows)
+
+def iter_export(fmt, user_id=None):
+    columns = list(select_transaction_export().selected_columns.keys())
+    chunks = iter_transaction_chunks(user_id)
+    iter_format = iter_csv if fmt == 'csv' else iter_jsonl
+    return (text.encode('utf8') for text in iter_format(chunks, columns))
+
+# 全体を圧縮してから返すのではなく、チャンクごとに圧縮して送り出す
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def is_admin(user):
+    return user is not None and user.email in current_app.config['ADMIN_EMAILS']
+
+@export_cli.command('transactions')
+@click.option('--user', 'email', help='Export only the transactions of this user.')
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), help='Write to this file instead of stdout.')
+def export_transactions(email, fmt, compress, output):
+    user_id = None
+    if email is not None:
+        user_id = db.session.execute(db.select(User.id).filter_by(email=email)).scalar_one_or_none()
+        if user_id is None:
+            raise click.BadParameter(f'No user with email {email!r}.', param_hint='--user')
+
+    chunks = iter_export(fmt, user_id)
+    if compress:
+        chunks = iter_gzip(chunks)
+
+    f = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            f.write(chunk)
+    finally:
+        if output:
+            f.close()
+        else:
+            f.flush()
@@ -0,0 +1,58 @@
+import hashlib
+from flask import current_app, has_request_context, request
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from .cache import MemoryBackend, RedisBackend, ReadThroughCache
+from .http_cache import make_etag
+
+def init_app(app):
+    app.config.setdefault('FRAGMENT_CACHE_BACKEND', 'memory')
+    app.config.setdefault('FRAGMENT_CACHE_URL', None)
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', 1000)
+    app.config.setdefault('FRAGMENT_CACHE_TTL', 300)
+    app.config.setdefault('FRAGMENT_CACHE_LOCALES', ['ja'])
+
+    if app.config['FRAGMENT_CACHE_BACKEND'] == 'memory':
+        backend = MemoryBackend(maxsize=app.config['FRAGMENT_CACHE_SIZE'], ttl=app.config['FRAGMENT_CACHE_TTL'])
+    elif app.config['FRAGMENT_CACHE_BACKEND'] == 'redis':
+        backend = RedisBackend.from_url(app.config['FRAGMENT_CACHE_URL'], prefix='fragment:', ttl=app.config['FRAGMENT_CACHE_TTL'])
+    else:
+        raise ValueError(f"Unknown FRAGMENT_CACHE_BACKEND: {app.config['FRAGMENT_CACHE_BACKEND']!r}")
+
+    app.extensions['fragment_cache'] = ReadThroughCache(backend)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+# 対応している言語だけをキーに含め、Accept-Language の値ごとにエントリが増えないようにする
+def _locale():
+    locales = current_app.config['FRAGMENT_CACHE_LOCALES']
+    if has_request_context():
+        return request.accept_languages.best_match(locales, default=locales[0])
+    return locales[0]
+
+# parts にはデータのバージョン (更新日時など) を含める。ユーザーごとの内容を含む部分には使わない
+def get_fragment(parts, render):
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is None:
+        return render()
+    return cache.get(make_etag(_locale(), *parts), lambda: str(render()))
+
+# {% cache 'name', version %} ... {% endcache %} で囲んだ部分の描画結果をキャッシュする
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        # 同じキーを別の場所で使っても衝突しないよう、テンプレート名と行番号をキーに加える。
+        # 共有のキャッシュにデプロイ前のマークアップが残らないよう、ブロックの構文木のチェックサムも加える
+        checksum = hashlib.sha1(repr(body).encode('utf8')).hexdigest()[:16]
+        args = [nodes.Const(f'{parser.name}:{lineno}:{checksum}'), nodes.List(parts)]
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, location, parts, caller):
+        return Markup(get_fragment((location, *parts), caller))
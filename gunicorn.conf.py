@@ -0,0 +1,89 @@
+# 本番用の gunicorn の設定
+#
+#   $ FLASK_ENV=production gunicorn -c gunicorn.conf.py
+#
+# アプリをマスタープロセスで読み込んで (preload) から fork し、import 済みのモジュールや
+# コンパイル済みのテンプレートをワーカー間でコピーオンライトで共有する
+import gc
+import os
+import tempfile
+import time
+
+_started = time.perf_counter()
+_here = os.path.dirname(os.path.abspath(__file__))
+
+def _cpu_count():
+    # コンテナで CPU を制限している場合は、割り当てられた数を使う
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _env_bool(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+# パッケージの外から main を読み込む (main.py はパッケージ内の相対 import を使うため)
+pythonpath = os.path.dirname(_here)
+wsgi_app = f'{os.path.basename(_here)}.main:app'
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+preload_app = _env_bool('GUNICORN_PRELOAD', 'true')
+workers = int(os.environ.get('WEB_CONCURRENCY', _cpu_count() * 2 + 1))
+# スレッド数はワーカーあたりのコネクションプール (DB_POOL_SIZE) を超えないようにする
+threads = int(os.environ.get('GUNICORN_THREADS', min(4, int(os.environ.get('DB_POOL_SIZE', 5)))))
+worker_class = 'gthread'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# メモリの断片化やリークの影響を抑えるため、一定数のリクエストを処理したワーカーは作り直す
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+accesslog = None
+errorlog = '-'
+
+# ワーカーごとのメモリ上の試行回数では、制限がワーカー数倍に緩むため起動しない
+if (
+    workers > 1
+    and _env_bool('RATE_LIMIT_ENABLED', 'true')
+    and os.environ.get('RATE_LIMIT_BACKEND', 'redis' if os.environ.get('FLASK_ENV') == 'production' else 'memory') == 'memory'
+):
+    raise RuntimeError('RATE_LIMIT_BACKEND=memory cannot be shared between gunicorn workers; use redis or WEB_CONCURRENCY=1')
+
+# メトリクスはワーカーごとに持つため、複数のワーカーでは METRICS_DIR に書き出して /metrics でまとめる
+_metrics_dir = os.environ.get('METRICS_DIR') or (
+    os.path.join(tempfile.gettempdir(), f'{os.path.basename(_here)}-metrics-{os.getpid()}') if workers > 1 else None
+)
+raw_env = [f'METRICS_DIR={_metrics_dir}'] if _metrics_dir else []
+
+def _import(name):
+    from importlib import import_module
+    return import_module(f'{os.path.basename(_here)}.{name}')
+
+def _prefork():
+    return _import('prefork')
+
+def on_starting(server):
+    if _metrics_dir:
+        _import('metrics').clear_snapshots(_metrics_dir)
+
+# 終了したワーカーのゲージを消し、カウンタは合計が減らないよう残す
+def child_exit(server, worker):
+    if _metrics_dir:
+        _import('metrics').mark_process_dead(_metrics_dir, worker.pid)
+
+def when_ready(server):
+    if preload_app:
+        _prefork().warmup(server.app.wsgi())
+        # 読み込み済みのオブジェクトを GC の対象から外し、ワーカーで参照カウント以外のページが書き換わらないようにする
+        gc.collect()
+        gc.freeze()
+    server.log.info('Ready in %.3fs (preload=%s, workers=%d, threads=%d)', time.perf_counter() - _started, preload_app, workers, threads)
+
+# マスタープロセスのデータベース接続やスレッドプールをワーカーで使わないよう作り直す
+def post_fork(server, worker):
+    if preload_app:
+        _prefork().after_fork(server.app.wsgi())
+
+def post_worker_init(worker):
+    if not preload_app:
+        _prefork().warmup(worker.wsgi)
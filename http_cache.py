@@ -0,0 +1,31 @@
+from datetime import timezone
+import hashlib
+from flask import current_app, request
+from werkzeug.wrappers import Response
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf8')).hexdigest()
+
+def _as_utc(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+def add_validators(response, etag, last_modified=None):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = _as_utc(last_modified)
+
+    cache_control = current_app.config['CACHE_CONTROL']
+    response.headers['Cache-Control'] = cache_control.get(request.endpoint, cache_control['default'])
+    return response
+
+# テンプレートを描画する前に条件付きリクエストを判定し、変更がなければ 304 を返す。
+# Last-Modified はユーザーごとの内容 (カートの状態など) やページから削除された行を反映しないため、
+# If-Modified-Since だけのリクエストには 304 を返さず、ETag だけで判定する
+def not_modified(etag, last_modified=None):
+    if request.if_none_match and request.if_none_match.contains_weak(etag):
+        return add_validators(Response(status=304), etag, last_modified)
+    return None
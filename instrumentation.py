@@ -0,0 +1,153 @@
+from collections import Counter
+from functools import lru_cache
+import hmac
+import ipaddress
+import time
+from flask import Response, before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.datastructures import WWWAuthenticate
+from werkzeug.exceptions import Forbidden, Unauthorized
+from .metrics import render as render_metrics
+
+SQL_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+def init_app(app):
+    app.config.setdefault('SLOW_REQUEST_SECONDS', 0.5)
+    app.config.setdefault('SLOW_REQUEST_MAX_STATEMENTS', 20)
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('METRICS_ALLOWED_NETWORKS', ['127.0.0.0/8', '::1/128'])
+
+    registry = app.extensions['metrics']
+    registry.histogram(
+        'http_request_duration_seconds',
+        'Wall time spent handling a request.',
+        ['endpoint', 'method', 'status'],
+    )
+    registry.histogram('http_request_db_seconds', 'Time spent executing SQL per request.', ['endpoint'])
+    registry.histogram(
+        'http_request_sql_statements',
+        'SQL statements executed per request.',
+        ['endpoint'],
+        buckets=SQL_COUNT_BUCKETS,
+    )
+    registry.histogram('template_render_seconds', 'Time spent rendering a template.', ['template'])
+    registry.counter('http_slow_requests_total', 'Requests slower than SLOW_REQUEST_SECONDS.', ['endpoint'])
+    registry.gauge('cache_stats', 'Cache statistics.', ['cache', 'stat'], function=lambda: _cache_stats(app))
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_finish_template, app)
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+@lru_cache(maxsize=None)
+def _networks(networks):
+    return [ipaddress.ip_network(network) for network in networks]
+
+# /metrics は METRICS_TOKEN を Bearer トークンで指定したリクエストか、METRICS_ALLOWED_NETWORKS のアドレスからのリクエストにだけ返す
+def _authorize_metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        authorization = request.authorization
+        if authorization is None or authorization.type != 'bearer' or not hmac.compare_digest(authorization.token or '', token):
+            raise Unauthorized(www_authenticate=WWWAuthenticate('bearer'))
+        return
+
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        raise Forbidden
+    if not any(address in network for network in _networks(tuple(current_app.config['METRICS_ALLOWED_NETWORKS']))):
+        raise Forbidden
+
+def metrics():
+    _authorize_metrics()
+    return Response(render_metrics(current_app), mimetype='text/plain; version=0.0.4')
+
+def _cache_stats(app):
+    stats = []
+    for name in ('product', 'fragment'):
+        if f'{name}_cache' in app.extensions:
+            for stat, value in app.extensions[f'{name}_cache'].stats().items():
+                stats.append(({'cache': name, 'stat': stat}, value))
+    if 'user_cache' in app.extensions:
+        user_cache = app.extensions['user_cache']
+        stats.append(({'cache': 'user', 'stat': 'size'}, len(user_cache)))
+        stats.append(({'cache': 'user', 'stat': 'evictions'}, user_cache.evictions))
+    return stats
+
+def _start_request():
+    g.timing_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+    # 同じ SQL をまとめて数えることで N+1 を見つけやすくする
+    g.sql_statements = Counter()
+    g.template_seconds = 0.0
+
+def _finish_request(response):
+    if 'timing_started' not in g:
+        return response
+
+    duration = time.perf_counter() - g.timing_started
+    endpoint = request.endpoint or 'unmatched'
+    registry = current_app.extensions['metrics']
+    registry.get('http_request_duration_seconds').observe(
+        duration, endpoint=endpoint, method=request.method, status=response.status_code,
+    )
+    registry.get('http_request_db_seconds').observe(g.sql_seconds, endpoint=endpoint)
+    registry.get('http_request_sql_statements').observe(g.sql_count, endpoint=endpoint)
+
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={g.sql_seconds * 1000:.3f}',
+        f'tpl;dur={g.template_seconds * 1000:.3f}',
+        f'total;dur={duration * 1000:.3f}',
+    ])
+
+    if duration >= current_app.config['SLOW_REQUEST_SECONDS']:
+        registry.get('http_slow_requests_total').inc(endpoint=endpoint)
+        statements = g.sql_statements.most_common(current_app.config['SLOW_REQUEST_MAX_STATEMENTS'])
+        current_app.logger.warning(
+            'Slow request %s %s: %.3fs, %d SQL statements in %.3fs, templates %.3fs\n%s',
+            request.method, request.path, duration, g.sql_count, g.sql_seconds, g.template_seconds,
+            '\n'.join(f'[{count}x] {statement}' for statement, count in statements),
+        )
+
+    return response
+
+def _start_template(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+def _finish_template(sender, template, context, **extra):
+    if not has_request_context() or not g.get('template_started'):
+        return
+
+    elapsed = time.perf_counter() - g.template_started.pop()
+    # 描画中に別のテンプレートを描画した場合に二重に数えないよう、外側のテンプレートだけを合計する
+    if not g.template_started and 'template_seconds' in g:
+        g.template_seconds += elapsed
+    current_app.extensions['metrics'].get('template_render_seconds').observe(elapsed, template=template.name or 'string')
+
+# プライマリとリードレプリカのどちらのエンジンも計測する
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_statements' in g:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started or not has_request_context() or 'sql_statements' not in g:
+        return
+
+    g.sql_seconds += time.perf_counter() - started.pop()
+    g.sql_count += 1
+    g.sql_statements[statement] += 1
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
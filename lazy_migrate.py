@@ -0,0 +1,32 @@
+import click
+from flask import g
+from flask.cli import ScriptInfo, with_appcontext
+
+# Flask-Migrate は alembic ごと import すると起動時間の大半を占めるため、flask db のサブコマンドを実行するときにだけ読み込む
+class LazyMigrateGroup(click.Group):
+    def _load(self, ctx):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as migrate_cli
+
+        app = ctx.ensure_object(ScriptInfo).load_app()
+        if 'migrate' not in app.extensions:
+            Migrate(app, app.extensions['sqlalchemy'])
+        return migrate_cli
+
+    def list_commands(self, ctx):
+        return self._load(ctx).list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._load(ctx).get_command(ctx, name)
+
+# オプションは flask_migrate.cli の db グループと同じものを受け付ける
+@click.group('db', cls=LazyMigrateGroup, help='Perform database migrations.')
+@click.option('-d', '--directory', default=None, help='Migration script directory (default is "migrations")')
+@click.option('-x', '--x-arg', multiple=True, help='Additional arguments consumed by custom env.py scripts')
+@with_appcontext
+def migrate_cli(directory, x_arg):
+    g.directory = directory
+    g.x_arg = x_arg
+
+def init_app(app):
+    app.cli.add_command(migrate_cli)
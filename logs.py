@@ -0,0 +1,182 @@
+import atexit
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+import uuid
+import weakref
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask.logging import default_handler
+
+_RECORD_FIELDS = ('request_id', 'route', 'method', 'status', 'duration_ms')
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in _RECORD_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+# QueueHandler に付けるフィルタはリクエストスレッドで実行されるので、ここでリクエストの情報を付与する
+class RequestContextFilter(logging.Filter):
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.route = request.url_rule.rule if request.url_rule else request.path
+            record.method = request.method
+        return True
+
+# 同じ名前のアプリを複数作るとロガーを共有するため、別のアプリのレコードは書き出さない
+class AppFilter(logging.Filter):
+    def __init__(self, app):
+        super().__init__()
+        self.app = weakref.ref(app)
+
+    def filter(self, record):
+        return not has_app_context() or current_app._get_current_object() is self.app()
+
+class DebugSampler(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+# キューが溢れた場合はリクエストを待たせずにレコードを捨てる
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def _file_handler(app):
+    if app.config['LOG_ROTATION'] == 'time':
+        handler = logging.handlers.TimedRotatingFileHandler(
+            app.config['LOG_FILE'],
+            when=app.config['LOG_ROTATE_WHEN'],
+            backupCount=app.config['LOG_BACKUP_COUNT'],
+            encoding='utf8',
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            app.config['LOG_FILE'],
+            maxBytes=app.config['LOG_MAX_BYTES'],
+            backupCount=app.config['LOG_BACKUP_COUNT'],
+            encoding='utf8',
+        )
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+_apps = weakref.WeakSet()
+
+def shutdown(app):
+    for logger, handler in app.extensions.pop('log_handlers', ()):
+        logger.removeHandler(handler)
+    listener = app.extensions.pop('log_listener', None)
+    if listener is not None:
+        # テストなどで既に停止している場合は stop を呼ばない
+        if listener._thread is not None:
+            listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    _apps.discard(app)
+
+def init_app(app):
+    app.config.setdefault('LOG_FILE', 'server.log')
+    app.config.setdefault('LOG_LEVEL', 'DEBUG')
+    app.config.setdefault('LOG_ROTATION', 'size')
+    app.config.setdefault('LOG_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('LOG_ROTATE_WHEN', 'midnight')
+    app.config.setdefault('LOG_BACKUP_COUNT', 5)
+    app.config.setdefault('LOG_DEBUG_SAMPLE_RATE', 1.0)
+    app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+    app.config.setdefault('LOG_STDERR', True)
+
+    # 同じアプリで設定し直した場合 (テストなど) にハンドラが重複しないようにする
+    shutdown(app)
+
+    level = logging.getLevelName(app.config['LOG_LEVEL'])
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE']))
+    queue_handler.addFilter(AppFilter(app))
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(DebugSampler(app.config['LOG_DEBUG_SAMPLE_RATE']))
+
+    # 標準エラー出力への書き込みもリクエストスレッドで行わないよう、Flask の既定のハンドラを外してリスナーから出力する
+    handlers = [_file_handler(app)]
+    if app.config['LOG_STDERR']:
+        stderr_handler = logging.StreamHandler()
+        stderr_handler.setFormatter(default_handler.formatter)
+        handlers.append(stderr_handler)
+    app.logger.removeHandler(default_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    log_handlers = []
+    for logger in (app.logger, logging.getLogger('werkzeug')):
+        logger.setLevel(level)
+        logger.addHandler(queue_handler)
+        log_handlers.append((logger, queue_handler))
+
+    app.extensions['log_handlers'] = log_handlers
+    app.extensions['log_listener'] = listener
+    app.extensions['log_handler'] = queue_handler
+    _apps.add(app)
+
+    if _start_request not in app.before_request_funcs.get(None, []):
+        app.before_request_funcs.setdefault(None, []).insert(0, _start_request)
+        app.after_request(_log_request)
+
+def _start_request():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+
+def _log_request(response):
+    duration_ms = round((time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000, 3)
+    current_app.logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+        'status': response.status_code,
+        'duration_ms': duration_ms,
+    })
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    return response
+
+# QueueListener のスレッドは fork 後の子プロセスに引き継がれず、キューのロックも壊れうるため、
+# fork の前に止めて、親と子のそれぞれで起動し直す
+_restart = []
+
+def _before_fork():
+    for app in list(_apps):
+        listener = app.extensions.get('log_listener')
+        if listener is not None and listener._thread is not None:
+            listener.stop()
+            _restart.append(listener)
+
+def _after_fork():
+    while _restart:
+        _restart.pop().start()
+
+def _shutdown_all():
+    for app in list(_apps):
+        shutdown(app)
+
+atexit.register(_shutdown_all)
+os.register_at_fork(before=_before_fork, after_in_parent=_after_fork, after_in_child=_after_fork)
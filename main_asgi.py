@@ -0,0 +1,7 @@
+# 相対 import を使うため、パッケージの親ディレクトリから読み込む
+#
+#   $ uvicorn --app-dir .. <パッケージ名>.main_asgi:app
+from . import create_app
+from .asgi import create_asgi_app
+
+app = create_asgi_app(create_app())
@@ -0,0 +1,287 @@
+import bisect
+import json
+import os
+import threading
+from flask import current_app
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, key, value):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), function=None):
+        super().__init__(name, help, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _update(self):
+        # 関数が指定されている場合は出力のたびに現在値を取得する
+        if self.function is not None:
+            for labels, value in self.function():
+                self.set(value, **labels)
+
+    def render(self):
+        self._update()
+        return super().render()
+
+    def snapshot(self):
+        self._update()
+        return super().snapshot()
+
+    def merge(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(self._key(labels), ((), 0))
+        return sum(counts)
+
+    def sum(self, **labels):
+        _, total = self._values.get(self._key(labels), ((), 0))
+        return total
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(float(total))}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+    def merge(self, key, value):
+        counts, total = value
+        with self._lock:
+            merged, merged_total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            self._values[key] = ([a + b for a, b in zip(merged, counts)], merged_total + total)
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), function=None):
+        return self.register(Gauge(name, help, labelnames, function=function))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets=buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {
+            metric.name: {
+                'type': metric.type,
+                'help': metric.help,
+                'labelnames': metric.labelnames,
+                'buckets': getattr(metric, 'buckets', None),
+                'values': metric.snapshot(),
+            }
+            for metric in list(self._metrics.values())
+        }
+
+# ワーカーごとのスナップショットを 1 つのレジストリにまとめる。カウンタとヒストグラムは合計し、
+# ゲージ (コネクションプールやキャッシュの状態など) はワーカーごとの値なので worker ラベルを付けて並べる
+def merge(snapshots):
+    registry = Registry()
+    for worker, snapshot in sorted(snapshots.items()):
+        for name, data in snapshot.items():
+            if data['type'] == 'gauge':
+                metric = registry.gauge(name, data['help'], [*data['labelnames'], 'worker'])
+                for key, value in data['values']:
+                    metric.merge((*key, worker), value)
+            elif data['type'] == 'histogram':
+                metric = registry.histogram(name, data['help'], data['labelnames'], buckets=data['buckets'])
+                for key, value in data['values']:
+                    metric.merge(tuple(key), value)
+            else:
+                metric = registry.counter(name, data['help'], data['labelnames'])
+                for key, value in data['values']:
+                    metric.merge(tuple(key), value)
+    return registry
+
+# gunicorn などで複数のワーカープロセスがある場合は、METRICS_DIR にワーカーごとのスナップショットを書き出し、
+# /metrics ではすべてのワーカーの値をまとめて返す (どのワーカーが応答しても同じ値になる)
+_DEAD = 'dead'
+
+def write_snapshot(registry, directory):
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w', encoding='utf8') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(f'{path}.tmp', path)
+
+def read_snapshots(directory):
+    snapshots = {}
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding='utf8') as f:
+                snapshots[name[:-len('.json')]] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+# 終了したワーカーのカウンタとヒストグラムは合計が減らないよう 1 つのファイルにまとめ、ゲージは捨てる
+def mark_process_dead(directory, pid):
+    path = os.path.join(directory, f'{pid}.json')
+    dead = os.path.join(directory, f'{_DEAD}.json')
+    snapshots = {
+        worker: {name: data for name, data in snapshot.items() if data['type'] != 'gauge'}
+        for worker, snapshot in read_snapshots(directory).items()
+        if worker in (str(pid), _DEAD)
+    }
+    if str(pid) not in snapshots:
+        return
+    with open(f'{dead}.tmp', 'w', encoding='utf8') as f:
+        json.dump(merge(snapshots).snapshot(), f)
+    os.replace(f'{dead}.tmp', dead)
+    os.remove(path)
+
+# 前回の起動で書き出されたスナップショットを消す (gunicorn の on_starting で呼び出す)
+def clear_snapshots(directory):
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, name))
+
+def render(app):
+    registry = app.extensions['metrics']
+    directory = app.config['METRICS_DIR']
+    if not directory:
+        return registry.render()
+    write_snapshot(registry, directory)
+    return merge(read_snapshots(directory)).render()
+
+# 書き出しはリクエストごとではなく、ワーカーごとのスレッドで METRICS_FLUSH_INTERVAL 秒ごとに行う。
+# preload したマスタープロセスで fork 前にスレッドを起動しないよう、最初のリクエストで起動する
+class SnapshotWriter:
+    def __init__(self, app):
+        self.app = app
+        self._stopping = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stopping.clear()
+                threading.Thread(target=self._run, name='metrics-snapshot', daemon=True).start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.wait(self.app.config['METRICS_FLUSH_INTERVAL']):
+            try:
+                write_snapshot(self.app.extensions['metrics'], self.app.config['METRICS_DIR'])
+            except OSError:
+                self.app.logger.exception('Failed to write the metrics snapshot')
+
+def _start_snapshot_writer():
+    current_app.extensions['metrics_writer'].start()
+
+def init_app(app):
+    app.config.setdefault('METRICS_DIR', None)
+    app.config.setdefault('METRICS_FLUSH_INTERVAL', 5.0)
+    app.extensions['metrics'] = Registry()
+
+    if app.config['METRICS_DIR']:
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+        app.extensions['metrics_writer'] = SnapshotWriter(app)
+        app.before_request(_start_snapshot_writer)
@@ -0,0 +1,41 @@
+"""create product_sales_stats
+
+Revision ID: 3e9b7c1d5a20
+Revises: 7a41c9d0e6b2
+Create Date: 2026-10-18 15:52:08.617204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e9b7c1d5a20'
+down_revision = '7a41c9d0e6b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_sales_stats',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.BigInteger(), nullable=False),
+    sa.Column('last_purchased', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+    op.create_index('ix_product_sales_stats_count', 'product_sales_stats', [sa.text('count DESC'), 'product_id'], unique=False)
+
+    # 既存の購入履歴から集計しておく
+    op.execute(
+        "INSERT INTO product_sales_stats (product_id, count, revenue, last_purchased) "
+        "SELECT pt.product_id, count(*), sum(p.price), max(pt.created) "
+        "FROM purchase_transactions pt JOIN products p ON p.id = pt.product_id "
+        "GROUP BY pt.product_id"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_product_sales_stats_count', table_name='product_sales_stats')
+    op.drop_table('product_sales_stats')
@@ -0,0 +1,41 @@
+"""add purchase_transaction indexes
+
+Revision ID: 7a41c9d0e6b2
+Revises: 5c3f8e2a9d41
+Create Date: 2026-10-18 11:02:17.334518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a41c9d0e6b2'
+down_revision = '5c3f8e2a9d41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 大きなテーブルへの書き込みを止めないよう、PostgreSQL では CONCURRENTLY で作成する
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_purchase_transactions_user_id_created',
+            'purchase_transactions',
+            ['user_id', sa.text('created DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_purchase_transactions_product_id',
+            'purchase_transactions',
+            ['product_id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_purchase_transactions_product_id', table_name='purchase_transactions', postgresql_concurrently=True)
+        op.drop_index('ix_purchase_transactions_user_id_created', table_name='purchase_transactions', postgresql_concurrently=True)
@@ -0,0 +1,34 @@
+"""add product name search index
+
+Revision ID: b6d2f4a8c913
+Revises: 3e9b7c1d5a20
+Create Date: 2026-10-18 16:08:44.201937
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d2f4a8c913'
+down_revision = '3e9b7c1d5a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 商品の追加を止めないよう、PostgreSQL では CONCURRENTLY で作成する
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_products_name_search',
+            'products',
+            [sa.text("to_tsvector('simple', name)")],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_products_name_search', table_name='products', postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""create purchase_request
+
+Revision ID: e4a1c7b93f58
+Revises: b6d2f4a8c913
+Create Date: 2026-10-18 16:31:27.904611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a1c7b93f58'
+down_revision = 'b6d2f4a8c913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('purchase_requests',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('idempotency_key', sa.String(length=64), nullable=False),
+    sa.Column('product_ids', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('updated', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'idempotency_key', name='uq_purchase_requests_user_id_idempotency_key')
+    )
+    op.create_index('ix_purchase_requests_queued', 'purchase_requests', ['id'], unique=False, postgresql_where=sa.text("status = 'queued'"))
+
+
+def downgrade():
+    op.drop_index('ix_purchase_requests_queued', table_name='purchase_requests', postgresql_where=sa.text("status = 'queued'"))
+    op.drop_table('purchase_requests')
@@ -5,12 +5,16 @@ from . import db
 
 class Product(db.Model):
     __tablename__ = 'products'
+    # 商品検索用の全文検索インデックス (単語の前方一致に使うため、語幹処理をしない simple 設定にする)
+    __table_args__ = (
+        db.Index('ix_products_name_search', db.text("to_tsvector('simple', name)"), postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
     id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
     name: Mapped[str] = mapped_column(db.String(20), nullable=False)
     price: Mapped[int] = mapped_column(db.Integer, nullable=False)
     purchase_transactions: Mapped[List['PurchaseTransaction']] = db.relationship(back_populates='product', cascade='all, delete-orphan')
     created: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
-    updated: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    updated: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     def __repr__(self) -> str:
         return f'Product(id={self.id!r}, name={self.name!r}, price={self.price!r}, created={self.created!r}, updated={self.updated!r})'
 
@@ -22,7 +26,7 @@ class User(db.Model):
     password: Mapped[str] = mapped_column(db.String(100), unique=True, nullable=False)
     purchase_transactions: Mapped[List['PurchaseTransaction']] = db.relationship(back_populates='user', cascade='all, delete-orphan')
     created: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
-    updated: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    updated: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     def __repr__(self) -> str:
         return f'User(id={self.id!r}, name={self.name!r}, email={self.email!r}, password={self.password!r}, created={self.created!r}, updated={self.updated!r})'
 
@@ -34,6 +38,52 @@ class PurchaseTransaction(db.Model):
     product: Mapped['Product'] = db.relationship(back_populates='purchase_transactions')
     user: Mapped['User'] = db.relationship(back_populates='purchase_transactions')
     created: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
-    updated: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    updated: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     def __repr__(self) -> str:
         return f'PurchaseTransaction(id={self.id!r}, product_id={self.product_id!r}, user_id={self.user_id!r} created={self.created!r}, updated={self.updated!r})'
+
+# 購入履歴の表示用と、商品削除時のカスケード・売上集計用のインデックス
+db.Index('ix_purchase_transactions_user_id_created', PurchaseTransaction.user_id, PurchaseTransaction.created.desc())
+db.Index('ix_purchase_transactions_product_id', PurchaseTransaction.product_id)
+
+# 商品検索で使う式。インデックスの式と一致させる必要がある
+product_name_tsvector = db.func.to_tsvector(db.literal_column("'simple'"), Product.name)
+
+class StoredSession(db.Model):
+    __tablename__ = 'sessions'
+    id: Mapped[str] = mapped_column(db.String(64), primary_key=True)
+    data: Mapped[str] = mapped_column(db.Text, nullable=False)
+    expires: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, index=True)
+    def __repr__(self) -> str:
+        return f'StoredSession(id={self.id!r}, expires={self.expires!r})'
+
+# 商品ごとの売上の集計。購入時に同じトランザクションで加算し、flask sales rebuild で作り直せる
+class ProductSalesStats(db.Model):
+    __tablename__ = 'product_sales_stats'
+    product_id: Mapped[int] = mapped_column(db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    count: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
+    revenue: Mapped[int] = mapped_column(db.BigInteger, nullable=False, default=0)
+    last_purchased: Mapped[datetime] = mapped_column(db.DateTime, nullable=False)
+    def __repr__(self) -> str:
+        return f'ProductSalesStats(product_id={self.product_id!r}, count={self.count!r}, revenue={self.revenue!r}, last_purchased={self.last_purchased!r})'
+
+db.Index('ix_product_sales_stats_count', ProductSalesStats.count.desc(), ProductSalesStats.product_id)
+
+# 購入の受付。冪等キーで再送を検出し、非同期モードではワーカーが queued の受付を処理する
+class PurchaseRequest(db.Model):
+    __tablename__ = 'purchase_requests'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'idempotency_key', name='uq_purchase_requests_user_id_idempotency_key'),
+    )
+    id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(db.ForeignKey('users.id', ondelete='CASCADE'))
+    idempotency_key: Mapped[str] = mapped_column(db.String(64), nullable=False)
+    product_ids: Mapped[str] = mapped_column(db.Text, nullable=False)
+    status: Mapped[str] = mapped_column(db.String(16), nullable=False)
+    created: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    updated: Mapped[datetime] = mapped_column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    def __repr__(self) -> str:
+        return f'PurchaseRequest(id={self.id!r}, user_id={self.user_id!r}, idempotency_key={self.idempotency_key!r}, status={self.status!r})'
+
+# ワーカーが未処理の受付だけを順に取り出すための部分インデックス
+db.Index('ix_purchase_requests_queued', PurchaseRequest.id, postgresql_where=PurchaseRequest.status == 'queued')
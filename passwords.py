@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import os
+import threading
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+
+# プロセスプールでも渡せるようにモジュールレベルの関数にしておく。
+# bcrypt は起動時間を短くするため、最初にハッシュを計算するときに読み込む
+def _hashpw(password, rounds):
+    import bcrypt
+    salt = bcrypt.gensalt(rounds=rounds, prefix=b'2b')
+    return bcrypt.hashpw(password.encode('utf8'), salt).decode('utf8')
+
+def _checkpw(password, hashed):
+    import bcrypt
+    return bcrypt.checkpw(password.encode('utf8'), hashed.encode('utf8'))
+
+class _PasswordHasherState:
+    def __init__(self, rounds, workers, queue_size, timeout, executor):
+        self.rounds = rounds
+        self.timeout = timeout
+        self.executor = None
+        self.slots = None
+
+        # workers が 0 の場合はリクエストスレッド上でそのまま計算する
+        if workers > 0:
+            executor_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+            self.executor = executor_class(max_workers=workers)
+            # 実行中と待機中を合わせた数を制限し、溢れた分は待たせずに断る
+            self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+
+        if not self.slots.acquire(timeout=self.timeout):
+            raise ServiceUnavailable('Too many password operations in progress. Please retry shortly.')
+
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        workers = app.config.setdefault('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+        app.config.setdefault('BCRYPT_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_SIZE', workers * 2)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 0.05)
+        app.config.setdefault('PASSWORD_HASH_EXECUTOR', 'thread')
+
+        # 設定し直した場合は、前のワーカーのスレッドやプロセスを残さない
+        if 'password_hasher' in app.extensions:
+            app.extensions['password_hasher'].shutdown()
+
+        app.extensions['password_hasher'] = _PasswordHasherState(
+            rounds=app.config['BCRYPT_ROUNDS'],
+            workers=app.config['PASSWORD_HASH_WORKERS'],
+            queue_size=app.config['PASSWORD_HASH_QUEUE_SIZE'],
+            timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+            executor=app.config['PASSWORD_HASH_EXECUTOR'],
+        )
+
+    @property
+    def _state(self):
+        return current_app.extensions['password_hasher']
+
+    def hash(self, password):
+        return self._state.submit(_hashpw, password, self._state.rounds)
+
+    def check(self, password, hashed):
+        return self._state.submit(_checkpw, password, hashed)
+
+    # 一括投入用。リクエストの処理とは別に、すべてのコアを使ってまとめてハッシュ化する
+    def hash_many(self, passwords):
+        rounds = self._state.rounds
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            return list(executor.map(_hashpw, passwords, [rounds] * len(passwords)))
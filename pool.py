@@ -0,0 +1,86 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+
+_TRUE = ('1', 'true', 'yes', 'on')
+
+_checkout_started = threading.local()
+
+# チェックアウトの待ち時間を checkout イベントで計測できるよう、開始時刻を記録しておく
+class _TimedCheckoutMixin:
+    def connect(self):
+        _checkout_started.value = time.perf_counter()
+        return super().connect()
+
+# SQLAlchemy はプールのロガーをクラスのモジュール名から付けるため、そのままではアプリのロガー (LOG_LEVEL) の子になり、
+# 開発環境でチェックアウトごとに DEBUG のログが出る。元のプールと同じ sqlalchemy.pool 以下のロガーを使う
+class InstrumentedQueuePool(_TimedCheckoutMixin, QueuePool):
+    _sqla_logger_namespace = 'sqlalchemy.pool.impl.QueuePool'
+
+class InstrumentedNullPool(_TimedCheckoutMixin, NullPool):
+    _sqla_logger_namespace = 'sqlalchemy.pool.impl.NullPool'
+
+def engine_options_from_env(environ):
+    # PgBouncer (transaction モード) の背後ではプールを PgBouncer に任せ、アプリ側では保持しない
+    if environ.get('DB_PGBOUNCER', '').lower() in _TRUE:
+        return {
+            'poolclass': InstrumentedNullPool,
+            'pool_pre_ping': False,
+        }
+
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': environ.get('DB_POOL_PRE_PING', 'true').lower() in _TRUE,
+    }
+
+def instrument_engine(engine, registry, name='default'):
+    pool = engine.pool
+    checked_out = registry.histogram(
+        'db_pool_checked_out',
+        'Connections checked out from the pool, sampled at each checkout.',
+        ['engine'],
+        buckets=(1, 2, 5, 10, 20, 50, 100),
+    )
+    overflow = registry.histogram(
+        'db_pool_overflow',
+        'Overflow connections in use, sampled at each checkout.',
+        ['engine'],
+        buckets=(0, 1, 2, 5, 10, 20, 50),
+    )
+    wait = registry.histogram(
+        'db_pool_wait_seconds',
+        'Time spent waiting to check out a connection.',
+        ['engine'],
+    )
+    connects = registry.counter('db_pool_connects_total', 'New DBAPI connections opened.', ['engine'])
+    invalidations = registry.counter('db_pool_invalidations_total', 'Connections invalidated.', ['engine'])
+
+    @event.listens_for(pool, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        started = getattr(_checkout_started, 'value', None)
+        if started is not None:
+            wait.observe(time.perf_counter() - started, engine=name)
+            _checkout_started.value = None
+
+        # engine.dispose() でプールが作り直されても計測できるよう、毎回 engine から参照する
+        if isinstance(engine.pool, QueuePool):
+            checked_out.observe(engine.pool.checkedout(), engine=name)
+            overflow.observe(max(engine.pool.overflow(), 0), engine=name)
+
+    @event.listens_for(pool, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        connects.inc(engine=name)
+
+    @event.listens_for(pool, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        invalidations.inc(engine=name)
+
+def init_app(app, db):
+    with app.app_context():
+        for key, engine in db.engines.items():
+            instrument_engine(engine, app.extensions['metrics'], name=key or 'default')
@@ -0,0 +1,66 @@
+import importlib
+import time
+from sqlalchemy.exc import SQLAlchemyError
+from .passwords import PasswordHasher
+from .template_cache import compile_templates
+
+# 遅延 import しているモジュールのうち、リクエストの処理で必ず使うもの
+WARMUP_MODULES = ('email_validator', 'bcrypt')
+
+def init_app(app):
+    app.extensions.setdefault('startup_seconds', {})
+    app.extensions['metrics'].gauge(
+        'app_startup_seconds',
+        'Time spent creating and warming up the application.',
+        ['phase'],
+        function=lambda: [({'phase': phase}, seconds) for phase, seconds in app.extensions['startup_seconds'].items()],
+    )
+
+def record_startup(app, phase, started):
+    elapsed = time.perf_counter() - started
+    app.extensions['startup_seconds'][phase] = elapsed
+    app.logger.debug('Startup phase %s took %.3fs', phase, elapsed)
+
+# preload したマスタープロセスで呼び出し、fork 後のワーカーがコンパイル済みのテンプレートなどを共有できるようにする
+def warmup(app):
+    started = time.perf_counter()
+
+    for name in WARMUP_MODULES:
+        importlib.import_module(name)
+
+    compile_templates(app)
+
+    app.url_map.update()
+
+    # データベースに接続できなくても起動は続け、最初の入力補完で作る
+    from .search import build_index
+    try:
+        build_index(app)
+    except SQLAlchemyError:
+        app.logger.warning('Could not build the typeahead index during warmup', exc_info=True)
+
+    record_startup(app, 'warmup', started)
+
+def _dispose_engines(app):
+    # 親プロセスの接続は親が使い続けるため、close=False で閉じずにプールから手放す
+    with app.app_context():
+        for engine in app.extensions['sqlalchemy'].engines.values():
+            engine.dispose(close=False)
+
+    if 'replicas' in app.extensions:
+        for engine in app.extensions['replicas'].engines.values():
+            engine.dispose(close=False)
+
+    if 'async_engine' in app.extensions:
+        app.extensions['async_engine'].sync_engine.dispose(close=False)
+
+# preload したアプリを fork したワーカーで呼び出す (gunicorn.conf.py の post_fork)。
+# os.register_at_fork にすると、パスワードのハッシュ化のプロセスプールの子プロセスでも実行されてしまう
+def after_fork(app):
+    _dispose_engines(app)
+    # スレッドプールのスレッドは fork 後の子プロセスに引き継がれないため作り直す。
+    # コピーされた executor のロックは親のスレッドが持ったままの可能性があるため、shutdown せずに捨てる
+    app.extensions.pop('password_hasher', None)
+    PasswordHasher().init_app(app)
+    if app.config['ASYNC_PURCHASES']:
+        app.extensions['purchase_worker'].start()
@@ -0,0 +1,67 @@
+from collections import namedtuple
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from . import db
+from .cache import MemoryBackend, RedisBackend, ReadThroughCache
+from .models import Product
+from .replicas import use_primary
+
+# キャッシュには ORM オブジェクトではなく、セッションに依存しない値だけを保存する
+ProductRecord = namedtuple('ProductRecord', ['id', 'name', 'price', 'updated'])
+
+def init_app(app):
+    app.config.setdefault('PRODUCT_CACHE_BACKEND', 'memory')
+    app.config.setdefault('PRODUCT_CACHE_URL', None)
+    app.config.setdefault('PRODUCT_CACHE_SIZE', 10000)
+    app.config.setdefault('PRODUCT_CACHE_TTL', 300)
+
+    if app.config['PRODUCT_CACHE_BACKEND'] == 'memory':
+        backend = MemoryBackend(maxsize=app.config['PRODUCT_CACHE_SIZE'], ttl=app.config['PRODUCT_CACHE_TTL'])
+    elif app.config['PRODUCT_CACHE_BACKEND'] == 'redis':
+        backend = RedisBackend.from_url(app.config['PRODUCT_CACHE_URL'], prefix='product:', ttl=app.config['PRODUCT_CACHE_TTL'])
+    else:
+        raise ValueError(f"Unknown PRODUCT_CACHE_BACKEND: {app.config['PRODUCT_CACHE_BACKEND']!r}")
+
+    app.extensions['product_cache'] = ReadThroughCache(backend)
+
+def _select_products():
+    return db.select(Product.id, Product.name, Product.price, Product.updated)
+
+# 無効化の直後に遅れているレプリカから古い行を読み込むと、TTL の間その値が残るため、キャッシュミスはプライマリから読む
+def get_product(product_id):
+    def load():
+        with use_primary():
+            row = db.session.execute(_select_products().filter_by(id=product_id)).one_or_none()
+        return ProductRecord(*row) if row is not None else None
+
+    return current_app.extensions['product_cache'].get(product_id, load)
+
+def get_products(product_ids):
+    def load(missing):
+        with use_primary():
+            rows = db.session.execute(_select_products().where(Product.id.in_(missing))).all()
+        return {row.id: ProductRecord(*row) for row in rows}
+
+    products = current_app.extensions['product_cache'].get_many(product_ids, load)
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+def invalidate(product_id):
+    if has_app_context() and 'product_cache' in current_app.extensions:
+        current_app.extensions['product_cache'].delete(product_id)
+
+# コミット前に別のリクエストが古い値を読み込む可能性があるため、コミット後にも消す
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+def _invalidate_product(mapper, connection, target):
+    invalidate(target.id)
+    object_session(target).info.setdefault('invalidated_products', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_products(session):
+    for product_id in session.info.pop('invalidated_products', ()):
+        invalidate(product_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidated_products(session):
+    session.info.pop('invalidated_products', None)
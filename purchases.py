@@ -0,0 +1,197 @@
+from collections import namedtuple
+import json
+import os
+import re
+import threading
+import uuid
+from flask import current_app
+from werkzeug.exceptions import BadRequest
+from . import db
+from .models import Product, PurchaseRequest, PurchaseTransaction
+from .queries import dialect_insert
+from .sales import record_sales
+
+QUEUED = 'queued'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+PurchaseStatus = namedtuple('PurchaseStatus', ['id', 'status', 'product_ids'])
+
+# PurchaseRequest.idempotency_key の長さ (64) に収まる、ヘッダーにもフォームにも安全な文字だけを受け付ける
+_IDEMPOTENCY_KEY = re.compile(r'[A-Za-z0-9_.:-]{1,64}')
+
+def init_app(app):
+    app.config.setdefault('ASYNC_PURCHASES', False)
+    app.config.setdefault('PURCHASE_BATCH_SIZE', 500)
+    app.config.setdefault('PURCHASE_POLL_INTERVAL', 1.0)
+    app.add_template_global(new_idempotency_key, 'idempotency_key')
+    app.extensions['purchase_worker'] = PurchaseWorker(app)
+    app.before_request(_start_worker)
+
+# 再起動前に受け付けた購入も、新しい購入を待たずに処理する。
+# gunicorn で preload したマスタープロセスではスレッドを起動しない (fork した子にロックが引き継がれる) よう、
+# create_app ではなく、ワーカーの fork 後 (prefork.after_fork) か最初のリクエストで起動する
+def _start_worker():
+    if current_app.config['ASYNC_PURCHASES']:
+        current_app.extensions['purchase_worker'].start()
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+def parse_idempotency_key(value):
+    if not value:
+        return None
+    if not _IDEMPOTENCY_KEY.fullmatch(value):
+        raise BadRequest('Idempotency key must be 1-64 letters, digits, "_", ".", ":" or "-".')
+    return value
+
+# 売上の集計には、キャッシュ (古い価格が残りうる) ではなく購入と同じトランザクションで読んだ価格を使う
+def _current_prices(product_ids):
+    return dict(db.session.execute(db.select(Product.id, Product.price).where(Product.id.in_(product_ids))).all())
+
+# 商品をまとめて 1 回の INSERT で購入し、売上の集計にも同じトランザクションで加算する
+def purchase_products(user_id, products):
+    prices = _current_prices({product.id for product in products})
+    db.session.execute(
+        db.insert(PurchaseTransaction),
+        [{'user_id': user_id, 'product_id': product.id} for product in products],
+    )
+    record_sales((product.id, prices[product.id]) for product in products)
+    db.session.commit()
+
+def _status(purchase_request):
+    return PurchaseStatus(purchase_request.id, purchase_request.status, json.loads(purchase_request.product_ids))
+
+# 同じキーの受付が既にあれば None を返す。同時に送られた場合は先のトランザクションが終わるまで一意制約で待たされる
+def _claim(user_id, key, product_ids, status):
+    stmt = (
+        dialect_insert(PurchaseRequest)
+        .values(user_id=user_id, idempotency_key=key, product_ids=json.dumps(product_ids), status=status)
+        .on_conflict_do_nothing(index_elements=['user_id', 'idempotency_key'])
+        .returning(PurchaseRequest.id)
+    )
+    return db.session.execute(stmt).scalar()
+
+def _existing(user_id, key):
+    db.session.rollback()
+    return find_purchase(user_id, key)
+
+# 購入後にカートが空になっていても再送に元の結果を返せるよう、カートより先に確認する
+def find_purchase(user_id, key):
+    if key is None:
+        return None
+    purchase_request = db.session.execute(
+        db.select(PurchaseRequest).filter_by(user_id=user_id, idempotency_key=key)
+    ).scalar_one_or_none()
+    return _status(purchase_request) if purchase_request is not None else None
+
+def submit_purchase(user_id, products, key=None):
+    product_ids = [product.id for product in products]
+
+    if current_app.config['ASYNC_PURCHASES']:
+        return enqueue_purchase(user_id, product_ids, key or new_idempotency_key())
+
+    if key is None:
+        purchase_products(user_id, products)
+        return PurchaseStatus(None, COMPLETED, product_ids)
+
+    # 受付と購入を同じトランザクションで記録するため、再送は元の結果を返すだけになる
+    request_id = _claim(user_id, key, product_ids, COMPLETED)
+    if request_id is None:
+        return _existing(user_id, key)
+
+    purchase_products(user_id, products)
+    return PurchaseStatus(request_id, COMPLETED, product_ids)
+
+def enqueue_purchase(user_id, product_ids, key):
+    request_id = _claim(user_id, key, product_ids, QUEUED)
+    if request_id is None:
+        return _existing(user_id, key)
+
+    db.session.commit()
+    current_app.extensions['purchase_worker'].notify()
+    return PurchaseStatus(request_id, QUEUED, product_ids)
+
+def get_purchase_status(user_id, request_id):
+    purchase_request = db.session.execute(
+        db.select(PurchaseRequest).filter_by(id=request_id, user_id=user_id)
+    ).scalar_one_or_none()
+    return _status(purchase_request) if purchase_request is not None else None
+
+# 未処理の受付をまとめて取り出し、1 回の INSERT とコミットで購入する
+def process_queued_purchases(batch_size):
+    purchase_requests = db.session.execute(
+        db.select(PurchaseRequest)
+        .where(PurchaseRequest.status == QUEUED)
+        .order_by(PurchaseRequest.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+
+    if not purchase_requests:
+        db.session.rollback()
+        return 0
+
+    requested = {purchase_request.id: json.loads(purchase_request.product_ids) for purchase_request in purchase_requests}
+    product_ids = {product_id for ids in requested.values() for product_id in ids}
+    prices = _current_prices(product_ids)
+
+    rows = []
+    for purchase_request in purchase_requests:
+        # 受付後に削除された商品は購入しない
+        purchased = [product_id for product_id in requested[purchase_request.id] if product_id in prices]
+        purchase_request.product_ids = json.dumps(purchased)
+        purchase_request.status = COMPLETED if purchased else FAILED
+        rows.extend({'user_id': purchase_request.user_id, 'product_id': product_id} for product_id in purchased)
+
+    if rows:
+        db.session.execute(db.insert(PurchaseTransaction), rows)
+        record_sales((row['product_id'], prices[row['product_id']]) for row in rows)
+    db.session.commit()
+    return len(purchase_requests)
+
+# 非同期モードで受付を処理するワーカースレッド。受付はデータベースにあるため、再起動しても失われない
+class PurchaseWorker:
+    def __init__(self, app):
+        self.app = app
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def notify(self):
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        # fork 後の子プロセスではスレッドが引き継がれないため、プロセスごとに起動する
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='purchase-worker', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join(timeout)
+
+    # 起動したらまず残っている受付を処理し、その後は通知か一定時間ごとに処理する
+    def _run(self):
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    while process_queued_purchases(self.app.config['PURCHASE_BATCH_SIZE']):
+                        pass
+                except Exception:
+                    self.app.logger.exception('Failed to process queued purchases')
+                    db.session.rollback()
+            self._wakeup.wait(self.app.config['PURCHASE_POLL_INTERVAL'])
+            self._wakeup.clear()
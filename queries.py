@@ -0,0 +1,105 @@
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from . import db
+from .models import Product, PurchaseTransaction
+
+Page = namedtuple('Page', ['items', 'prev_cursor', 'next_cursor'])
+
+# 商品一覧はテンプレートと ETag で使う列だけを id のキーセットで取得する
+def select_product_page(after=None, before=None, per_page=20):
+    stmt = db.select(Product.id, Product.name, Product.price, Product.updated)
+
+    if before is not None:
+        stmt = stmt.where(Product.id < before).order_by(Product.id.desc())
+    else:
+        if after is not None:
+            stmt = stmt.where(Product.id > after)
+        stmt = stmt.order_by(Product.id)
+
+    # 次のページの有無を判定するために 1 件多く取得する
+    return stmt.limit(per_page + 1)
+
+def fetch_product_page(after=None, before=None, per_page=20):
+    rows = db.session.execute(select_product_page(after=after, before=before, per_page=per_page)).all()
+    return product_page(rows, after=after, before=before, per_page=per_page)
+
+# 取得した行からページを作る (非同期のセッションで取得した場合にも使う)
+def product_page(rows, after=None, before=None, per_page=20):
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if before is not None:
+        rows.reverse()
+        prev_cursor = rows[0].id if rows and has_more else None
+        next_cursor = rows[-1].id if rows else None
+    else:
+        prev_cursor = rows[0].id if rows and after is not None else None
+        next_cursor = rows[-1].id if rows and has_more else None
+
+    return Page(rows, prev_cursor, next_cursor)
+
+# ページに含まれる商品の最終更新日時 (ETag と Last-Modified に使う)
+def page_last_modified(page):
+    return max((row.updated for row in page.items), default=None)
+
+# 購入履歴は created, id の降順で、商品の列も同じクエリで JOIN して取得する
+def select_transaction_page(user_id, before=None, per_page=20):
+    stmt = (
+        db.select(
+            PurchaseTransaction.id,
+            PurchaseTransaction.created,
+            Product.name.label('product_name'),
+            Product.price.label('product_price'),
+        )
+        .join(PurchaseTransaction.product)
+        .where(PurchaseTransaction.user_id == user_id)
+    )
+
+    if before is not None:
+        stmt = stmt.where(db.tuple_(PurchaseTransaction.created, PurchaseTransaction.id) < before)
+
+    return stmt.order_by(PurchaseTransaction.created.desc(), PurchaseTransaction.id.desc()).limit(per_page + 1)
+
+def fetch_transaction_page(user_id, before=None, per_page=20):
+    rows = db.session.execute(select_transaction_page(user_id, before=before, per_page=per_page)).all()
+    return transaction_page(rows, per_page=per_page)
+
+def transaction_page(rows, per_page=20):
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    next_cursor = encode_transaction_cursor(rows[-1]) if rows and has_more else None
+    return Page(rows, None, next_cursor)
+
+def encode_transaction_cursor(row):
+    return f'{row.created.isoformat()}_{row.id}'
+
+def decode_transaction_cursor(cursor):
+    created, _, id = cursor.rpartition('_')
+    return datetime.fromisoformat(created), int(id)
+
+# 書き出し用。利用者ごとの書き出しは購入履歴と同じ並び順でインデックスを使い、全件の書き出しは id 順にする
+def select_transaction_export(user_id=None):
+    stmt = (
+        db.select(
+            PurchaseTransaction.id,
+            PurchaseTransaction.created,
+            PurchaseTransaction.user_id,
+            PurchaseTransaction.product_id,
+            Product.name.label('product_name'),
+            Product.price.label('product_price'),
+        )
+        .join(PurchaseTransaction.product)
+    )
+
+    if user_id is not None:
+        return stmt.where(PurchaseTransaction.user_id == user_id).order_by(
+            PurchaseTransaction.created.desc(), PurchaseTransaction.id.desc(),
+        )
+
+    return stmt.order_by(PurchaseTransaction.id)
+
+# ON CONFLICT を使える INSERT 文 (PostgreSQL と、テストのレプリカなどで使う SQLite に対応する)
+def dialect_insert(model):
+    dialect = db.session.get_bind(clause=db.insert(model)).dialect.name
+    return (postgresql if dialect == 'postgresql' else sqlite).insert(model)
@@ -0,0 +1,143 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache, wraps
+import math
+import threading
+import time
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+from .cache import LRUCache
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+def init_app(app):
+    app.config.setdefault('RATE_LIMIT_ENABLED', True)
+    app.config.setdefault('RATE_LIMIT_BACKEND', 'memory')
+    app.config.setdefault('RATE_LIMIT_URL', None)
+    app.config.setdefault('RATE_LIMIT_SIZE', 100000)
+    app.config.setdefault('RATE_LIMITS', {})
+
+    if app.config['RATE_LIMIT_BACKEND'] == 'memory':
+        store = MemoryStore(maxsize=app.config['RATE_LIMIT_SIZE'])
+    elif app.config['RATE_LIMIT_BACKEND'] == 'redis':
+        if not app.config['RATE_LIMIT_URL']:
+            raise ValueError('RATE_LIMIT_URL is required when RATE_LIMIT_BACKEND is redis')
+        store = RedisStore.from_url(app.config['RATE_LIMIT_URL'], prefix='ratelimit:')
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {app.config['RATE_LIMIT_BACKEND']!r}")
+
+    app.extensions['rate_limit_store'] = store
+    app.extensions['metrics'].counter('http_rate_limited_total', 'Requests rejected by rate limits.', ['endpoint', 'scope'])
+
+# "5/minute" や "100/3600" (秒数) の形式の制限を (回数, 秒数) にする
+@lru_cache(maxsize=None)
+def parse_limit(limit):
+    count, _, period = limit.partition('/')
+    period = period.strip()
+    seconds = PERIODS.get(period) or (int(period) if period.isdigit() else None)
+    if not count.strip().isdigit() or not seconds:
+        raise ValueError(f"Invalid rate limit: {limit!r}")
+    return int(count), seconds
+
+# 直前の窓の回数を経過時間に応じて減らして足し合わせ、固定窓の境界でまとめて通されないようにする。
+# current にはこのリクエストも含まれる (拒否したリクエストも数えるため、試行を続けると待ち時間が延びる)。
+# 許可するかどうかと、拒否する場合に次に許可されるまでの秒数を返す
+def sliding_window(previous, current, elapsed, limit, window):
+    if previous * (window - elapsed) / window + current <= limit:
+        return True, 0
+
+    # 今の窓のうちに直前の窓の回数が十分に減る場合
+    if previous and current < limit:
+        at = window * (1 - (limit - current - 1) / previous)
+        if at < window:
+            return False, at - elapsed
+
+    # 次の窓では今の窓の回数が直前の窓の回数になる
+    at = window * (1 - (limit - 1) / current) if current > limit - 1 else 0
+    return False, window - elapsed + at
+
+class RateLimitStore(ABC):
+    # key の now を含む窓の回数を 1 増やし、(直前の窓の回数, 今の窓の回数, 窓の開始からの経過秒数) を返す
+    @abstractmethod
+    def hit(self, key, window, now):
+        pass
+
+# 回数はキーごとに 2 つだけ持ち、古いキーは LRU で追い出す
+class MemoryStore(RateLimitStore):
+    def __init__(self, maxsize=100000):
+        self.counters = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def hit(self, key, window, now):
+        index, elapsed = divmod(now, window)
+        with self._lock:
+            start, previous, current = self.counters.get(key, (index, 0, 0))
+            if start == index - 1:
+                previous, current = current, 0
+            elif start != index:
+                previous, current = 0, 0
+            current += 1
+            self.counters.set(key, (index, previous, current), ttl=window * 2)
+        return previous, current, elapsed
+
+# 複数プロセスで制限を共有する場合は Redis 互換のサーバーを使う。1 往復で窓ごとのキーを増やして直前の窓を読む
+class RedisStore(RateLimitStore):
+    def __init__(self, client, prefix=''):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def hit(self, key, window, now):
+        index, elapsed = divmod(now, window)
+        index = int(index)
+        pipeline = self.client.pipeline()
+        pipeline.incr(f'{self.prefix}{key}:{index}')
+        pipeline.expire(f'{self.prefix}{key}:{index}', window * 2)
+        pipeline.get(f'{self.prefix}{key}:{index - 1}')
+        current, _, previous = pipeline.execute()
+        return int(previous or 0), current, elapsed
+
+# リバースプロキシの後ろでは PROXY_FIX_X_FOR を指定し、X-Forwarded-For からクライアントのアドレスを得る
+def _ip():
+    return request.remote_addr
+
+def _email():
+    email = request.form.get('email', '').strip().lower()
+    return email or None
+
+# 制限の単位ごとにキーを取り出す。None の場合はその単位では制限しない
+KEY_FUNCTIONS = {'ip': _ip, 'email': _email}
+
+def check_rate_limits(endpoint, limits):
+    store = current_app.extensions['rate_limit_store']
+    now = time.time()
+    for scope, limit in limits.items():
+        if not limit:
+            continue
+        value = KEY_FUNCTIONS[scope]()
+        if value is None:
+            continue
+
+        count, window = parse_limit(limit)
+        previous, current, elapsed = store.hit(f'{endpoint}:{scope}:{value}', window, now)
+        allowed, retry_after = sliding_window(previous, current, elapsed, count, window)
+        if not allowed:
+            current_app.extensions['metrics'].get('http_rate_limited_total').inc(endpoint=endpoint, scope=scope)
+            raise TooManyRequests(retry_after=max(1, math.ceil(retry_after)))
+
+# 制限は RATE_LIMITS[エンドポイント] に {'ip': '30/minute', 'email': '5/minute'} の形式で指定する。
+# ビューより先に確認するため、拒否したリクエストではパスワードのハッシュ化やデータベースへの問い合わせを行わない
+def rate_limit(methods=('POST',)):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if current_app.config['RATE_LIMIT_ENABLED'] and request.method in methods:
+                limits = current_app.config['RATE_LIMITS'].get(request.endpoint)
+                if limits:
+                    check_rate_limits(request.endpoint, limits)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
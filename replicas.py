@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+from functools import wraps
+import itertools
+import threading
+import time
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.sql.dml import UpdateBase
+from . import pool
+
+# 参照系のルートでは、直近に書き込みをしていなければリードレプリカから読む
+def read_only(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        replicas = current_app.extensions.get('replicas')
+
+        if replicas is None or _wrote_recently():
+            return view(*args, **kwargs)
+
+        g.replica = replicas.choose()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.replica = None
+
+    return wrapper
+
+# キャッシュに入れる値など、レプリカの遅延で古い値を読むと影響が長く残る読み込みはプライマリから行う
+@contextmanager
+def use_primary():
+    replica = g.get('replica') if has_request_context() else None
+    if replica is None:
+        yield
+        return
+
+    g.replica = None
+    try:
+        yield
+    finally:
+        g.replica = replica
+
+def _wrote_recently():
+    last_write = session.get('last_write')
+    window = current_app.config['REPLICA_READ_YOUR_WRITES_SECONDS']
+    return last_write is not None and time.time() - last_write < window
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get('replica') if has_request_context() else None
+
+        if bind is None and replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return current_app.extensions['replicas'].engines[replica]
+
+        if has_request_context() and (self._flushing or isinstance(clause, UpdateBase)):
+            self.info['wrote'] = True
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+# 書き込みをコミットしたユーザーは、しばらくの間プライマリから読む (read-your-writes)
+@event.listens_for(RoutingSession, 'after_commit')
+def _mark_write(db_session):
+    if db_session.info.pop('wrote', False) and has_request_context() and 'replicas' in current_app.extensions:
+        session['last_write'] = time.time()
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_write(db_session):
+    db_session.info.pop('wrote', None)
+
+# 定期的に疎通を確認し、応答しないレプリカはしばらく振り分けから外す
+class ReplicaSet:
+    def __init__(self, engines, check_interval=10, retry_after=30):
+        self.engines = engines
+        self.keys = list(engines)
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self._cycle = itertools.cycle(self.keys)
+        self._checked = {}
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def _next_key(self):
+        with self._lock:
+            return next(self._cycle)
+
+    def is_healthy(self, key):
+        now = time.monotonic()
+
+        if self._down_until.get(key, 0) > now:
+            return False
+
+        if now - self._checked.get(key, float('-inf')) < self.check_interval:
+            return True
+
+        try:
+            with self.engines[key].connect() as conn:
+                conn.execute(text('SELECT 1'))
+        except Exception:
+            current_app.logger.warning('Replica %s is unavailable', key, exc_info=True)
+            self._down_until[key] = now + self.retry_after
+            return False
+
+        self._checked[key] = now
+        return True
+
+    def choose(self):
+        for _ in range(len(self.keys)):
+            key = self._next_key()
+            if self.is_healthy(key):
+                return key
+
+        # すべてのレプリカが使えない場合はプライマリから読む
+        return None
+
+def init_app(app):
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+    app.config.setdefault('REPLICA_READ_YOUR_WRITES_SECONDS', 5)
+    app.config.setdefault('REPLICA_HEALTH_CHECK_INTERVAL', 10)
+    app.config.setdefault('REPLICA_RETRY_AFTER', 30)
+
+    if not app.config['SQLALCHEMY_REPLICA_URIS']:
+        return
+
+    engine_options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    engines = {
+        f'replica_{i}': create_engine(uri, **engine_options)
+        for i, uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS'])
+    }
+    for key, engine in engines.items():
+        pool.instrument_engine(engine, app.extensions['metrics'], name=key)
+
+    app.extensions['replicas'] = ReplicaSet(
+        engines,
+        check_interval=app.config['REPLICA_HEALTH_CHECK_INTERVAL'],
+        retry_after=app.config['REPLICA_RETRY_AFTER'],
+    )
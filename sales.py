@@ -0,0 +1,89 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+import click
+from flask.cli import AppGroup
+from . import db
+from .models import Product, ProductSalesStats, PurchaseTransaction
+from .queries import dialect_insert
+
+sales_cli = AppGroup('sales', help='Maintain the product sales aggregates.')
+
+def init_app(app):
+    app.config.setdefault('BEST_SELLERS_LIMIT', 20)
+    app.cli.add_command(sales_cli)
+
+# 購入と同じトランザクションで集計に加算する。purchases は (product_id, price) の組
+def record_sales(purchases, purchased=None):
+    purchased = purchased or datetime.now(timezone.utc)
+    totals = defaultdict(lambda: [0, 0])
+    for product_id, price in purchases:
+        totals[product_id][0] += 1
+        totals[product_id][1] += price
+
+    if not totals:
+        return
+
+    # 同時に購入された場合にデッドロックしないよう、行をロックする順番を揃える
+    stmt = dialect_insert(ProductSalesStats).values([
+        {'product_id': product_id, 'count': count, 'revenue': revenue, 'last_purchased': purchased}
+        for product_id, (count, revenue) in sorted(totals.items())
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ProductSalesStats.product_id],
+        set_={
+            'count': ProductSalesStats.count + stmt.excluded.count,
+            'revenue': ProductSalesStats.revenue + stmt.excluded.revenue,
+            'last_purchased': stmt.excluded.last_purchased,
+        },
+    )
+    db.session.execute(stmt)
+
+# 購入履歴からすべて集計し直す。売上は購入時ではなく現在の価格で計算される
+def rebuild():
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # 集計し直している間に加算された分が消えないよう、購入による加算を待たせる
+        db.session.execute(db.text('LOCK TABLE product_sales_stats IN EXCLUSIVE MODE'))
+
+    db.session.execute(db.delete(ProductSalesStats))
+    db.session.execute(db.insert(ProductSalesStats).from_select(
+        ['product_id', 'count', 'revenue', 'last_purchased'],
+        db.select(
+            PurchaseTransaction.product_id,
+            db.func.count(),
+            db.func.sum(Product.price),
+            db.func.max(PurchaseTransaction.created),
+        )
+        .join(PurchaseTransaction.product)
+        .group_by(PurchaseTransaction.product_id),
+    ))
+    db.session.commit()
+
+def select_best_sellers(limit):
+    return (
+        db.select(
+            Product.id,
+            Product.name,
+            ProductSalesStats.count,
+            ProductSalesStats.revenue,
+            ProductSalesStats.last_purchased,
+        )
+        .join(ProductSalesStats, ProductSalesStats.product_id == Product.id)
+        .order_by(ProductSalesStats.count.desc(), ProductSalesStats.product_id)
+        .limit(limit)
+    )
+
+def best_sellers(limit):
+    return db.session.execute(select_best_sellers(limit)).all()
+
+def sales_totals():
+    return db.session.execute(db.select(
+        db.func.count(ProductSalesStats.product_id).label('products'),
+        db.func.coalesce(db.func.sum(ProductSalesStats.count), 0).label('count'),
+        db.func.coalesce(db.func.sum(ProductSalesStats.revenue), 0).label('revenue'),
+    )).one()
+
+@sales_cli.command('rebuild')
+def rebuild_command():
+    rebuild()
+    totals = sales_totals()
+    click.echo(f"Rebuilt sales stats for {totals.products} products ({totals.count} purchases)")
@@ -0,0 +1,193 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from . import db
+from .models import Product, product_name_tsvector
+
+SearchResult = namedtuple('SearchResult', ['id', 'name', 'price'])
+
+_WORD = re.compile(r'\w+')
+
+# 複数の単語で絞り込む場合に、候補を調べる件数の上限 (typeahead の応答時間を一定に保つ)
+MAX_CANDIDATES = 1000
+
+logger = logging.getLogger(__name__)
+
+def init_app(app):
+    app.config.setdefault('SEARCH_PER_PAGE', 20)
+    app.config.setdefault('TYPEAHEAD_LIMIT', 10)
+    app.config.setdefault('SEARCH_INDEX_TTL', 60)
+    app.extensions['search_index'] = PrefixIndex(ttl=app.config['SEARCH_INDEX_TTL'])
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+# 各単語を前方一致させ、すべての単語を含む商品を返す tsquery を作る
+def to_prefix_tsquery(q):
+    words = _words(q)
+    return ' & '.join(f'{word}:*' for word in words) if words else None
+
+def select_product_search(q, page=1, per_page=20):
+    tsquery = db.func.to_tsquery(db.literal_column("'simple'"), to_prefix_tsquery(q))
+    rank = db.func.ts_rank(product_name_tsvector, tsquery)
+    return (
+        db.select(Product.id, Product.name, Product.price)
+        .where(product_name_tsvector.bool_op('@@')(tsquery))
+        .order_by(rank.desc(), Product.name, Product.id)
+        .offset((page - 1) * per_page)
+        .limit(per_page + 1)
+    )
+
+def search_products(q, page=1, per_page=20):
+    if to_prefix_tsquery(q) is None:
+        return [], False
+
+    rows = db.session.execute(select_product_search(q, page, per_page)).all()
+    return [SearchResult(*row) for row in rows[:per_page]], len(rows) > per_page
+
+# 商品名の単語をソートした配列に持ち、二分探索で前方一致する商品を探す
+class PrefixIndex:
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._data = ([], [])
+        self._built = None
+        self._stale = True
+        self._version = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def build(self, products, version=None):
+        entries = sorted(
+            (word, product.name.lower(), product.id, SearchResult(product.id, product.name, product.price))
+            for product in products
+            for word in set(_words(product.name))
+        )
+        # 検索中のスレッドが古い配列を参照していても壊れないよう、まとめて差し替える
+        self._data = ([entry[0] for entry in entries], [entry[3] for entry in entries])
+        self._version = version
+        self._built = time.monotonic()
+
+    def mark_stale(self):
+        self._stale = True
+
+    def _needs_build(self):
+        if self._stale or self._built is None:
+            return True
+        return self.ttl is not None and time.monotonic() - self._built > self.ttl
+
+    # load_version は商品の件数と最終更新日時のような安く求められる値を返す。前回から変わっていなければ全件を読み込み直さない。
+    # バージョンを先に読むため、その後の変更は次のバージョンの確認で見つかる
+    def _rebuild(self, load, load_version=None):
+        try:
+            version = load_version() if load_version is not None else None
+            if version is not None and version == self._version and self._built is not None:
+                self._built = time.monotonic()
+                return
+            self.build(load(), version)
+        except Exception:
+            self._stale = True
+            raise
+
+    def _rebuild_in_background(self, load, load_version):
+        try:
+            self._rebuild(load, load_version)
+        except Exception:
+            logger.exception('Failed to rebuild the typeahead index')
+
+    # 初回だけは作り終わるまで待ち、以降は古いインデックスで検索を続けながらバックグラウンドで作り直す
+    def ensure_built(self, load, load_version=None):
+        if not self._needs_build():
+            return
+        with self._lock:
+            if not self._needs_build() or (self._thread is not None and self._thread.is_alive()):
+                return
+            # 再構築中に変更されたら次の検索で作り直す
+            self._stale = False
+            if self._built is None:
+                self._rebuild(load, load_version)
+            else:
+                self._thread = threading.Thread(target=self._rebuild_in_background, args=(load, load_version), name='search-index', daemon=True)
+                self._thread.start()
+
+    def wait(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def lookup(self, prefix, limit):
+        keys, entries = self._data
+        words = _words(prefix)
+        if not words:
+            return []
+
+        # 最後の単語で前方一致させ、それ以外の単語も商品名に含まれるものに絞り込む
+        *others, last = words
+        results = []
+        seen = set()
+        start = bisect.bisect_left(keys, last)
+        for i in range(start, min(start + MAX_CANDIDATES, len(keys))):
+            if not keys[i].startswith(last):
+                break
+            entry = entries[i]
+            if entry.id in seen:
+                continue
+            name_words = _words(entry.name)
+            if all(any(word.startswith(other) for word in name_words) for other in others):
+                seen.add(entry.id)
+                results.append(entry)
+                if len(results) >= limit:
+                    break
+        return results
+
+def _load_products():
+    rows = db.session.execute(db.select(Product.id, Product.name, Product.price)).all()
+    return [SearchResult(*row) for row in rows]
+
+def _load_version():
+    return tuple(db.session.execute(db.select(db.func.count(), db.func.max(Product.updated)).select_from(Product)).one())
+
+def _ensure_built(app):
+    # バックグラウンドのスレッドでも読み込めるよう、アプリケーションコンテキストを作って読み込む
+    def load():
+        with app.app_context():
+            return _load_products()
+
+    def load_version():
+        with app.app_context():
+            return _load_version()
+
+    app.extensions['search_index'].ensure_built(load, load_version)
+
+# preload したマスタープロセス (prefork.warmup) で作っておき、各ワーカーの最初の入力補完で全件を読み込まないようにする
+def build_index(app):
+    _ensure_built(app)
+
+def typeahead(prefix, limit):
+    app = current_app._get_current_object()
+    _ensure_built(app)
+    return app.extensions['search_index'].lookup(prefix, limit)
+
+def mark_stale():
+    if has_app_context() and 'search_index' in current_app.extensions:
+        current_app.extensions['search_index'].mark_stale()
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+def _product_changed(mapper, connection, target):
+    object_session(target).info['products_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _rebuild_after_commit(session):
+    if session.info.pop('products_changed', False):
+        mark_stale()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_product_changes(session):
+    session.info.pop('products_changed', None)
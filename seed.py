@@ -0,0 +1,185 @@
+import csv
+from datetime import datetime, timedelta, timezone
+import io
+import itertools
+import json
+import random
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from . import db, passwords
+from .models import Product, PurchaseTransaction, User
+
+seed_cli = AppGroup('seed', help='Bulk load users, products and purchase transactions.')
+
+CHUNK_SIZE = 10000
+
+def init_app(app):
+    app.config.setdefault('SEED_CHUNK_SIZE', CHUNK_SIZE)
+    app.cli.add_command(seed_cli)
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+# CSV (ヘッダー付き) と JSONL を 1 行ずつ読み込む
+def read_rows(path):
+    with open(path, newline='', encoding='utf8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def _coercer(table, now):
+    # 列の型は行ごとに調べず、最初に一度だけ求めておく
+    columns = [(column.name, column.type.python_type) for column in table.columns]
+
+    def coerce(row):
+        values = {}
+        for name, python_type in columns:
+            value = row.get(name)
+            if value == '':
+                value = None
+            elif isinstance(value, str) and python_type is int:
+                value = int(value)
+            elif isinstance(value, str) and python_type is datetime:
+                value = datetime.fromisoformat(value)
+
+            # COPY ではモデルの既定値が使われないため、作成日時と更新日時はここで埋める
+            if value is None and name in ('created', 'updated'):
+                value = now
+            if value is not None or name in row:
+                values[name] = value
+        return values
+
+    return coerce
+
+def _copy(conn, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row.get(column) for column in columns])
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+# PostgreSQL では COPY、それ以外のエンジンでは executemany でチャンクごとに投入する
+def bulk_load(table, rows, chunk_size=None, use_copy=None, prepare=None):
+    chunk_size = chunk_size or current_app.config['SEED_CHUNK_SIZE']
+    coerce = _coercer(table, datetime.now(timezone.utc))
+    loaded = 0
+
+    with db.engine.begin() as conn:
+        if use_copy is None:
+            use_copy = conn.dialect.name == 'postgresql'
+
+        for chunk in _chunks(rows, chunk_size):
+            if prepare is not None:
+                chunk = prepare(chunk)
+            chunk = [coerce(row) for row in chunk]
+            columns = list(chunk[0])
+            chunk = [{column: row.get(column) for column in columns} for row in chunk]
+
+            if use_copy:
+                _copy(conn, table, columns, chunk)
+            else:
+                conn.execute(table.insert(), chunk)
+            loaded += len(chunk)
+
+        # id を指定して投入した場合に、以降の INSERT で重複しないようシーケンスを進める
+        if conn.dialect.name == 'postgresql' and loaded:
+            conn.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), coalesce(max(id), 1), max(id) IS NOT NULL) FROM {table.name}"
+            ))
+
+    return loaded
+
+def _hash_passwords(chunk):
+    hashes = passwords.hash_many([row['password'] for row in chunk])
+    return [{**row, 'password': hashed} for row, hashed in zip(chunk, hashes)]
+
+def load_users(rows, **kwargs):
+    return bulk_load(User.__table__, rows, prepare=_hash_passwords, **kwargs)
+
+def load_products(rows, **kwargs):
+    return bulk_load(Product.__table__, rows, **kwargs)
+
+def load_transactions(rows, **kwargs):
+    return bulk_load(PurchaseTransaction.__table__, rows, **kwargs)
+
+def generate_users(count, password, start=1):
+    for i in range(start, start + count):
+        yield {'name': f"user{i}", 'email': f"user{i}@example.com", 'password': password}
+
+def generate_products(count, seed=0, start=1):
+    rng = random.Random(seed)
+    for i in range(start, start + count):
+        yield {'name': f"product{i}", 'price': rng.randint(100, 10000)}
+
+# 既存のユーザーと商品を無作為に組み合わせ、過去 1 年間に分散させる
+def generate_transactions(count, user_ids, product_ids, seed=0):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    for _ in range(count):
+        created = now - timedelta(seconds=rng.randint(0, 86400 * 365))
+        yield {
+            'user_id': rng.choice(user_ids),
+            'product_id': rng.choice(product_ids),
+            'created': created,
+            'updated': created,
+        }
+
+def _ids(model):
+    return db.session.execute(db.select(model.id)).scalars().all()
+
+# 生成するデータの名前が既存の行と重複しないよう、最大の id の次から番号を振る
+def _next_number(model):
+    return (db.session.scalar(db.select(db.func.max(model.id))) or 0) + 1
+
+def _report(name, loaded, started):
+    elapsed = time.perf_counter() - started
+    click.echo(f"Loaded {loaded} {name} in {elapsed:.2f}s ({loaded / elapsed if elapsed else 0:.0f} rows/s)")
+
+@seed_cli.command('users')
+@click.option('--file', 'path', type=click.Path(exists=True, dir_okay=False), help='CSV or JSONL with name, email and password.')
+@click.option('--count', type=int, default=0, help='Number of synthetic users to generate.')
+@click.option('--password', default='password', show_default=True, help='Password of the synthetic users.')
+@click.option('--chunk-size', type=int, default=None)
+def seed_users(path, count, password, chunk_size):
+    started = time.perf_counter()
+    rows = read_rows(path) if path else generate_users(count, password, start=_next_number(User))
+    _report('users', load_users(rows, chunk_size=chunk_size), started)
+
+@seed_cli.command('products')
+@click.option('--file', 'path', type=click.Path(exists=True, dir_okay=False), help='CSV or JSONL with name and price.')
+@click.option('--count', type=int, default=0, help='Number of synthetic products to generate.')
+@click.option('--seed', 'seed_value', type=int, default=0)
+@click.option('--chunk-size', type=int, default=None)
+def seed_products(path, count, seed_value, chunk_size):
+    started = time.perf_counter()
+    rows = read_rows(path) if path else generate_products(count, seed=seed_value, start=_next_number(Product))
+    _report('products', load_products(rows, chunk_size=chunk_size), started)
+
+@seed_cli.command('transactions')
+@click.option('--file', 'path', type=click.Path(exists=True, dir_okay=False), help='CSV or JSONL with user_id, product_id and created.')
+@click.option('--count', type=int, default=0, help='Number of synthetic transactions to generate.')
+@click.option('--seed', 'seed_value', type=int, default=0)
+@click.option('--chunk-size', type=int, default=None)
+def seed_transactions(path, count, seed_value, chunk_size):
+    started = time.perf_counter()
+    if path:
+        rows = read_rows(path)
+    else:
+        user_ids, product_ids = _ids(User), _ids(Product)
+        if not user_ids or not product_ids:
+            raise click.UsageError('Seed users and products before generating transactions.')
+        rows = generate_transactions(count, user_ids, product_ids, seed=seed_value)
+    _report('transactions', load_transactions(rows, chunk_size=chunk_size), started)
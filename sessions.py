@@ -0,0 +1,293 @@
+from datetime import datetime, timedelta, timezone
+import random
+import secrets
+import click
+from flask import current_app, session
+from flask.cli import AppGroup
+from flask.json.tag import JSONTag, TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from .cache import LRUCache
+
+# カートを set のまま保存できるようにタグを追加する
+class TagSet(JSONTag):
+    __slots__ = ()
+    key = ' s'
+
+    def check(self, value):
+        return isinstance(value, (set, frozenset))
+
+    def to_json(self, value):
+        return [self.serializer.tag(item) for item in value]
+
+    def to_python(self, value):
+        return set(value)
+
+serializer = TaggedJSONSerializer()
+serializer.register(TagSet)
+
+sessions_cli = AppGroup('sessions', help='Manage server-side sessions.')
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def generate_sid():
+    return secrets.token_urlsafe(32)
+
+def generate_version():
+    return secrets.token_urlsafe(8)
+
+# version は書き込みのたびに変わり、Cookie に sid と一緒に保存される。キャッシュ以外のストアでは使わない
+class SessionStore:
+    def get(self, sid, version=None):
+        raise NotImplementedError
+
+    def set(self, sid, data, ttl, version=None):
+        raise NotImplementedError
+
+    def delete(self, sid, version=None):
+        raise NotImplementedError
+
+    # 期限切れのセッションを削除し、削除した件数を返す
+    def purge(self):
+        return 0
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, maxsize=10000):
+        self.cache = LRUCache(maxsize=maxsize)
+
+    def get(self, sid, version=None):
+        return self.cache.get(sid)
+
+    def set(self, sid, data, ttl, version=None):
+        self.cache.set(sid, data, ttl=ttl)
+
+    def delete(self, sid, version=None):
+        self.cache.delete(sid)
+
+# リクエスト中の ORM セッションの状態に影響されないよう、エンジンから直接読み書きする
+# 期限切れのセッションは新しいセッションを書き込むときに purge_probability の確率で削除する
+class SQLAlchemySessionStore(SessionStore):
+    def __init__(self, db, purge_probability=0.0):
+        self.db = db
+        self.purge_probability = purge_probability
+
+    @property
+    def table(self):
+        from .models import StoredSession
+        return StoredSession.__table__
+
+    def get(self, sid, version=None):
+        table = self.table
+        stmt = self.db.select(table.c.data).where(table.c.id == sid, table.c.expires > _utcnow())
+
+        with self.db.engine.connect() as conn:
+            return conn.execute(stmt).scalar_one_or_none()
+
+    def set(self, sid, data, ttl, version=None):
+        table = self.table
+        values = {'data': data, 'expires': _utcnow() + timedelta(seconds=ttl)}
+
+        with self.db.engine.begin() as conn:
+            result = conn.execute(self.db.update(table).where(table.c.id == sid).values(**values))
+            if result.rowcount == 0:
+                conn.execute(self.db.insert(table).values(id=sid, **values))
+                inserted = True
+            else:
+                inserted = False
+
+        if inserted and random.random() < self.purge_probability:
+            self.purge()
+
+    def delete(self, sid, version=None):
+        table = self.table
+
+        with self.db.engine.begin() as conn:
+            conn.execute(self.db.delete(table).where(table.c.id == sid))
+
+    def purge(self):
+        table = self.table
+
+        with self.db.engine.begin() as conn:
+            return conn.execute(self.db.delete(table).where(table.c.expires <= _utcnow())).rowcount
+
+# よく使われるセッションはプロセス内のキャッシュから返し、ストレージへのアクセスを省く。
+# キャッシュは (sid, version) ごとに持つため、別のワーカーで書き込まれたセッションは Cookie の version が変わってキャッシュを外れる
+class CachedSessionStore(SessionStore):
+    def __init__(self, store, maxsize=10000, ttl=60):
+        self.store = store
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, sid, version=None):
+        # version のない Cookie ではどの書き込みの後かわからないため、キャッシュを使わない
+        if version is None:
+            return self.store.get(sid)
+
+        data = self.cache.get((sid, version))
+
+        if data is None:
+            data = self.store.get(sid)
+            if data is not None:
+                self.cache.set((sid, version), data)
+
+        return data
+
+    def set(self, sid, data, ttl, version=None):
+        self.store.set(sid, data, ttl)
+        if version is not None:
+            self.cache.set((sid, version), data, ttl=min(ttl, self.cache.ttl))
+
+    def delete(self, sid, version=None):
+        self.store.delete(sid)
+        self.cache.delete((sid, version))
+
+    def purge(self):
+        return self.store.purge()
+
+class ServerSideSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, version=None, new=False, signed=False):
+        super().__init__(initial)
+        self.sid = sid
+        self.version = version
+        self.new = new
+        # ストレージではなく署名付きの Cookie から読み込んだ
+        self.signed = signed
+        self.previous_sid = None
+
+    # サインインとサインアウトでは sid を作り直し、事前に知られた sid を使い続けられないようにする (session fixation)
+    def regenerate(self):
+        if self.previous_sid is None and not self.new:
+            self.previous_sid = (self.sid, self.version)
+        self.sid = generate_sid()
+        self.modified = True
+
+def regenerate_session():
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+# サインイン前のセッションには CSRF トークンしか入らないため、ストレージには書き込まずに署名付きの Cookie に入れる。
+# サインインしていないクライアントがフォームを開くたびにセッションの行が増えないようにする
+class ServerSideSessionInterface(SessionInterface):
+    session_class = ServerSideSession
+    sid_length = 43
+    version_length = 11
+    cookie_keys = frozenset({'csrf_token'})
+    signed_prefix = '~'
+
+    def __init__(self, store):
+        self.store = store
+
+    def generate_sid(self):
+        return generate_sid()
+
+    # Cookie は "sid.version" の形式。version のない古い Cookie も読み込む
+    def parse_cookie(self, value):
+        sid, _, version = (value or '').partition('.')
+        if len(sid) != self.sid_length or (version and len(version) != self.version_length):
+            return None, None
+        return sid, version or None
+
+    def get_signing_serializer(self, app):
+        return URLSafeTimedSerializer(app.secret_key, salt='server-side-session', serializer=serializer)
+
+    def open_signed_session(self, app, value):
+        try:
+            data = self.get_signing_serializer(app).loads(value[len(self.signed_prefix):], max_age=int(app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return self.session_class(sid=self.generate_sid(), new=True)
+        return self.session_class(data, sid=self.generate_sid(), new=True, signed=True)
+
+    def open_session(self, app, request):
+        value = request.cookies.get(self.get_cookie_name(app))
+        if value and value.startswith(self.signed_prefix):
+            return self.open_signed_session(app, value)
+
+        sid, version = self.parse_cookie(value)
+
+        if sid:
+            data = self.store.get(sid, version)
+            if data is not None:
+                return self.session_class(serializer.loads(data), sid=sid, version=version)
+
+        return self.session_class(sid=self.generate_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.previous_sid is not None:
+            self.store.delete(*session.previous_sid)
+
+        if not session:
+            if session.modified and (not session.new or session.signed or session.previous_sid is not None):
+                if not session.new:
+                    self.store.delete(session.sid, session.version)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        if session.new and session.keys() <= self.cookie_keys:
+            if not (session.modified or self.should_set_cookie(app, session)):
+                return
+            value = self.signed_prefix + self.get_signing_serializer(app).dumps(dict(session))
+        else:
+            # 変更がなければストレージへの書き込みは行わない
+            if session.modified:
+                ttl = int(app.permanent_session_lifetime.total_seconds())
+                session.version = generate_version()
+                self.store.set(session.sid, serializer.dumps(dict(session)), ttl, session.version)
+
+            if not (session.new or session.modified or self.should_set_cookie(app, session)):
+                return
+            value = f'{session.sid}.{session.version}' if session.version else session.sid
+
+        response.set_cookie(
+            name,
+            value,
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite,
+        )
+        response.vary.add('Cookie')
+
+
+class ServerSideSessions:
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SESSION_BACKEND', 'sqlalchemy')
+        app.config.setdefault('SESSION_CACHE_SIZE', 10000)
+        app.config.setdefault('SESSION_CACHE_TTL', 60)
+        app.config.setdefault('SESSION_PURGE_PROBABILITY', 0.01)
+
+        if app.config['SESSION_BACKEND'] == 'memory':
+            store = MemorySessionStore(maxsize=app.config['SESSION_CACHE_SIZE'])
+        elif app.config['SESSION_BACKEND'] == 'sqlalchemy':
+            store = CachedSessionStore(
+                SQLAlchemySessionStore(self.db, purge_probability=app.config['SESSION_PURGE_PROBABILITY']),
+                maxsize=app.config['SESSION_CACHE_SIZE'],
+                ttl=app.config['SESSION_CACHE_TTL'],
+            )
+        else:
+            raise ValueError(f"Unknown SESSION_BACKEND: {app.config['SESSION_BACKEND']!r}")
+
+        app.session_interface = ServerSideSessionInterface(store)
+        app.cli.add_command(sessions_cli)
+
+# 新しいセッションの書き込み時にも確率的に削除するが、まとめて削除する場合に使う
+@sessions_cli.command('purge')
+def purge_sessions():
+    click.echo(f"Purged {current_app.session_interface.store.purge()} expired sessions")
@@ -0,0 +1,43 @@
+import os
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+
+templates_cli = AppGroup('templates', help='Precompile Jinja templates.')
+
+def init_app(app):
+    app.config.setdefault('TEMPLATE_CACHE_DIR', None)
+    app.cli.add_command(templates_cli)
+
+    # テンプレートのソースのチェックサムも保存されるため、テンプレートを変更した場合は自動的に作り直される
+    if app.config['TEMPLATE_CACHE_DIR']:
+        app.jinja_env.bytecode_cache = _bytecode_cache(app.config['TEMPLATE_CACHE_DIR'])
+
+def _bytecode_cache(directory):
+    os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory)
+
+def compile_templates(app):
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith('.html')]
+    for name in names:
+        # get_template でコンパイルすると、バイトコードがキャッシュに書き込まれる
+        env.get_template(name)
+    return names
+
+# ビルド時に実行しておくと、起動したワーカーは最初のリクエストでもテンプレートをコンパイルせずに済む
+@templates_cli.command('compile')
+@click.option('--directory', type=click.Path(file_okay=False), help='Defaults to TEMPLATE_CACHE_DIR.')
+def compile_command(directory):
+    directory = directory or current_app.config['TEMPLATE_CACHE_DIR']
+    if not directory:
+        raise click.UsageError('Set TEMPLATE_CACHE_DIR or pass --directory.')
+
+    started = time.perf_counter()
+    current_app.jinja_env.bytecode_cache = _bytecode_cache(directory)
+    # 同じプロセスでコンパイル済みのテンプレートはキャッシュに書き込まれないため、読み込み直す
+    current_app.jinja_env.cache.clear()
+    names = compile_templates(current_app)
+    click.echo(f"Compiled {len(names)} templates into {directory} in {time.perf_counter() - started:.2f}s")
@@ -1,5 +1,13 @@
 import pytest
-from .. import create_app, db
+from .. import create_app, db, logs
+from ..models import Product, User
+
+# テストで書き出すログをリポジトリに残さない (モジュール単位のフィクスチャや子プロセスにも効くようセッション単位で設定する)
+@pytest.fixture(scope='session', autouse=True)
+def log_file(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('LOG_FILE', str(tmp_path_factory.mktemp('logs') / 'server.log'))
+        yield
 
 @pytest.fixture()
 def app():
@@ -14,6 +22,7 @@ def app():
     # tear down
     with app.app_context():
         db.drop_all()
+    logs.shutdown(app)
 
 @pytest.fixture()
 def client(app):
@@ -22,3 +31,33 @@ def client(app):
 @pytest.fixture()
 def runner(app):
     return app.test_cli_runner()
+
+@pytest.fixture()
+def user(app):
+    with app.app_context():
+        user = User(name="test", email="test@gmail.com", password="test-password")
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+# 商品を作って id のリストを返す。名前と価格を省略すると product1, product2, ... と 100, 200, ... になる
+@pytest.fixture()
+def create_products(app):
+    def create_products(count=None, names=None, prices=None):
+        count = count or len(names or prices)
+        names = names or [f"product{i}" for i in range(1, count + 1)]
+        prices = prices or [i * 100 for i in range(1, count + 1)]
+        with app.app_context():
+            products = [Product(name=name, price=price) for name, price in zip(names, prices)]
+            db.session.add_all(products)
+            db.session.commit()
+            return [product.id for product in products]
+    return create_products
+
+# クライアントのセッションをサインイン済みにする (ユーザーは user フィクスチャなどで作っておく)
+@pytest.fixture()
+def sign_in():
+    def sign_in(client, email="test@gmail.com"):
+        with client.session_transaction() as session:
+            session['email'] = email
+    return sign_in
@@ -0,0 +1,102 @@
+import gzip
+import brotli
+from .. import db
+from ..models import ProductSalesStats, PurchaseTransaction
+
+def test_requiressign_in(client, sign_in):
+    response = client.get('/api/v1/products')
+    assert response.status_code == 401
+    assert response.json['error'] == 'Unauthorized'
+
+def test_products(app, client, user, create_products, sign_in):
+    app.config['PRODUCTS_PER_PAGE'] = 2
+    create_products(3)
+    sign_in(client)
+
+    response = client.get('/api/v1/products')
+    assert response.status_code == 200
+    assert response.json['items'] == [
+        {'id': 1, 'name': 'product1', 'price': 100},
+        {'id': 2, 'name': 'product2', 'price': 200},
+    ]
+    assert response.json['prev_cursor'] is None
+
+    second = client.get(f"/api/v1/products?after={response.json['next_cursor']}")
+    assert [item['name'] for item in second.json['items']] == ['product3']
+
+    # 変更がなければ 304 を返す
+    response = client.get('/api/v1/products', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+def test_product(app, client, user, create_products, sign_in):
+    product_id, = create_products(1)
+    sign_in(client)
+
+    response = client.get(f'/api/v1/products/{product_id}')
+    assert response.json == {'id': product_id, 'name': 'product1', 'price': 100, 'in_cart': False}
+    etag = response.headers['ETag']
+
+    client.post('/api/v1/cart', json={'product_id': product_id})
+    response = client.get(f'/api/v1/products/{product_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['in_cart'] is True
+
+    assert client.get('/api/v1/products/999').status_code == 404
+
+def test_cart_and_checkout(app, client, user, create_products, sign_in):
+    first, second = create_products(2)
+    sign_in(client)
+
+    response = client.post('/api/v1/cart', json={'product_id': first})
+    assert response.status_code == 201
+    client.post('/api/v1/cart', json={'product_id': second})
+    assert [item['id'] for item in client.get('/api/v1/cart').json['items']] == [first, second]
+
+    assert client.delete(f'/api/v1/cart/{second}').status_code == 204
+    assert [item['id'] for item in client.get('/api/v1/cart').json['items']] == [first]
+
+    response = client.post('/api/v1/checkout', json={})
+    assert response.status_code == 201
+    assert response.json['items'] == [{'id': first, 'name': 'product1', 'price': 100}]
+    assert client.get('/api/v1/cart').json['items'] == []
+
+    with app.app_context():
+        assert db.session.scalar(db.select(db.func.count(PurchaseTransaction.id))) == 1
+        assert db.session.get(ProductSalesStats, first).count == 1
+
+    transactions = client.get('/api/v1/transactions').json
+    assert transactions['items'][0]['product_name'] == 'product1'
+    assert transactions['next_cursor'] is None
+
+def test_requires_json_body(app, client, user, create_products, sign_in):
+    product_id, = create_products(1)
+    sign_in(client)
+
+    # フォームからの送信は受け付けない
+    response = client.post('/api/v1/cart', data={'product_id': product_id})
+    assert response.status_code == 415
+    assert client.post('/api/v1/cart', json={'product_id': 'x'}).status_code == 400
+    assert client.post('/api/v1/cart', json={'product_id': 999}).status_code == 404
+    assert client.post('/api/v1/checkout', json={}).status_code == 400
+
+def test_compression(app, client, user, create_products, sign_in):
+    app.config['PRODUCTS_PER_PAGE'] = 50
+    create_products(50)
+    sign_in(client)
+
+    plain = client.get('/api/v1/products')
+    assert 'Content-Encoding' not in plain.headers
+
+    response = client.get('/api/v1/products', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain.data
+
+    response = client.get('/api/v1/products', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == plain.data
+    assert len(response.data) < len(plain.data)
+
+    # 小さなレスポンスは圧縮しない
+    app.config['PRODUCTS_PER_PAGE'] = 1
+    response = client.get('/api/v1/products', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
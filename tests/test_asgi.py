@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+import pytest
+from starlette.testclient import TestClient
+from .. import db
+from ..asgi import create_asgi_app
+from ..models import PurchaseTransaction
+
+@pytest.fixture()
+def asgi_client(app, client, user):
+    # サインインは WSGI のテストクライアントで行い、同じセッションの Cookie を ASGI のクライアントに渡す
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+        # CSRF トークンを先に入れておき、ASGI 側でセッションが書き換わって Cookie が分かれないようにする
+        session['csrf_token'] = "0" * 40
+
+    with TestClient(create_asgi_app(app), follow_redirects=False) as asgi_client:
+        asgi_client.cookies.set('session', client.get_cookie('session').value)
+        yield asgi_client
+
+def test_products_matches_wsgi(app, client, asgi_client, create_products):
+    create_products(3)
+
+    response = asgi_client.get("/products")
+    assert response.status_code == 200
+    assert "product3" in response.text
+    assert response.headers['ETag'] == client.get("/products").headers['ETag']
+    assert 'X-Request-ID' in response.headers
+
+    response = asgi_client.get("/products", headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+def test_products_uses_async_engine(app, asgi_client, create_products):
+    create_products(1)
+    asgi_client.get("/products")
+
+    histogram = app.extensions['metrics'].get('http_request_sql_statements')
+    assert histogram.count(endpoint='views.products') == 1
+    assert histogram.sum(endpoint='views.products') >= 1
+    assert app.extensions['async_engine'].pool.checkedin() > 0
+
+def test_transactions(app, user, asgi_client, create_products):
+    product_id, = create_products(1)
+    with app.app_context():
+        db.session.add(PurchaseTransaction(user_id=user, product_id=product_id, created=datetime.now(timezone.utc)))
+        db.session.commit()
+
+    response = asgi_client.get("/transactions")
+    assert response.status_code == 200
+    assert "product1を購入しました" in response.text
+
+    assert asgi_client.get("/transactions?before=invalid").status_code == 400
+
+def test_requires_sign_in(app):
+    with TestClient(create_asgi_app(app), follow_redirects=False) as asgi_client:
+        response = asgi_client.get("/products")
+    assert response.status_code == 302
+    assert response.headers['Location'] == "/sign_in"
+
+def test_other_routes_are_served_by_flask(asgi_client):
+    response = asgi_client.get("/cart")
+    assert response.status_code == 200
+    assert asgi_client.get("/products/999999").status_code == 404
+
+# asgi を import しただけではアプリを作らない (起動用のアプリは main_asgi.py)
+def test_import_does_not_create_app():
+    from .. import asgi
+    assert not hasattr(asgi, 'app')
@@ -0,0 +1,80 @@
+import csv
+import gzip
+import io
+import json
+from .. import db
+from ..models import Product, PurchaseTransaction, User
+
+def _create_transactions(app, user_id, count):
+    with app.app_context():
+        other = User(name="other", email="other@gmail.com", password="other-password")
+        product = Product(name="apple", price=100)
+        db.session.add_all([other, product])
+        db.session.flush()
+        db.session.add_all([PurchaseTransaction(user_id=user_id, product_id=product.id) for _ in range(count)])
+        db.session.add(PurchaseTransaction(user_id=other.id, product_id=product.id))
+        db.session.commit()
+
+def test_export_csv(app, client, user, sign_in):
+    app.config['EXPORT_YIELD_PER'] = 2
+    _create_transactions(app, user, 5)
+    sign_in(client)
+
+    response = client.get('/transactions/export.csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.is_streamed
+    assert 'attachment' in response.headers['Content-Disposition']
+
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    # 他のユーザーの購入履歴は含まれない
+    assert len(rows) == 5
+    assert {row['user_id'] for row in rows} == {str(user)}
+    assert rows[0]['product_name'] == 'apple'
+    assert rows[0]['product_price'] == '100'
+
+def test_export_jsonl_gzip(app, client, user, sign_in):
+    _create_transactions(app, user, 3)
+    sign_in(client)
+
+    response = client.get('/transactions/export.jsonl', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+    lines = gzip.decompress(response.data).decode('utf8').splitlines()
+    records = [json.loads(line) for line in lines]
+    assert len(records) == 3
+    assert set(records[0]) == {'id', 'created', 'user_id', 'product_id', 'product_name', 'product_price'}
+
+def test_export_unknown_format(client, user, sign_in):
+    sign_in(client)
+    assert client.get('/transactions/export.xml').status_code == 404
+
+def test_export_not_signed_in(client):
+    assert client.get('/transactions/export.csv').status_code == 302
+
+def test_export_all_requires_admin(app, client, user, sign_in):
+    _create_transactions(app, user, 2)
+    sign_in(client)
+    assert client.get('/admin/transactions/export.csv').status_code == 403
+
+    app.config['ADMIN_EMAILS'] = ["test@gmail.com"]
+    response = client.get('/admin/transactions/export.jsonl')
+    assert response.status_code == 200
+    assert len(response.get_data(as_text=True).splitlines()) == 3
+
+def test_export_cli(app, runner, user, tmp_path):
+    _create_transactions(app, user, 4)
+
+    result = runner.invoke(args=['export', 'transactions', '--user', 'test@gmail.com', '--format', 'jsonl'])
+    assert result.exit_code == 0, result.output
+    assert len(result.output.splitlines()) == 4
+
+    output = tmp_path / 'all.csv.gz'
+    result = runner.invoke(args=['export', 'transactions', '--gzip', '--output', str(output)])
+    assert result.exit_code == 0, result.output
+    with gzip.open(output, 'rt', encoding='utf8') as f:
+        assert len(list(csv.DictReader(f))) == 5
+
+    result = runner.invoke(args=['export', 'transactions', '--user', 'nobody@gmail.com'])
+    assert result.exit_code != 0
@@ -0,0 +1,72 @@
+from .. import db
+from ..models import Product
+
+def test_cache_tag_renders_once_per_key(app):
+    calls = []
+    with app.test_request_context():
+        template = app.jinja_env.from_string("{% cache 'test', version %}{{ render() }}{% endcache %}")
+        render = lambda: calls.append(1) or "<b>x</b>"
+
+        assert template.render(version=1, render=render) == "&lt;b&gt;x&lt;/b&gt;"
+        assert template.render(version=1, render=render) == "&lt;b&gt;x&lt;/b&gt;"
+        assert len(calls) == 1
+
+        template.render(version=2, render=render)
+        assert len(calls) == 2
+
+# テンプレートを変更してデプロイすると、共有のキャッシュに残っている古い描画結果は使われない
+def test_key_includes_template_source(app):
+    with app.test_request_context():
+        old = app.jinja_env.from_string("{% cache 'test', 1 %}<p>old</p>{% endcache %}")
+        new = app.jinja_env.from_string("{% cache 'test', 1 %}<p>new</p>{% endcache %}")
+
+        assert old.render() == "<p>old</p>"
+        assert new.render() == "<p>new</p>"
+        assert app.jinja_env.from_string("{% cache 'test', 1 %}<p>old</p>{% endcache %}").render() == "<p>old</p>"
+        assert app.extensions['fragment_cache'].stats()['hits'] == 1
+
+def test_key_includes_locale(app):
+    app.config['FRAGMENT_CACHE_LOCALES'] = ['ja', 'en']
+    calls = []
+    template = app.jinja_env.from_string("{% cache 'test' %}{{ render() }}{% endcache %}")
+    render = lambda: calls.append(1) or "x"
+
+    for language in ('ja', 'en', 'en-US', 'fr'):
+        with app.test_request_context(headers={'Accept-Language': language}):
+            template.render(render=render)
+    assert len(calls) == 2
+
+def test_product_list_is_cached_until_updated(app, client, user, sign_in):
+    with app.app_context():
+        product = Product(name="before", price=100)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+    sign_in(client)
+
+    assert b"before" in client.get("/products").data
+    client.get("/products")
+    stats = app.extensions['fragment_cache'].stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+
+    with app.app_context():
+        db.session.get(Product, product_id).name = "after"
+        db.session.commit()
+
+    assert b"after" in client.get("/products").data
+
+def test_csrf_token_stays_dynamic(app, client, user, sign_in):
+    app.config['WTF_CSRF_ENABLED'] = True
+    with app.app_context():
+        db.session.add(Product(name="product", price=100))
+        db.session.commit()
+
+    tokens = []
+    for _ in range(2):
+        client.delete_cookie('session')
+        sign_in(client)
+        response = client.get("/products")
+        tokens.append(response.data.split(b'name="csrf_token" type="hidden" value="')[1].split(b'"')[0])
+
+    assert app.extensions['fragment_cache'].stats()['hits'] == 1
+    assert tokens[0] != tokens[1]
@@ -0,0 +1,80 @@
+import json
+import os
+from .. import db
+from ..models import Product
+
+def test_metrics_endpoint(app, client):
+    client.get('/sign_in')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{endpoint="views.sign_in",method="GET",status="200"} 1' in body
+    assert 'template_render_seconds_count{template="sign_in.html"} 1' in body
+    assert 'cache_stats{cache="product",stat="hits"} 0' in body
+    assert '# TYPE db_pool_wait_seconds histogram' in body
+
+def test_sql_statements_per_request(app, client, user):
+    with app.app_context():
+        db.session.add_all([Product(name=f"product{i}", price=i) for i in range(3)])
+        db.session.commit()
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    # 1 回目のリクエストでユーザー情報がキャッシュされる
+    client.get('/products')
+    response = client.get('/products')
+    assert 'db;dur=' in response.headers['Server-Timing']
+
+    histogram = app.extensions['metrics'].get('http_request_sql_statements')
+    assert histogram.count(endpoint='views.products') == 2
+    # 2 回目はユーザーをキャッシュから読み込むため、商品一覧の SELECT だけが実行される
+    assert histogram.sum(endpoint='views.products') == 2 + 1
+
+def test_slow_request_log(app, client, user, caplog):
+    app.config['SLOW_REQUEST_SECONDS'] = 0
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    with caplog.at_level('WARNING', logger=app.logger.name):
+        client.get('/transactions')
+
+    messages = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Slow request')]
+    assert len(messages) == 1
+    assert 'GET /transactions' in messages[0]
+    assert 'FROM purchase_transactions' in messages[0]
+    assert app.extensions['metrics'].get('http_slow_requests_total').get(endpoint='views.transactions') == 1
+
+def test_metrics_requires_internal_address_or_token(app, client):
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.1'}).status_code == 403
+
+    app.config['METRICS_TOKEN'] = 'secret'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'}, environ_base={'REMOTE_ADDR': '203.0.113.1'})
+    assert response.status_code == 200
+
+# 複数のワーカーでは、どのワーカーが応答してもすべてのワーカーの合計を返す
+def test_metrics_are_aggregated_across_workers(app, client, tmp_path):
+    from ..metrics import Registry, mark_process_dead, merge, read_snapshots
+    app.config['METRICS_DIR'] = str(tmp_path)
+
+    other = Registry()
+    other.counter('http_slow_requests_total', 'Requests slower than SLOW_REQUEST_SECONDS.', ['endpoint']).inc(2, endpoint='views.products')
+    other.gauge('cache_stats', 'Cache statistics.', ['cache', 'stat']).set(7, cache='product', stat='size')
+    (tmp_path / '1.json').write_text(json.dumps(other.snapshot()))
+
+    app.extensions['metrics'].get('http_slow_requests_total').inc(endpoint='views.products')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'http_slow_requests_total{endpoint="views.products"} 3' in body
+    assert 'cache_stats{cache="product",stat="size",worker="1"} 7' in body
+
+    # 終了したワーカーのカウンタは残し、ゲージは消す
+    mark_process_dead(str(tmp_path), 1)
+    assert set(read_snapshots(str(tmp_path))) == {'dead', str(os.getpid())}
+    merged = merge(read_snapshots(str(tmp_path)))
+    assert merged.get('http_slow_requests_total').get(endpoint='views.products') == 3
+    assert 'worker="1"' not in merged.render()
@@ -0,0 +1,99 @@
+import json
+import logging
+import queue
+from .. import logs
+from ..logs import DroppingQueueHandler
+
+def _init_logs(app, tmp_path, **config):
+    app.config['LOG_FILE'] = str(tmp_path / 'server.log')
+    app.config.update(config)
+    logs.init_app(app)
+    return tmp_path / 'server.log'
+
+def _read_records(app, path):
+    # リスナーを止めてキューに残っているレコードを書き出す
+    app.extensions['log_listener'].stop()
+    with open(path, encoding='utf8') as f:
+        return [json.loads(line) for line in f]
+
+def test_access_log_is_json(app, client, tmp_path):
+    path = _init_logs(app, tmp_path)
+
+    response = client.get('/sign_in', headers={'X-Request-ID': 'abc123'})
+    assert response.headers['X-Request-ID'] == 'abc123'
+
+    records = _read_records(app, path)
+    access = [record for record in records if record.get('status') is not None]
+    assert len(access) == 1
+    assert access[0]['request_id'] == 'abc123'
+    assert access[0]['route'] == '/sign_in'
+    assert access[0]['method'] == 'GET'
+    assert access[0]['status'] == 200
+    assert access[0]['duration_ms'] >= 0
+
+def test_generated_request_id(app, client, tmp_path):
+    path = _init_logs(app, tmp_path)
+
+    response = client.get('/sign_in')
+    request_id = response.headers['X-Request-ID']
+    assert len(request_id) == 32
+
+    records = _read_records(app, path)
+    assert records[-1]['request_id'] == request_id
+
+def test_debug_sampling(app, tmp_path):
+    path = _init_logs(app, tmp_path, LOG_LEVEL='DEBUG', LOG_DEBUG_SAMPLE_RATE=0.0)
+
+    for i in range(10):
+        app.logger.debug('debug %s', i)
+    app.logger.warning('warning')
+
+    records = _read_records(app, path)
+    assert [record['level'] for record in records] == ['WARNING']
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    logger = logging.getLogger('tests.logs.dropping')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        # リスナーがいなくてもブロックせずに捨てる
+        for i in range(5):
+            logger.warning('message %s', i)
+    finally:
+        logger.removeHandler(handler)
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 4
+
+def test_logs_do_not_write_on_request_thread(app):
+    from flask.logging import default_handler
+    assert default_handler not in app.logger.handlers
+    assert app.extensions['log_handler'] in app.logger.handlers
+    assert all(isinstance(handler, DroppingQueueHandler) for handler in app.logger.handlers)
+
+def test_apps_keep_their_own_handlers(app, tmp_path):
+    from .. import create_app
+    path = _init_logs(app, tmp_path)
+    other = create_app()
+    try:
+        assert app.extensions['log_listener']._thread.is_alive()
+        with other.app_context():
+            other.logger.warning('other app')
+        with app.app_context():
+            app.logger.warning('first app')
+    finally:
+        logs.shutdown(other)
+
+    records = _read_records(app, path)
+    assert [record['message'] for record in records] == ['first app']
+
+def test_stderr_can_be_disabled(monkeypatch):
+    from .. import create_app
+    monkeypatch.setenv('LOG_STDERR', 'false')
+    app = create_app()
+    try:
+        assert not any(isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler)
+                       for handler in app.extensions['log_listener'].handlers)
+    finally:
+        logs.shutdown(app)
@@ -0,0 +1,85 @@
+import threading
+import pytest
+from werkzeug.exceptions import ServiceUnavailable
+from .. import passwords
+
+def test_hash_and_check(app):
+    with app.app_context():
+        hashed = passwords.hash("hogehoge")
+        assert hashed.startswith(f"$2b${app.config['BCRYPT_ROUNDS']:02d}$")
+        assert passwords.check("hogehoge", hashed)
+        assert not passwords.check("foofoo", hashed)
+
+def test_inline_when_no_workers(app):
+    app.config['PASSWORD_HASH_WORKERS'] = 0
+    passwords.init_app(app)
+
+    with app.app_context():
+        assert app.extensions['password_hasher'].executor is None
+        assert passwords.check("hogehoge", passwords.hash("hogehoge"))
+
+def _saturate(app):
+    app.config['PASSWORD_HASH_WORKERS'] = 1
+    app.config['PASSWORD_HASH_QUEUE_SIZE'] = 0
+    passwords.init_app(app)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    state = app.extensions['password_hasher']
+    worker = threading.Thread(target=state.submit, args=(block,))
+    worker.start()
+    started.wait()
+    return release, worker
+
+def test_saturated_pool_rejects(app):
+    release, worker = _saturate(app)
+
+    try:
+        with app.app_context():
+            with pytest.raises(ServiceUnavailable):
+                passwords.hash("hogehoge")
+    finally:
+        release.set()
+        worker.join()
+
+    with app.app_context():
+        assert passwords.check("hogehoge", passwords.hash("hogehoge"))
+
+def test_sign_up_saturated_returns_503(app, client):
+    release, worker = _saturate(app)
+
+    try:
+        response = client.post('/sign_up', data={
+            "name": "test",
+            "email": "test@gmail.com",
+            "password": "hogehoge"
+        })
+        assert response.status_code == 503
+    finally:
+        release.set()
+        worker.join()
+
+def test_sign_in_saturated_returns_503(app, client, user):
+    release, worker = _saturate(app)
+
+    try:
+        response = client.post('/sign_in', data={
+            "email": "test@gmail.com",
+            "password": "hogehoge"
+        })
+        assert response.status_code == 503
+    finally:
+        release.set()
+        worker.join()
+
+def test_init_app_shuts_down_previous_executor(app):
+    previous = app.extensions['password_hasher']
+    passwords.init_app(app)
+
+    assert app.extensions['password_hasher'] is not previous
+    assert previous.executor._shutdown
@@ -0,0 +1,75 @@
+from .. import db
+from ..pool import InstrumentedNullPool, InstrumentedQueuePool, engine_options_from_env
+
+def test_engine_options_from_env():
+    options = engine_options_from_env({
+        'DB_POOL_SIZE': '20',
+        'DB_MAX_OVERFLOW': '5',
+        'DB_POOL_TIMEOUT': '2.5',
+        'DB_POOL_RECYCLE': '600',
+        'DB_POOL_PRE_PING': 'false',
+    })
+    assert options == {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': 20,
+        'max_overflow': 5,
+        'pool_timeout': 2.5,
+        'pool_recycle': 600,
+        'pool_pre_ping': False,
+    }
+
+def test_engine_options_defaults():
+    options = engine_options_from_env({})
+    assert options['pool_pre_ping'] is True
+    assert options['pool_size'] == 5
+
+def test_engine_options_pgbouncer():
+    assert engine_options_from_env({'DB_PGBOUNCER': 'on'}) == {
+        'poolclass': InstrumentedNullPool,
+        'pool_pre_ping': False,
+    }
+
+def test_pool_metrics(app):
+    registry = app.extensions['metrics']
+
+    with app.app_context():
+        assert isinstance(db.engine.pool, InstrumentedQueuePool)
+        db.session.execute(db.text('SELECT 1'))
+        db.session.commit()
+
+        # dispose でプールが作り直されても計測は続く
+        db.engine.dispose()
+        db.session.execute(db.text('SELECT 1'))
+        db.session.commit()
+
+    assert registry.get('db_pool_wait_seconds').count(engine='default') >= 2
+    assert registry.get('db_pool_checked_out').count(engine='default') >= 2
+    assert registry.get('db_pool_connects_total').get(engine='default') >= 1
+
+    output = registry.render()
+    assert '# TYPE db_pool_wait_seconds histogram' in output
+    assert 'db_pool_wait_seconds_bucket{engine="default",le="+Inf"}' in output
+    assert 'db_pool_overflow_count{engine="default"}' in output
+
+# 開発環境 (LOG_LEVEL=DEBUG) でもプールのチェックアウトごとのログはアプリのログに出さない
+def test_development_request_writes_no_pool_logs(app, user, tmp_path, monkeypatch):
+    import json
+    from .. import create_app, logs
+    monkeypatch.setenv('FLASK_ENV', 'development')
+    monkeypatch.setenv('DATABASE_URL', app.config['SQLALCHEMY_DATABASE_URI'])
+    monkeypatch.setenv('LOG_FILE', str(tmp_path / 'server.log'))
+    monkeypatch.setenv('LOG_STDERR', 'false')
+    development = create_app()
+    try:
+        client = development.test_client()
+        with client.session_transaction() as session:
+            session['email'] = "test@gmail.com"
+            session['user_id'] = user
+        assert client.get('/products').status_code == 200
+    finally:
+        logs.shutdown(development)
+
+    with open(tmp_path / 'server.log', encoding='utf8') as f:
+        records = [json.loads(line) for line in f]
+    assert any(record.get('status') == 200 for record in records)
+    assert not [record for record in records if 'pool' in record['logger']]
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import fakeredis
+from .. import db
+from ..cache import MemoryBackend, RedisBackend, ReadThroughCache
+from ..models import Product
+from ..product_cache import ProductRecord, get_product, get_products
+
+def test_single_flight():
+    cache = ReadThroughCache(MemoryBackend())
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return "value"
+
+    def get(_):
+        barrier.wait()
+        return cache.get("key", loader)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(get, range(8))) == ["value"] * 8
+
+    assert len(calls) == 1
+    assert cache.stats()['loads'] == 1
+    assert cache.stats()['hits'] + cache.stats()['misses'] == 8
+
+def test_stats_and_evictions():
+    cache = ReadThroughCache(MemoryBackend(maxsize=1))
+    cache.get(1, lambda: "a")
+    cache.get(1, lambda: "a")
+    cache.get(2, lambda: "b")
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'loads': 2, 'evictions': 1}
+
+def test_redis_backend():
+    cache = ReadThroughCache(RedisBackend(fakeredis.FakeRedis(), prefix='product:', ttl=60))
+    record = ProductRecord(1, "product", 100, None)
+    assert cache.get(1, lambda: record) == record
+    assert cache.get(1, lambda: None) == record
+    cache.delete(1)
+    assert cache.get(1, lambda: None) is None
+
+def test_get_product_is_cached(app, create_products):
+    product_id, = create_products(1)
+
+    with app.app_context():
+        assert get_product(product_id).name == "product1"
+        assert get_product(product_id).name == "product1"
+        assert app.extensions['product_cache'].stats()['loads'] == 1
+
+def test_get_products_loads_misses_at_once(app, create_products):
+    ids = create_products(3)
+
+    with app.app_context():
+        get_product(ids[0])
+        assert [p.id for p in get_products(ids)] == ids
+        assert app.extensions['product_cache'].stats()['loads'] == 2
+
+def test_invalidated_on_update_and_delete(app, create_products):
+    product_id, = create_products(1)
+
+    with app.app_context():
+        get_product(product_id)
+        db.session.get(Product, product_id).name = "renamed"
+        db.session.commit()
+        assert get_product(product_id).name == "renamed"
+
+        db.session.delete(db.session.get(Product, product_id))
+        db.session.commit()
+        assert get_product(product_id) is None
+
+def test_product_page_served_from_cache(app, user, client, create_products, sign_in):
+    product_id, = create_products(1)
+    sign_in(client)
+
+    assert client.get(f'/products/{product_id}').status_code == 200
+    assert client.get(f'/products/{product_id}').status_code == 200
+    assert app.extensions['product_cache'].stats()['loads'] == 1
+    assert client.get('/products/0').status_code == 404
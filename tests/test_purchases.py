@@ -0,0 +1,166 @@
+import time
+import pytest
+from .. import db
+from ..models import Product, ProductSalesStats, PurchaseRequest, PurchaseTransaction
+from ..purchases import process_queued_purchases
+
+@pytest.fixture()
+def products(app):
+    with app.app_context():
+        products = [Product(name="apple", price=100), Product(name="banana", price=250)]
+        db.session.add_all(products)
+        db.session.commit()
+        return [product.id for product in products]
+
+@pytest.fixture()
+def signed_in(client, user):
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+    return client
+
+def _count(app, model):
+    with app.app_context():
+        return db.session.scalar(db.select(db.func.count()).select_from(model))
+
+def test_purchase_retry_is_noop(app, signed_in, products):
+    apple, _ = products
+
+    first = signed_in.post(f'/purchase/{apple}', data={'idempotency_key': 'key1'})
+    second = signed_in.post(f'/purchase/{apple}', data={'idempotency_key': 'key1'})
+    assert first.status_code == second.status_code == 200
+    assert 'appleの購入に成功しました' in second.get_data(as_text=True)
+    assert _count(app, PurchaseTransaction) == 1
+
+    # 別のキーなら別の購入になる
+    signed_in.post(f'/purchase/{apple}', data={'idempotency_key': 'key2'})
+    assert _count(app, PurchaseTransaction) == 2
+    with app.app_context():
+        assert db.session.get(ProductSalesStats, apple).count == 2
+
+def test_checkout_retry_returns_original_result(app, signed_in, products):
+    apple, banana = products
+    with signed_in.session_transaction() as session:
+        session['cart'] = {str(apple), str(banana)}
+
+    signed_in.post('/checkout', data={'idempotency_key': 'key1'})
+    # カートは空になっているが、同じキーなら元の結果を返す
+    response = signed_in.post('/checkout', data={'idempotency_key': 'key1'})
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'appleの購入に成功しました' in body
+    assert 'bananaの購入に成功しました' in body
+    assert _count(app, PurchaseTransaction) == 2
+
+def test_cart_renders_idempotency_keys(app, signed_in, products):
+    with signed_in.session_transaction() as session:
+        session['cart'] = {str(product_id) for product_id in products}
+
+    body = signed_in.get('/cart').get_data(as_text=True)
+    assert body.count('name="idempotency_key"') == 3
+
+def test_api_idempotency_key(app, signed_in, products):
+    apple, _ = products
+    signed_in.post('/api/v1/cart', json={'product_id': apple})
+
+    first = signed_in.post('/api/v1/checkout', json={}, headers={'Idempotency-Key': 'key1'})
+    second = signed_in.post('/api/v1/checkout', json={}, headers={'Idempotency-Key': 'key1'})
+    assert first.status_code == 201
+    assert second.status_code == 200
+    assert second.json['id'] == first.json['id']
+    assert second.json['items'] == first.json['items']
+    assert _count(app, PurchaseTransaction) == 1
+
+def test_async_purchase(app, signed_in, products, monkeypatch):
+    app.config['ASYNC_PURCHASES'] = True
+    monkeypatch.setattr(app.extensions['purchase_worker'], 'start', lambda: None)
+    apple, banana = products
+
+    response = signed_in.post(f'/purchase/{apple}', data={'idempotency_key': 'key1'})
+    assert response.status_code == 303
+    status_url = response.headers['Location']
+    assert 'お待ちください' in signed_in.get(status_url).get_data(as_text=True)
+
+    # 再送しても受付は増えない
+    assert signed_in.post(f'/purchase/{apple}', data={'idempotency_key': 'key1'}).headers['Location'] == status_url
+    signed_in.post(f'/purchase/{banana}', data={'idempotency_key': 'key2'})
+    assert _count(app, PurchaseRequest) == 2
+    assert _count(app, PurchaseTransaction) == 0
+
+    with app.app_context():
+        assert process_queued_purchases(batch_size=10) == 2
+        assert process_queued_purchases(batch_size=10) == 0
+
+    assert _count(app, PurchaseTransaction) == 2
+    assert 'appleの購入に成功しました' in signed_in.get(status_url).get_data(as_text=True)
+
+def test_async_purchase_of_deleted_product_fails(app, signed_in, products, monkeypatch):
+    app.config['ASYNC_PURCHASES'] = True
+    monkeypatch.setattr(app.extensions['purchase_worker'], 'start', lambda: None)
+    apple, _ = products
+
+    signed_in.post('/api/v1/cart', json={'product_id': apple})
+    response = signed_in.post('/api/v1/checkout', json={})
+    assert response.status_code == 202
+    status_url = response.json['status_url']
+
+    with app.app_context():
+        db.session.delete(db.session.get(Product, apple))
+        db.session.commit()
+        process_queued_purchases(batch_size=10)
+
+    assert signed_in.get(status_url).json == {'id': response.json['id'], 'status': 'failed', 'status_url': status_url}
+
+def test_purchase_worker(app, signed_in, products):
+    app.config['ASYNC_PURCHASES'] = True
+    app.config['PURCHASE_POLL_INTERVAL'] = 0.05
+    apple, _ = products
+    worker = app.extensions['purchase_worker']
+
+    try:
+        status_url = signed_in.post(f'/purchase/{apple}').headers['Location']
+
+        for _ in range(100):
+            if 'appleの購入に成功しました' in signed_in.get(status_url).get_data(as_text=True):
+                break
+            time.sleep(0.05)
+        else:
+            pytest.fail('queued purchase was not processed')
+    finally:
+        worker.stop(timeout=5)
+
+    assert _count(app, PurchaseTransaction) == 1
+
+def test_invalid_idempotency_key_is_rejected(app, signed_in, products):
+    apple, _ = products
+
+    assert signed_in.post(f'/purchase/{apple}', data={'idempotency_key': 'k' * 65}).status_code == 400
+    signed_in.post('/api/v1/cart', json={'product_id': apple})
+    response = signed_in.post('/api/v1/checkout', json={}, headers={'Idempotency-Key': 'bad key'})
+    assert response.status_code == 400
+    assert _count(app, PurchaseRequest) == 0
+
+# 再起動前に受け付けた購入は、新しい購入を待たずに最初のリクエストで処理される
+def test_worker_drains_queue_at_startup(app, signed_in, products, monkeypatch):
+    from .. import create_app, logs
+    app.config['ASYNC_PURCHASES'] = True
+    monkeypatch.setattr(app.extensions['purchase_worker'], 'start', lambda: None)
+    apple, _ = products
+    signed_in.post(f'/purchase/{apple}', data={'idempotency_key': 'key1'})
+
+    monkeypatch.setenv('ASYNC_PURCHASES', '1')
+    monkeypatch.setenv('PURCHASE_POLL_INTERVAL', '60')
+    restarted = create_app()
+    worker = restarted.extensions['purchase_worker']
+    try:
+        # preload したマスタープロセスで fork 前にスレッドを起動しないよう、create_app では起動しない
+        assert worker._thread is None
+        restarted.test_client().get('/sign_in')
+        for _ in range(100):
+            if _count(app, PurchaseTransaction) == 1:
+                break
+            time.sleep(0.05)
+        else:
+            pytest.fail('queued purchase was not processed at startup')
+    finally:
+        worker.stop(timeout=5)
+        logs.shutdown(restarted)
@@ -0,0 +1,91 @@
+import pytest
+from datetime import datetime
+from .. import create_app, db
+from ..models import Product, PurchaseTransaction, StoredSession, User
+from ..product_cache import _select_products
+from ..queries import select_product_page, select_transaction_export, select_transaction_page
+from ..sales import select_best_sellers
+from ..search import select_product_search
+
+USERS = 2000
+PRODUCTS = 20000
+TRANSACTIONS = 200000
+
+LARGE_TABLES = {'users', 'products', 'purchase_transactions', 'product_sales_stats'}
+
+# 主要なクエリの実行計画を大きなテーブルで確認し、シーケンシャルスキャンになっていないことを保証する
+@pytest.fixture(scope='module')
+def app():
+    app = create_app()
+
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            pytest.skip('EXPLAIN tests require PostgreSQL')
+
+        db.create_all()
+        with db.engine.begin() as conn:
+            conn.execute(db.text(f"""
+                INSERT INTO users (name, email, password, created, updated)
+                SELECT 'user' || i, 'user' || i || '@example.com', 'password' || i, now(), now()
+                FROM generate_series(1, {USERS}) AS i
+            """))
+            conn.execute(db.text(f"""
+                INSERT INTO products (name, price, created, updated)
+                SELECT 'product' || i, i, now(), now()
+                FROM generate_series(1, {PRODUCTS}) AS i
+            """))
+            conn.execute(db.text(f"""
+                INSERT INTO purchase_transactions (product_id, user_id, created, updated)
+                SELECT i % {PRODUCTS} + 1, i % {USERS} + 1, now() - i * interval '1 second', now()
+                FROM generate_series(1, {TRANSACTIONS}) AS i
+            """))
+            conn.execute(db.text("""
+                INSERT INTO product_sales_stats (product_id, count, revenue, last_purchased)
+                SELECT pt.product_id, count(*), sum(p.price), max(pt.created)
+                FROM purchase_transactions pt JOIN products p ON p.id = pt.product_id
+                GROUP BY pt.product_id
+            """))
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(db.text('ANALYZE'))
+
+    yield app
+
+    with app.app_context():
+        db.drop_all()
+
+def _explain(stmt):
+    compiled = stmt.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    with db.engine.connect() as conn:
+        return conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', dict(compiled.params)).scalar()[0]['Plan']
+
+def _seq_scans(plan):
+    scans = []
+    if plan['Node Type'] == 'Seq Scan' and plan.get('Relation Name') in LARGE_TABLES:
+        scans.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        scans.extend(_seq_scans(child))
+    return scans
+
+QUERIES = {
+    'products_first_page': lambda: select_product_page(per_page=20),
+    'products_after': lambda: select_product_page(after=PRODUCTS // 2, per_page=20),
+    'products_before': lambda: select_product_page(before=PRODUCTS // 2, per_page=20),
+    'product_by_id': lambda: _select_products().filter_by(id=PRODUCTS // 2),
+    'products_in_cart': lambda: _select_products().where(Product.id.in_([1, 2, 3])),
+    'transactions_first_page': lambda: select_transaction_page(USERS // 2, per_page=20),
+    'transactions_before': lambda: select_transaction_page(USERS // 2, before=(datetime.now(), TRANSACTIONS // 2), per_page=20),
+    'export_by_user': lambda: select_transaction_export(USERS // 2),
+    'best_sellers': lambda: select_best_sellers(20),
+    'product_search': lambda: select_product_search(f'product{PRODUCTS // 2}', per_page=20),
+    'user_by_email': lambda: db.select(User.id, User.name, User.email).filter_by(email='user1@example.com'),
+    'user_by_id': lambda: db.select(User.id, User.name, User.email).filter_by(id=1),
+    'cascade_by_product': lambda: db.select(PurchaseTransaction).where(PurchaseTransaction.product_id == 1),
+    'cascade_by_user': lambda: db.select(PurchaseTransaction).where(PurchaseTransaction.user_id == 1),
+    'session_by_id': lambda: db.select(StoredSession.data).where(StoredSession.id == 'x', StoredSession.expires > datetime.now()),
+}
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_no_sequential_scan(app, name):
+    with app.app_context():
+        plan = _explain(QUERIES[name]())
+        assert _seq_scans(plan) == [], plan
@@ -0,0 +1,92 @@
+import os
+import runpy
+import fakeredis
+import pytest
+from .. import create_app, logs, passwords
+from ..ratelimit import MemoryStore, RedisStore, parse_limit, sliding_window
+
+def _sign_in(client, email="test@gmail.com", ip="10.0.0.1"):
+    return client.post('/sign_in', data={"email": email, "password": "hogehoge"}, environ_base={'REMOTE_ADDR': ip})
+
+def test_parse_limit():
+    assert parse_limit("5/minute") == (5, 60)
+    assert parse_limit("100/3600") == (100, 3600)
+    with pytest.raises(ValueError):
+        parse_limit("5/fortnight")
+
+def test_sliding_window():
+    # 直前の窓の回数は経過時間に応じて減っていく。拒否したリクエストも数える
+    assert sliding_window(10, 1, 0, 10, 60) == (False, pytest.approx(12))
+    assert sliding_window(10, 1, 30, 10, 60) == (True, 0)
+    # 今の窓で使い切った場合は次の窓まで待つ
+    assert sliding_window(0, 11, 30, 10, 60) == (False, pytest.approx(30 + 60 * (1 - 9 / 11)))
+
+@pytest.mark.parametrize('store', [MemoryStore(), RedisStore(fakeredis.FakeRedis(), prefix='ratelimit:')])
+def test_store_rolls_windows(store):
+    assert store.hit('key', 60, 0) == (0, 1, 0)
+    assert store.hit('key', 60, 10) == (0, 2, 10)
+    assert store.hit('key', 60, 70) == (2, 1, 10)
+    # 窓を 1 つ以上空けると直前の窓の回数は 0 になる
+    assert store.hit('key', 60, 200) == (0, 1, 20)
+
+def test_sign_in_limited_by_email(app, client, monkeypatch):
+    app.config['RATE_LIMITS']['views.sign_in'] = {'ip': '100/minute', 'email': '2/minute'}
+
+    assert _sign_in(client).status_code == 200
+    assert _sign_in(client, ip="10.0.0.2").status_code == 200
+
+    # 拒否したリクエストではパスワードを確認しない
+    monkeypatch.setattr(passwords, 'check', lambda *args: pytest.fail('password checked'))
+    response = _sign_in(client, ip="10.0.0.3")
+    assert response.status_code == 429
+    assert 1 <= int(response.headers['Retry-After']) <= 120
+
+    monkeypatch.undo()
+    assert _sign_in(client, email="other@gmail.com").status_code == 200
+    assert b'http_rate_limited_total{endpoint="views.sign_in",scope="email"} 1' in client.get('/metrics').data
+
+def test_sign_up_limited_by_ip(app, client):
+    app.config['RATE_LIMITS']['views.sign_up'] = {'ip': '1/hour'}
+    data = {"name": "test", "email": "test@gmail.com", "password": "hogehoge"}
+
+    assert client.post('/sign_up', data=data).status_code == 302
+    client.post('/sign_out')
+    response = client.post('/sign_up', data=data)
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+    # フォームの表示は制限しない
+    assert client.get('/sign_up').status_code == 200
+
+def test_disabled(app, client):
+    app.config['RATE_LIMITS']['views.sign_in'] = {'email': '1/minute'}
+    app.config['RATE_LIMIT_ENABLED'] = False
+
+    assert _sign_in(client).status_code == 200
+    assert _sign_in(client).status_code == 200
+
+def test_proxy_fix_uses_forwarded_address(monkeypatch):
+    monkeypatch.setenv('PROXY_FIX_X_FOR', '1')
+    app = create_app()
+    app.config['RATE_LIMITS']['views.sign_in'] = {'ip': '1/minute'}
+    client = app.test_client()
+
+    try:
+        post = lambda ip: client.post('/sign_in', data={}, headers={'X-Forwarded-For': ip})
+        assert post('10.0.0.1').status_code == 200
+        # プロキシのアドレスは同じでも、クライアントごとに数える
+        assert post('10.0.0.2').status_code == 200
+        assert post('10.0.0.1').status_code == 429
+    finally:
+        logs.shutdown(app)
+
+def test_production_requires_shared_store_for_many_workers(monkeypatch):
+    monkeypatch.setenv('FLASK_ENV', 'production')
+    monkeypatch.setenv('WEB_CONCURRENCY', '2')
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'gunicorn.conf.py')
+
+    monkeypatch.setenv('RATE_LIMIT_BACKEND', 'memory')
+    with pytest.raises(RuntimeError, match='RATE_LIMIT_BACKEND=memory'):
+        runpy.run_path(path)
+
+    monkeypatch.setenv('RATE_LIMIT_BACKEND', 'redis')
+    assert runpy.run_path(path)['workers'] == 2
@@ -0,0 +1,89 @@
+import pytest
+from .. import create_app, db
+from ..models import Product, User
+
+@pytest.fixture()
+def app(monkeypatch, tmp_path):
+    replicas = [f"sqlite:///{tmp_path / 'replica0.db'}", f"sqlite:///{tmp_path / 'replica1.db'}"]
+    monkeypatch.setenv('DATABASE_REPLICA_URLS', ','.join(replicas))
+    app = create_app()
+
+    # set up
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(name="test", email="test@gmail.com", password="test-password"))
+        db.session.add(Product(name="primary", price=100))
+        db.session.commit()
+
+        # レプリカにはそれぞれ別の商品を入れて、どこから読んだか判別できるようにする
+        for engine in app.extensions['replicas'].engines.values():
+            db.metadata.create_all(engine)
+            with engine.begin() as conn:
+                conn.execute(db.insert(Product).values(name=engine.url.database.rsplit('/', 1)[-1], price=100))
+
+    yield app
+
+    # tear down
+    with app.app_context():
+        db.drop_all()
+
+@pytest.fixture()
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+    return client
+
+def test_reads_are_routed_round_robin(client):
+    first = client.get('/products').data
+    second = client.get('/products').data
+
+    assert b'primary' not in first + second
+    assert b'replica0.db' in first + second
+    assert b'replica1.db' in first + second
+
+def test_writes_go_to_primary_and_reads_follow(app, client):
+    with app.app_context():
+        product_id = db.session.execute(db.select(Product.id).filter_by(name="primary")).scalar_one()
+
+    response = client.post(f'/purchase/{product_id}')
+    assert response.status_code == 200
+
+    # 書き込み直後はプライマリから読む
+    assert b'primary' in client.get('/products').data
+
+    app.config['REPLICA_READ_YOUR_WRITES_SECONDS'] = 0
+    assert b'primary' not in client.get('/products').data
+
+def test_failed_health_check_skips_replica(app, client, monkeypatch):
+    replicas = app.extensions['replicas']
+
+    def broken_connect(*args, **kwargs):
+        raise RuntimeError("replica is down")
+
+    with app.app_context(), monkeypatch.context() as m:
+        m.setattr(replicas.engines['replica_1'], 'connect', broken_connect)
+
+        assert replicas.is_healthy('replica_0')
+        assert not replicas.is_healthy('replica_1')
+
+    # 復帰待ちの間は残りのレプリカだけに振り分ける
+    for _ in range(4):
+        assert b'replica0.db' in client.get('/products').data
+
+def test_all_replicas_down_falls_back_to_primary(app, client):
+    replicas = app.extensions['replicas']
+    replicas._down_until = {'replica_0': float('inf'), 'replica_1': float('inf')}
+
+    assert b'primary' in client.get('/products').data
+
+# 商品のキャッシュは、遅れているレプリカではなくプライマリから読み込んで作る
+def test_product_cache_is_filled_from_primary(app, client):
+    with app.app_context():
+        product_id = db.session.execute(db.select(Product.id).filter_by(name="primary")).scalar_one()
+
+    for _ in range(2):
+        app.extensions['product_cache'].delete(product_id)
+        body = client.get(f'/products/{product_id}').data
+        assert b'primary' in body
+        assert b'replica' not in body
@@ -0,0 +1,66 @@
+from .. import db
+from ..models import Product, ProductSalesStats, PurchaseTransaction
+
+def _stats(app):
+    with app.app_context():
+        return {
+            stats.product_id: (stats.count, stats.revenue)
+            for stats in db.session.execute(db.select(ProductSalesStats)).scalars()
+        }
+
+def test_purchase_updates_stats(app, client, user, create_products, sign_in):
+    apple, banana = create_products(prices=[100, 250])
+    sign_in(client)
+
+    client.post(f'/purchase/{apple}')
+    client.post(f'/purchase/{apple}')
+    assert _stats(app) == {apple: (2, 200)}
+
+    client.post('/add_cart', data={'product_id': apple})
+    client.post('/add_cart', data={'product_id': banana})
+    client.post('/checkout')
+    assert _stats(app) == {apple: (3, 300), banana: (1, 250)}
+
+# 別のワーカーで価格が変わり、このワーカーの商品キャッシュに古い価格が残っていても、売上には現在の価格を加算する
+def test_purchase_uses_current_price(app, client, user, create_products, sign_in):
+    apple, = create_products(prices=[100])
+    sign_in(client)
+    client.post(f'/purchase/{apple}')
+
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(db.update(Product.__table__).where(Product.__table__.c.id == apple).values(price=300))
+
+    client.post(f'/purchase/{apple}')
+    assert _stats(app) == {apple: (2, 400)}
+
+def test_rebuild(app, runner, user, create_products):
+    apple, banana = create_products(prices=[100, 250])
+    with app.app_context():
+        # 一括投入などで集計を通さずに追加された購入履歴
+        db.session.add_all([PurchaseTransaction(user_id=user, product_id=apple) for _ in range(3)])
+        db.session.add(PurchaseTransaction(user_id=user, product_id=banana))
+        db.session.add(ProductSalesStats(product_id=banana, count=10, revenue=1, last_purchased=db.func.now()))
+        db.session.commit()
+
+    result = runner.invoke(args=['sales', 'rebuild'])
+    assert result.exit_code == 0, result.output
+    assert 'Rebuilt sales stats for 2 products (4 purchases)' in result.output
+    assert _stats(app) == {apple: (3, 300), banana: (1, 250)}
+
+def test_sales_dashboard(app, client, user, create_products, sign_in):
+    apple, banana = create_products(prices=[100, 250])
+    sign_in(client)
+    client.post(f'/purchase/{banana}')
+    client.post(f'/purchase/{apple}')
+    client.post(f'/purchase/{apple}')
+
+    assert client.get('/sales').status_code == 403
+
+    app.config['ADMIN_EMAILS'] = ["test@gmail.com"]
+    response = client.get('/sales')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert '2商品、3件、合計450円' in body
+    # 販売数の多い順に表示される
+    assert body.index('product1') < body.index('product2')
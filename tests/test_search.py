@@ -0,0 +1,144 @@
+import threading
+import time
+import pytest
+from .. import db
+from ..models import Product
+from ..search import PrefixIndex, SearchResult
+
+NAMES = ["apple juice", "apple pie", "pineapple", "green apple", "banana"]
+
+# 全文検索のインデックスは PostgreSQL の tsvector を使う
+def _require_postgresql(app):
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            pytest.skip('Full-text search requires PostgreSQL')
+
+def test_search(app, client, user, create_products, sign_in):
+    _require_postgresql(app)
+    create_products(names=NAMES)
+    sign_in(client)
+
+    response = client.get('/products/search?q=app')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    # 単語の前方一致なので pineapple は含まれない
+    for name in ["apple juice", "apple pie", "green apple"]:
+        assert name in body
+    assert "pineapple" not in body
+    assert "banana" not in body
+
+    body = client.get('/products/search?q=apple+ju').get_data(as_text=True)
+    assert "apple juice" in body
+    assert "apple pie" not in body
+
+def test_search_pagination(app, client, user, create_products, sign_in):
+    _require_postgresql(app)
+    app.config['SEARCH_PER_PAGE'] = 2
+    create_products(names=NAMES)
+    sign_in(client)
+
+    first = client.get('/products/search?q=apple').get_data(as_text=True)
+    second = client.get('/products/search?q=apple&page=2').get_data(as_text=True)
+    assert 'page=2' in first
+    assert 'page=3' not in second
+    found = [name for name in ["apple juice", "apple pie", "green apple"] if name in first + second]
+    assert len(found) == 3
+
+    assert client.get('/products/search?q=apple&page=0').status_code == 400
+    assert '該当する商品はありません' in client.get('/products/search?q=%25').get_data(as_text=True)
+
+def test_typeahead(app, client, user, create_products, sign_in):
+    create_products(names=NAMES)
+    sign_in(client)
+
+    response = client.get('/products/typeahead?q=Ap')
+    assert response.status_code == 200
+    assert [product['name'] for product in response.json] == ["apple juice", "apple pie", "green apple"]
+    assert set(response.json[0]) == {'id', 'name', 'price'}
+
+    # インデックスを作った後は、データベースに問い合わせずに返す
+    histogram = app.extensions['metrics'].get('http_request_sql_statements')
+    before = histogram.sum(endpoint='views.typeahead_products')
+    client.get('/products/typeahead?q=ban')
+    assert histogram.sum(endpoint='views.typeahead_products') == before
+
+def test_typeahead_rebuilt_after_change(app, client, user, create_products, sign_in):
+    create_products(names=NAMES)
+    sign_in(client)
+    assert client.get('/products/typeahead?q=cherry').json == []
+
+    with app.app_context():
+        db.session.add(Product(name="cherry", price=100))
+        db.session.commit()
+
+    # 作り直している間は古いインデックスで返す
+    assert client.get('/products/typeahead?q=cherry').json == []
+    app.extensions['search_index'].wait()
+    assert [product['name'] for product in client.get('/products/typeahead?q=cherry').json] == ["cherry"]
+
+# preload したマスタープロセスで作っておき、ワーカーの最初の入力補完では全件を読み込まない
+def test_warmup_builds_index(app, client, user, monkeypatch, create_products, sign_in):
+    from .. import search
+    from ..prefork import warmup
+    create_products(names=NAMES)
+    warmup(app)
+
+    monkeypatch.setattr(search, '_load_products', lambda: pytest.fail('products loaded in a request'))
+    sign_in(client)
+    assert [product['name'] for product in client.get('/products/typeahead?q=ban').json] == ["banana"]
+
+# 期限が切れても、商品の件数と最終更新日時が変わっていなければ全件を読み込み直さない
+def test_unchanged_version_skips_reload():
+    index = PrefixIndex(ttl=0)
+    index.ensure_built(lambda: [SearchResult(1, "apple", 100)], lambda: (1, 'v1'))
+
+    def fail():
+        raise AssertionError('products reloaded')
+
+    index.ensure_built(fail, lambda: (1, 'v1'))
+    index.wait()
+    assert not index._stale
+    assert [result.name for result in index.lookup("app", 10)] == ["apple"]
+
+    index.ensure_built(lambda: [SearchResult(2, "banana", 100)], lambda: (1, 'v2'))
+    index.wait()
+    assert [result.name for result in index.lookup("ban", 10)] == ["banana"]
+
+def test_change_during_rebuild_is_not_lost():
+    index = PrefixIndex()
+    index.ensure_built(lambda: [SearchResult(1, "apple", 100)])
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def load():
+        started.set()
+        release.wait()
+        return [SearchResult(1, "apple", 100)]
+
+    index.mark_stale()
+    index.ensure_built(load)
+    started.wait()
+    # 読み込み中に変更されても、古いインデックスで待たずに返す
+    assert [result.name for result in index.lookup("app", 10)] == ["apple"]
+    index.mark_stale()
+    release.set()
+    index.wait()
+
+    # 読み込み中の変更が残っているので、次の検索でもう一度作り直す
+    index.ensure_built(lambda: [SearchResult(2, "banana", 100)])
+    index.wait()
+    assert [result.name for result in index.lookup("ban", 10)] == ["banana"]
+
+def test_prefix_index_latency():
+    index = PrefixIndex()
+    index.build(SearchResult(i, f"product{i} color{i % 100}", i) for i in range(100000))
+
+    start = time.perf_counter()
+    for i in range(100):
+        results = index.lookup(f"product{i}", 10)
+    elapsed = (time.perf_counter() - start) / 100
+
+    assert len(results) == 10
+    assert [result.name for result in index.lookup("color15 product15", 10)][:1] == ["product15 color15"]
+    assert elapsed < 0.005
@@ -0,0 +1,68 @@
+from .. import db, passwords
+from ..models import Product, PurchaseTransaction, User
+from ..seed import bulk_load, generate_products
+
+def test_seed_generated(app, runner):
+    result = runner.invoke(args=['seed', 'users', '--count', '3', '--password', 'hogehoge'])
+    assert result.exit_code == 0, result.output
+    assert 'Loaded 3 users' in result.output
+
+    assert runner.invoke(args=['seed', 'products', '--count', '5', '--chunk-size', '2']).exit_code == 0
+    result = runner.invoke(args=['seed', 'transactions', '--count', '25', '--chunk-size', '10'])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        assert db.session.scalar(db.select(db.func.count(PurchaseTransaction.id))) == 25
+        user = db.session.execute(db.select(User).filter_by(email="user1@example.com")).scalar_one()
+        assert passwords.check("hogehoge", user.password)
+
+        # 続けて投入しても名前が重複せず、ORM からの INSERT も id が衝突しない
+        assert runner.invoke(args=['seed', 'products', '--count', '2']).exit_code == 0
+        db.session.add(Product(name="extra", price=1))
+        db.session.commit()
+        assert db.session.scalar(db.select(db.func.count(Product.id))) == 8
+
+def test_seed_from_files(app, runner, tmp_path):
+    users = tmp_path / 'users.csv'
+    users.write_text("name,email,password\nalice,alice@example.com,secret\n", encoding='utf8')
+    products = tmp_path / 'products.jsonl'
+    products.write_text('{"id": 10, "name": "apple", "price": 100}\n{"id": 11, "name": "banana", "price": 200}\n', encoding='utf8')
+
+    assert runner.invoke(args=['seed', 'users', '--file', str(users)]).exit_code == 0
+    assert runner.invoke(args=['seed', 'products', '--file', str(products)]).exit_code == 0
+
+    with app.app_context():
+        user_id = db.session.execute(db.select(User.id).filter_by(name="alice")).scalar_one()
+
+    transactions = tmp_path / 'transactions.csv'
+    transactions.write_text(
+        f"user_id,product_id,created\n{user_id},10,2024-04-01T10:00:00\n{user_id},11,\n",
+        encoding='utf8',
+    )
+    result = runner.invoke(args=['seed', 'transactions', '--file', str(transactions)])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        rows = db.session.execute(
+            db.select(PurchaseTransaction.product_id, PurchaseTransaction.created).order_by(PurchaseTransaction.product_id)
+        ).all()
+        assert [row.product_id for row in rows] == [10, 11]
+        assert rows[0].created.isoformat() == '2024-04-01T10:00:00'
+        assert rows[1].created is not None
+
+        # id を指定して投入した後も、シーケンスは続きから採番する
+        product = Product(name="cherry", price=300)
+        db.session.add(product)
+        db.session.commit()
+        assert product.id == 12
+
+def test_seed_transactions_requires_users(runner):
+    result = runner.invoke(args=['seed', 'transactions', '--count', '1'])
+    assert result.exit_code != 0
+    assert 'Seed users and products' in result.output
+
+def test_bulk_load_executemany(app):
+    with app.app_context():
+        loaded = bulk_load(Product.__table__, generate_products(7), chunk_size=3, use_copy=False)
+        assert loaded == 7
+        assert db.session.scalar(db.select(db.func.count(Product.id))) == 7
@@ -0,0 +1,178 @@
+from flask import session
+from ..sessions import CachedSessionStore, MemorySessionStore, serializer
+
+def _session_cookie(client):
+    return client.get_cookie('session')
+
+def test_cart_is_set(user, client):
+    with client.session_transaction() as sess:
+        sess['email'] = "test@gmail.com"
+
+    with client:
+        client.post('/add_cart', data={"product_id": "1"})
+        client.post('/add_cart', data={"product_id": "1"})
+        client.post('/add_cart', data={"product_id": "2"})
+        client.get('/sign_in')
+        assert session['cart'] == {"1", "2"}
+
+        client.post('/remove_cart', data={"product_id": "1"})
+        client.get('/sign_in')
+        assert session['cart'] == {"2"}
+
+def test_cookie_size_is_constant(user, client):
+    with client.session_transaction() as sess:
+        sess['email'] = "test@gmail.com"
+
+    client.post('/add_cart', data={"product_id": "1"})
+    cookie = _session_cookie(client).value
+    sid = cookie.partition('.')[0]
+
+    for product_id in range(2, 200):
+        client.post('/add_cart', data={"product_id": str(product_id)})
+
+    # 書き込みのたびに version だけが変わる
+    assert _session_cookie(client).value.partition('.')[0] == sid
+    assert len(_session_cookie(client).value) == len(cookie) == 43 + 1 + 11
+
+def test_unknown_session_id_starts_new_session(client):
+    client.set_cookie('session', 'x' * 43)
+
+    with client:
+        client.get('/sign_in')
+        assert 'email' not in session
+
+def test_memory_backend(app, user):
+    app.config['SESSION_BACKEND'] = 'memory'
+    from .. import server_sessions
+    server_sessions.init_app(app)
+    client = app.test_client()
+
+    with client.session_transaction() as sess:
+        sess['email'] = "test@gmail.com"
+
+    with client:
+        client.get('/sign_in')
+        assert session['email'] == "test@gmail.com"
+
+def test_set_serialization():
+    assert serializer.loads(serializer.dumps({'cart': {"1", "2"}})) == {'cart': {"1", "2"}}
+
+class CountingStore(MemorySessionStore):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def get(self, sid):
+        self.reads += 1
+        return super().get(sid)
+
+def test_cached_store_serves_hot_sessions_from_memory():
+    backend = CountingStore()
+    store = CachedSessionStore(backend, ttl=60)
+    store.set('sid', 'data', 3600, 'v1')
+
+    assert store.get('sid', 'v1') == 'data'
+    assert store.get('sid', 'v1') == 'data'
+    assert backend.reads == 0
+
+    store.delete('sid', 'v1')
+    assert store.get('sid', 'v1') is None
+    assert backend.reads == 1
+
+# 別のワーカーで書き込まれると Cookie の version が変わり、古いキャッシュは使われない
+def test_cached_store_misses_after_write_in_other_worker():
+    backend = CountingStore()
+    worker_a = CachedSessionStore(backend, ttl=60)
+    worker_b = CachedSessionStore(backend, ttl=60)
+    worker_a.set('sid', 'old', 3600, 'v1')
+    assert worker_b.get('sid', 'v1') == 'old'
+
+    worker_a.set('sid', 'new', 3600, 'v2')
+    assert worker_b.get('sid', 'v2') == 'new'
+
+def test_sign_in_rotates_session_id(app, client):
+    from .. import db
+    from ..models import User
+    from .. import passwords
+    with app.app_context():
+        db.session.add(User(name="test", email="test@gmail.com", password=passwords.hash("hogehoge")))
+        db.session.commit()
+
+    # サインイン前に作られたセッション (攻撃者が仕込んだものを想定)
+    with client.session_transaction() as sess:
+        sess['cart'] = {"1"}
+    planted = _session_cookie(client).value
+
+    client.post('/sign_in', data={"email": "test@gmail.com", "password": "hogehoge"})
+    signed_in = _session_cookie(client).value
+    assert signed_in.partition('.')[0] != planted.partition('.')[0]
+
+    # 事前に知られた sid ではサインイン後のセッションを使えない
+    other = app.test_client()
+    other.set_cookie('session', planted)
+    with other:
+        other.get('/sign_in')
+        assert 'email' not in session
+
+    client.post('/sign_out')
+    assert _session_cookie(client) is None or _session_cookie(client).value.partition('.')[0] != signed_in.partition('.')[0]
+
+def test_purge_removes_expired_sessions(app, runner):
+    from datetime import timedelta
+    from .. import db
+    from ..models import StoredSession
+    from ..sessions import _utcnow
+    with app.app_context():
+        db.session.add_all([
+            StoredSession(id='expired', data='{}', expires=_utcnow() - timedelta(seconds=1)),
+            StoredSession(id='active', data='{}', expires=_utcnow() + timedelta(hours=1)),
+        ])
+        db.session.commit()
+
+    result = runner.invoke(args=['sessions', 'purge'])
+    assert 'Purged 1 expired sessions' in result.output
+    with app.app_context():
+        assert db.session.execute(db.select(StoredSession.id)).scalars().all() == ['active']
+
+# サインイン前のフォームの表示ではセッションの行を作らず、CSRF トークンは署名付きの Cookie に入れる
+def test_anonymous_sessions_are_not_stored(app, user):
+    import re
+    from .. import db, passwords
+    from ..models import StoredSession, User
+    app.config['WTF_CSRF_ENABLED'] = True
+    with app.app_context():
+        db.session.get(User, user).password = passwords.hash("hogehoge")
+        db.session.commit()
+
+    for _ in range(5):
+        client = app.test_client()
+        response = client.get('/sign_in')
+        assert _session_cookie(client).value.startswith('~')
+    with app.app_context():
+        assert db.session.execute(db.select(db.func.count()).select_from(StoredSession)).scalar_one() == 0
+
+    # 改ざんした Cookie は読み込まない
+    value = _session_cookie(client).value
+    assert app.session_interface.open_signed_session(app, value)['csrf_token']
+    tampered = app.session_interface.open_signed_session(app, value[:-2] + ('AA' if value[-2:] != 'AA' else 'BB'))
+    assert not tampered and not tampered.signed
+
+    token = re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', response.data).group(1).decode()
+    response = client.post('/sign_in', data={"email": "test@gmail.com", "password": "hogehoge", "csrf_token": token})
+    assert response.status_code == 302
+    assert len(_session_cookie(client).value) == 43 + 1 + 11
+    with app.app_context():
+        assert db.session.execute(db.select(db.func.count()).select_from(StoredSession)).scalar_one() == 1
+
+def test_new_sessions_purge_expired_sessions(app):
+    from datetime import timedelta
+    from .. import db
+    from ..models import StoredSession
+    from ..sessions import SQLAlchemySessionStore, _utcnow
+    with app.app_context():
+        db.session.add(StoredSession(id='expired', data='{}', expires=_utcnow() - timedelta(seconds=1)))
+        db.session.commit()
+
+        store = SQLAlchemySessionStore(db, purge_probability=1.0)
+        store.set('active', '{}', 3600)
+        assert db.session.execute(db.select(StoredSession.id)).scalars().all() == ['active']
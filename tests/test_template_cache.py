@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+from .. import create_app
+
+PACKAGE = __package__.rpartition('.')[0]
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def test_compile_populates_bytecode_cache(runner, tmp_path):
+    result = runner.invoke(args=['templates', 'compile', '--directory', str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    assert "Compiled" in result.output
+    assert list(tmp_path.glob('__jinja2_*.cache'))
+
+def test_templates_are_loaded_from_bytecode_cache(runner, tmp_path, monkeypatch):
+    runner.invoke(args=['templates', 'compile', '--directory', str(tmp_path)])
+
+    monkeypatch.setenv('TEMPLATE_CACHE_DIR', str(tmp_path))
+    app = create_app()
+
+    def compile(*args, **kwargs):
+        raise AssertionError('template was compiled')
+
+    monkeypatch.setattr(app.jinja_env, 'compile', compile)
+    with app.test_request_context():
+        assert app.jinja_env.get_template('products.html')
+
+def test_compile_requires_directory(runner):
+    result = runner.invoke(args=['templates', 'compile'])
+    assert result.exit_code != 0
+    assert "TEMPLATE_CACHE_DIR" in result.output
+
+def test_heavy_modules_are_imported_lazily():
+    code = f"import sys; from {PACKAGE} import create_app; create_app(); print(sorted({{'flask_migrate', 'alembic', 'bcrypt'}} & set(sys.modules)))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    assert output.strip().splitlines()[-1] == '[]'
+
+def test_migrate_commands_are_loaded_on_demand(runner):
+    directory = os.path.join(ROOT, PACKAGE, 'migrations')
+    result = runner.invoke(args=['db', '--directory', directory, 'heads'])
+    assert result.exit_code == 0, result.output
+    assert "(head)" in result.output
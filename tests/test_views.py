@@ -1,7 +1,8 @@
-from flask import session
+from flask import session, template_rendered
+from sqlalchemy import event
 from .. import db
 import bcrypt
-from ..models import User
+from ..models import User, Product, PurchaseTransaction
 
 # サインアップテスト
 def test_sign_up_get(client):
@@ -73,7 +74,7 @@ def test_sign_in_post(app, client):
         assert response.status_code == 302
         assert session.get('email') == email
 
-def test_sign_in_user_already_signed_in(client):
+def test_sign_in_user_already_signed_in(user, client):
     email = "test@gmail.com"
     password = "hogehoge"
 
@@ -119,7 +120,7 @@ def test_sign_in_user_does_not_exist(app, client):
         assert session.get('email') is None
 
 # サインアウトテスト　
-def test_sign_out_post(client):
+def test_sign_out_post(user, client):
     email = "test@gmail.com"
 
     with client.session_transaction() as session:
@@ -127,3 +128,289 @@ def test_sign_out_post(client):
 
     response = client.post('/sign_out')
     assert response.status_code == 302
+
+# 商品一覧テスト
+def test_products_not_signed_in(client):
+    response = client.get('/products')
+    assert response.status_code == 302
+
+def test_products_keyset_pagination(app, user, client):
+    app.config['PRODUCTS_PER_PAGE'] = 2
+
+    with app.app_context():
+        db.session.add_all([Product(name=f"product{i}", price=i * 100) for i in range(1, 6)])
+        db.session.commit()
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    response = client.get('/products')
+    assert response.status_code == 200
+    assert b'product1' in response.data
+    assert b'product2' in response.data
+    assert b'product3' not in response.data
+    assert b'after=2' in response.data
+    assert b'before=' not in response.data
+
+    response = client.get('/products?after=2')
+    assert b'product3' in response.data
+    assert b'product4' in response.data
+    assert b'before=3' in response.data
+    assert b'after=4' in response.data
+
+    response = client.get('/products?after=4')
+    assert b'product5' in response.data
+    assert b'after=' not in response.data
+
+    response = client.get('/products?before=3')
+    assert b'product1' in response.data
+    assert b'product2' in response.data
+    assert b'before=' not in response.data
+    assert b'after=2' in response.data
+
+# 購入履歴テスト
+def _count_statements(app, func):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        func()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return len(statements)
+
+def _create_transactions(app, email, count):
+    with app.app_context():
+        user = User(name=email.split('@')[0], email=email, password=f"{email}-password")
+        products = [Product(name=f"product{i}", price=i * 100) for i in range(count)]
+        db.session.add_all([PurchaseTransaction(user=user, product=product) for product in products])
+        db.session.commit()
+
+def test_transactions_scoped_to_signed_in_user(app, client):
+    _create_transactions(app, "test@gmail.com", 2)
+    _create_transactions(app, "other@gmail.com", 1)
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    response = client.get('/transactions')
+    assert response.status_code == 200
+    assert response.data.count('を購入しました。'.encode('utf8')) == 2
+
+def test_transactions_pagination(app, client):
+    app.config['TRANSACTIONS_PER_PAGE'] = 2
+    _create_transactions(app, "test@gmail.com", 3)
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    response = client.get('/transactions')
+    assert response.data.count('を購入しました。'.encode('utf8')) == 2
+    assert b'before=' in response.data
+
+    cursor = response.data.split(b'before=')[1].split(b'"')[0].decode('utf8')
+    response = client.get(f'/transactions?before={cursor}')
+    assert response.data.count('を購入しました。'.encode('utf8')) == 1
+    assert b'before=' not in response.data
+
+def test_transactions_invalid_cursor(app, client):
+    _create_transactions(app, "test@gmail.com", 1)
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    response = client.get('/transactions?before=foo')
+    assert response.status_code == 400
+
+def test_transactions_query_count_is_constant(app, client):
+    _create_transactions(app, "test@gmail.com", 2)
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    # 最初のリクエストでユーザー情報がキャッシュされる
+    client.get('/transactions')
+    few = _count_statements(app, lambda: client.get('/transactions'))
+
+    with app.app_context():
+        user = db.session.execute(db.select(User).filter_by(email="test@gmail.com")).scalar_one()
+        db.session.add_all([PurchaseTransaction(user=user, product=Product(name=f"extra{i}", price=i)) for i in range(10)])
+        db.session.commit()
+
+    many = _count_statements(app, lambda: client.get('/transactions'))
+    assert few == many == 1
+
+# 一括購入テスト
+def _create_cart(app, email, count):
+    with app.app_context():
+        db.session.add(User(name=email.split('@')[0], email=email, password=f"{email}-password"))
+        products = [Product(name=f"product{i}", price=i * 100) for i in range(count)]
+        db.session.add_all(products)
+        db.session.commit()
+        return [str(product.id) for product in products]
+
+def test_checkout(app, client):
+    cart = _create_cart(app, "test@gmail.com", 3)
+
+    with client.session_transaction() as sess:
+        sess['email'] = "test@gmail.com"
+        sess['cart'] = cart
+
+    with client:
+        response = client.post('/checkout')
+        assert response.status_code == 200
+        assert 'cart' not in session
+
+    with app.app_context():
+        user = db.session.execute(db.select(User).filter_by(email="test@gmail.com")).scalar_one()
+        assert sorted(str(t.product_id) for t in user.purchase_transactions) == sorted(cart)
+
+def test_checkout_empty_cart(client, user):
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    response = client.post('/checkout')
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/cart')
+
+def test_checkout_query_count_is_constant(app, client):
+    few = _create_cart(app, "test@gmail.com", 1)
+    many = _create_cart(app, "test2@gmail.com", 10)
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+        session['cart'] = few
+    few_count = _count_statements(app, lambda: client.post('/checkout'))
+
+    with client.session_transaction() as session:
+        session['email'] = "test2@gmail.com"
+        session['cart'] = many
+    many_count = _count_statements(app, lambda: client.post('/checkout'))
+
+    assert few_count == many_count
+
+# ログインユーザーのキャッシュテスト
+def test_current_user_is_cached(app, user, client):
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    client.get('/cart')
+    assert _count_statements(app, lambda: client.get('/cart')) == 0
+
+def test_current_user_cache_invalidated_on_update(app, user, client):
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    client.get('/cart')
+
+    with app.app_context():
+        db.session.get(User, user).name = "renamed"
+        db.session.commit()
+        assert user not in app.extensions['user_cache']
+
+    assert _count_statements(app, lambda: client.get('/cart')) == 1
+
+def test_deleted_user_is_signed_out(app, user, client):
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    client.get('/cart')
+
+    with app.app_context():
+        db.session.delete(db.session.get(User, user))
+        db.session.commit()
+
+    response = client.get('/cart', follow_redirects=True)
+    assert response.status_code == 200
+    assert response.request.path == '/sign_in'
+    assert b'name="password"' in response.data
+    with client.session_transaction() as session:
+        assert 'email' not in session
+
+def test_purchase_uses_signed_in_user(app, user, client):
+    with app.app_context():
+        product = Product(name="product", price=100)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    response = client.post(f'/purchase/{product_id}')
+    assert response.status_code == 200
+
+    with app.app_context():
+        transaction = db.session.execute(db.select(PurchaseTransaction)).scalar_one()
+        assert transaction.user_id == user
+
+# 条件付きリクエストテスト
+def _rendered_templates(app, func):
+    templates = []
+
+    def record(sender, template, context, **extra):
+        templates.append(template.name)
+
+    with template_rendered.connected_to(record, app):
+        response = func()
+    return response, templates
+
+def test_products_not_modified(app, user, client):
+    with app.app_context():
+        db.session.add(Product(name="product", price=100))
+        db.session.commit()
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    response = client.get('/products')
+    assert response.status_code == 200
+    assert response.headers['ETag'].startswith('W/')
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    assert 'Last-Modified' in response.headers
+    etag = response.headers['ETag']
+
+    response, templates = _rendered_templates(app, lambda: client.get('/products', headers={'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert templates == []
+    assert _count_statements(app, lambda: client.get('/products', headers={'If-None-Match': etag})) == 1
+
+    with app.app_context():
+        db.session.execute(db.select(Product)).scalar_one().price = 200
+        db.session.commit()
+
+    response = client.get('/products', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_product_not_modified(app, user, client):
+    with app.app_context():
+        product = Product(name="product", price=100)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+    with client.session_transaction() as session:
+        session['email'] = "test@gmail.com"
+
+    response = client.get(f'/products/{product_id}')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+
+    response, templates = _rendered_templates(app, lambda: client.get(f'/products/{product_id}', headers={'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert templates == []
+
+    client.post('/add_cart', data={"product_id": str(product_id)})
+    response = client.get(f'/products/{product_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+    # 商品は更新されていないが、カートの状態が変わっているので If-Modified-Since だけでは 304 を返さない
+    response = client.get(f'/products/{product_id}', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert b'action="/add_cart"' not in response.data
@@ -1,16 +1,36 @@
-from flask import Blueprint, render_template, session, request, redirect, url_for
-import bcrypt
-from werkzeug.exceptions import Unauthorized, NotFound, InternalServerError
+from flask import Blueprint, Response, render_template, make_response, session, request, redirect, url_for, current_app, g, jsonify, stream_with_context
+from flask_wtf.csrf import generate_csrf
+import time
+from werkzeug.exceptions import HTTPException, BadRequest, Unauthorized, Forbidden, NotFound, InternalServerError, ServiceUnavailable
 from .forms import SignUpForm, SignInForm, SignOutForm
-from .models import User, Product, PurchaseTransaction
-from . import db
+from .models import User
+from .queries import fetch_product_page, page_last_modified, fetch_transaction_page, decode_transaction_cursor
+from .cart import cart_product_ids
+from .http_cache import make_etag, add_validators, not_modified
+from .auth import sign_in_user, sign_out_user
+from .product_cache import get_product, get_products
+from .replicas import read_only
+from .exports import FORMATS, iter_export, iter_gzip, is_admin
+from .sales import best_sellers, sales_totals
+from .purchases import COMPLETED, find_purchase, submit_purchase, get_purchase_status, parse_idempotency_key
+from .search import search_products, typeahead
+from .ratelimit import rate_limit
+from . import db, passwords
 
 bp = Blueprint("views", __name__)
 
+# ページにはセッションごとの CSRF トークンが含まれるため、ユーザーとトークンの有効期間ごとに ETag を分ける
+def _page_etag(*parts):
+    generate_csrf()
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 0
+    period = int(time.time() // (time_limit / 2)) if time_limit else 0
+    return make_etag(g.user.id, session.get('csrf_token'), period, *parts)
+
 @bp.route("/sign_up", methods=('GET', 'POST'))
+@rate_limit()
 def sign_up():
     try:
-        if 'email' in session:
+        if g.user:
             return redirect(url_for('views.products'))
 
         form = SignUpForm(request.form)
@@ -18,22 +38,24 @@ def sign_up():
             name = form.name.data
             email = form.email.data
             password = form.password.data
-            salt = bcrypt.gensalt(rounds=12, prefix=b'2b')
-            hashpw = bcrypt.hashpw(password.encode('utf8'), salt)
-            user = User(name=name, email=email, password=hashpw.decode('utf8'))
+            hashpw = passwords.hash(password)
+            user = User(name=name, email=email, password=hashpw)
             db.session.add(user)
             db.session.commit()
-            session['email'] = user.email
+            sign_in_user(user)
             return redirect(url_for('views.products'))
 
         return render_template('sign_up.html', form=form)
+    except ServiceUnavailable:
+        raise
     except Exception as e:
         return render_template('sign_up.html', form=form, e=e)
 
 @bp.route("/sign_in", methods=('GET', 'POST'))
+@rate_limit()
 def sign_in():
     try:
-        if 'email' in session:
+        if g.user:
             return redirect(url_for('views.products'))
 
         form = SignInForm(request.form)
@@ -45,13 +67,15 @@ def sign_in():
             if user is None:
                 raise Unauthorized
 
-            if bcrypt.checkpw(password.encode('utf8'), user.password.encode('utf8')):
-                session['email'] = user.email
+            if passwords.check(password, user.password):
+                sign_in_user(user)
                 return redirect(url_for('views.products'))
             else:
                 raise Unauthorized
 
         return render_template('sign_in.html', form=form)
+    except ServiceUnavailable:
+        raise
     except Exception as e:
         return render_template('sign_in.html', form=form, e=e)
 
@@ -59,81 +83,234 @@ def sign_in():
 def sign_out():
     try:
         if 'email' in session:
-            session.pop('email', None)
+            sign_out_user()
             return redirect(url_for('views.sign_in'))
 
         form = SignOutForm(request.form)
-        products = db.session.query(Product).all()
-        return render_template('products.html', products=products, form=form)
+        page = fetch_product_page(per_page=current_app.config['PRODUCTS_PER_PAGE'])
+        return render_template('products.html', products=page.items, page=page, form=form)
     except Exception as e:
         raise InternalServerError from e
 
 @bp.route("/products")
+@read_only
 def products():
-    if 'email' in session:
-        form = SignOutForm(request.form)
-        products = db.session.query(Product).all()
-        return render_template('products.html', products=products, form=form)
+    if g.user:
+        after, before = product_cursors()
+        page = fetch_product_page(after=after, before=before, per_page=current_app.config['PRODUCTS_PER_PAGE'])
+        return products_response(page)
 
     return redirect(url_for('views.sign_in'))
 
+def product_cursors():
+    return request.args.get('after', type=int), request.args.get('before', type=int)
+
+# ページの取得以外は ASGI のエントリポイント (asgi.py) の非同期ビューと共通にする
+def products_response(page):
+    # ETag はページの行 (id, updated) とカーソルから作るので、削除や追加も検知できる
+    updated = page_last_modified(page)
+    version = [(row.id, row.updated) for row in page.items]
+    etag = _page_etag('products', version, page.prev_cursor, page.next_cursor)
+    response = not_modified(etag, updated)
+    if response:
+        return response
+
+    # 商品の一覧部分はユーザーによらず同じなので、行の更新日時をバージョンにしてキャッシュする
+    form = SignOutForm(request.form)
+    response = make_response(render_template('products.html', products=page.items, page=page, version=version, form=form))
+    return add_validators(response, etag, updated)
+
 @bp.route("/transactions")
+@read_only
 def transactions():
-    if 'email' in session:
-        purchase_transactions = db.session.query(PurchaseTransaction).all()
-        return render_template('transactions.html', transactions=purchase_transactions)
+    if g.user:
+        page = fetch_transaction_page(
+            g.user.id,
+            before=transaction_cursor(),
+            per_page=current_app.config['TRANSACTIONS_PER_PAGE'],
+        )
+        return transactions_response(page)
+
+    return redirect(url_for('views.sign_in'))
+
+def transaction_cursor():
+    if 'before' not in request.args:
+        return None
+    try:
+        return decode_transaction_cursor(request.args['before'])
+    except ValueError as e:
+        raise BadRequest from e
+
+def transactions_response(page):
+    return render_template('transactions.html', transactions=page.items, page=page)
+
+@bp.route("/products/search")
+@read_only
+def search():
+    if g.user:
+        q = request.args.get('q', '')
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            raise BadRequest
+
+        results, has_next = search_products(q, page=page, per_page=current_app.config['SEARCH_PER_PAGE'])
+        return render_template('search.html', q=q, results=results, page=page, has_next=has_next)
+
+    return redirect(url_for('views.sign_in'))
+
+# 入力補完はメモリ上のインデックスから返し、データベースには問い合わせない
+@bp.route("/products/typeahead")
+@read_only
+def typeahead_products():
+    if g.user:
+        results = typeahead(request.args.get('q', ''), current_app.config['TYPEAHEAD_LIMIT'])
+        return jsonify([result._asdict() for result in results])
+
+    return redirect(url_for('views.sign_in'))
+
+# 書き出しは行数に関係なく一定のメモリで返せるよう、ジェネレーターでストリーミングする
+def _export_response(fmt, filename, user_id=None):
+    if fmt not in FORMATS:
+        raise NotFound
+
+    chunks = iter_export(fmt, user_id)
+    headers = {'Content-Disposition': f'attachment; filename={filename}.{fmt}', 'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.accept_encodings:
+        chunks = iter_gzip(chunks)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(stream_with_context(chunks), mimetype=FORMATS[fmt], headers=headers)
+
+@bp.route("/transactions/export.<fmt>")
+def export_transactions(fmt):
+    if g.user:
+        return _export_response(fmt, 'transactions', user_id=g.user.id)
+
+    return redirect(url_for('views.sign_in'))
+
+@bp.route("/admin/transactions/export.<fmt>")
+def export_all_transactions(fmt):
+    if g.user:
+        if not is_admin(g.user):
+            raise Forbidden
+        return _export_response(fmt, 'all_transactions')
+
+    return redirect(url_for('views.sign_in'))
+
+# 売上は集計テーブルから読むため、購入履歴の件数に関係なく商品数に比例する時間で表示できる
+@bp.route("/sales")
+@read_only
+def sales():
+    if g.user:
+        if not is_admin(g.user):
+            raise Forbidden
+        return render_template(
+            'sales.html',
+            best_sellers=best_sellers(current_app.config['BEST_SELLERS_LIMIT']),
+            totals=sales_totals(),
+        )
 
     return redirect(url_for('views.sign_in'))
 
-@bp.route("/products/<product_id>")
+@bp.route("/products/<int:product_id>")
+@read_only
 def product(product_id):
-    if 'email' in session:
-        product = db.session.execute(db.select(Product).filter_by(id=product_id)).scalar_one()
+    if g.user:
+        product = get_product(product_id)
 
         if product is None:
             raise NotFound
 
         in_cart = False
-        if 'cart' in session and product_id in session['cart']:
+        if 'cart' in session and str(product_id) in session['cart']:
             in_cart = True
 
-        return render_template('products.html', product=product, in_cart=in_cart)
+        etag = _page_etag('product', product.id, product.updated, in_cart)
+        response = not_modified(etag, product.updated)
+        if response:
+            return response
+
+        form = SignOutForm(request.form)
+        response = make_response(render_template('products.html', product=product, in_cart=in_cart, form=form))
+        return add_validators(response, etag, product.updated)
 
     return redirect(url_for('views.sign_in'))
 
-@bp.post("/purchase/<product_id>")
+# 非同期モードで受け付けた場合は、処理状況のページへ移動する
+def _purchase_response(result):
+    if result.status != COMPLETED:
+        return redirect(url_for('views.purchase_status', request_id=result.id), code=303)
+
+    return render_template('success.html', products=get_products(result.product_ids))
+
+@bp.post("/purchase/<int:product_id>")
 def purchase(product_id):
     try:
-        if 'email' in session:
-            user = db.session.execute(db.select(User).filter_by(id=2)).scalar_one()
-            product = db.session.execute(db.select(Product).filter_by(id=product_id)).scalar_one()
+        if g.user:
+            product = get_product(product_id)
 
-            if user and product:
-                purchase_transaction = PurchaseTransaction(user=user, product=product)
-                db.session.add(purchase_transaction)
-                db.session.commit()
-            else:
+            if not product:
                 raise NotFound
 
-            return render_template('success.html', product=product)
+            result = submit_purchase(g.user.id, [product], parse_idempotency_key(request.form.get('idempotency_key')))
+            return _purchase_response(result)
 
         return redirect(url_for('views.sign_in'))
+    except HTTPException:
+        raise
     except Exception as e:
         raise InternalServerError from e
 
-@bp.post('/add_cart')
-def add_cart():
+@bp.post('/checkout')
+def checkout():
     try:
-        if 'email' in session:
-            cart_items = []
+        if g.user:
+            key = parse_idempotency_key(request.form.get('idempotency_key'))
+            result = find_purchase(g.user.id, key)
+            if result is not None:
+                return _purchase_response(result)
 
-            if 'cart' in session:
-                cart_items = session['cart']
+            cart_items = cart_product_ids()
+
+            if not cart_items:
+                return redirect(url_for('views.cart'))
+
+            products = get_products(cart_items)
+
+            if not products:
+                raise NotFound
+
+            result = submit_purchase(g.user.id, products, key)
+            session.pop('cart', None)
 
-            if request.form['product_id'] not in cart_items:
-                cart_items.append(request.form['product_id'])
+            return _purchase_response(result)
 
-            session['cart'] = cart_items
+        return redirect(url_for('views.sign_in'))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise InternalServerError from e
+
+@bp.route("/purchases/<int:request_id>")
+def purchase_status(request_id):
+    if g.user:
+        result = get_purchase_status(g.user.id, request_id)
+
+        if result is None:
+            raise NotFound
+
+        products = get_products(result.product_ids) if result.status == COMPLETED else []
+        return render_template('purchase_status.html', result=result, products=products)
+
+    return redirect(url_for('views.sign_in'))
+
+@bp.post('/add_cart')
+def add_cart():
+    try:
+        if g.user:
+            # カートは set で保持し、重複チェックを O(1) で行う
+            session.setdefault('cart', set()).add(request.form['product_id'])
+            session.modified = True
             return redirect(url_for('views.cart'))
 
         return redirect(url_for('views.sign_in'))
@@ -143,12 +320,11 @@ def add_cart():
 @bp.post('/remove_cart')
 def remove_cart():
     try:
-        if 'email' in session:
+        if g.user:
 
             if 'cart' in session:
-                cart_items = session['cart']
-                cart_items.remove(request.form['product_id'])
-                session['cart'] = cart_items
+                session['cart'].discard(request.form['product_id'])
+                session.modified = True
 
             return redirect(url_for('views.cart'))
 
@@ -157,13 +333,13 @@ def remove_cart():
         raise InternalServerError from e
 
 @bp.route("/cart")
+@read_only
 def cart():
-    if 'email' in session:
+    if g.user:
         products = []
 
         if 'cart' in session:
-            cart_items = session['cart']
-            products = db.session.query(Product).filter(Product.id.in_(cart_items)).all()
+            products = get_products(cart_product_ids())
 
         return render_template('cart.html', products=products)
 